@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+'''compare the serialization codecs available for hub connections
+
+first each codec encodes and decodes a few representative frames on its own,
+request and publish bodies packed into bytes inside them the way hubs and
+clients send them, then a hub fires the same RPC workload at another one over
+a connection using each codec in turn, reporting the requests per second.
+'''
+
+import sys
+import time
+import traceback
+
+import junction
+from junction.core import backend, codecs, const, dispatch
+
+HOST = "127.0.0.1"
+PORT = 9400
+
+SERVICE = 1
+
+ROUNDS = 20000
+REQUESTS = 5000
+CONCURRENCY = 16
+
+RECORD = {"id": 17, "name": "somebody", "tags": ["a", "b", "c"],
+        "scores": [1.5, 2.5, 3.5], "active": True, "parent": None}
+
+# (label, msg_type, leading fields, packed (args, kwargs) body or None)
+PAYLOADS = [
+    ("small request", const.MSG_TYPE_RPC_REQUEST, (1, SERVICE, 17, "get"),
+        ((17,), {})),
+    ("record publish", const.MSG_TYPE_PUBLISH, (SERVICE, 17, "update"),
+        ((RECORD,), {})),
+    ("record response", const.MSG_TYPE_RPC_RESPONSE, (1, 0, RECORD), None),
+    ("10k list response", const.MSG_TYPE_RPC_RESPONSE,
+        (1, 0, range(10000)), None),
+]
+
+
+def codec_throughput(codec, payload, rounds):
+    label, msg_type, fields, body = payload
+    start = time.time()
+    for i in xrange(rounds):
+        msg = fields
+        if body is not None:
+            msg += dispatch.pack(body[0], body[1], codec)
+        data = codec.dumps((msg_type, msg))
+    dumped = time.time()
+    for i in xrange(rounds):
+        msg = codec.loads(data)[1]
+        if body is not None:
+            dispatch.unpack(*msg[-2:])
+    loaded = time.time()
+    return rounds / (dumped - start), rounds / (loaded - dumped), len(data)
+
+
+def worker(hub, count, done):
+    for i in xrange(count):
+        hub.rpc(SERVICE, 0, "echo", ({"i": i, "xs": [i] * 10},))
+    done.append(None)
+
+
+def rpc_throughput(name, port, server):
+    hub = junction.Hub((HOST, port), [server], codecs=[name])
+    hub.start()
+    hub.wait_connected()
+    backend.pause_for(0.1)
+
+    done = []
+    start = time.time()
+    for i in xrange(CONCURRENCY):
+        backend.schedule(worker, args=(hub, REQUESTS // CONCURRENCY, done))
+    while len(done) < CONCURRENCY:
+        backend.pause_for(0.01)
+    elapsed = time.time() - start
+
+    hub.shutdown()
+    return REQUESTS / elapsed
+
+
+def main():
+    backend.handle_exception = traceback.print_exception
+
+    names = sys.argv[1:] or codecs.CODECS.keys()
+
+    for payload in PAYLOADS:
+        rounds = ROUNDS if len(repr(payload)) < 1000 else ROUNDS // 100
+        print payload[0]
+        for name in names:
+            dumps, loads, size = codec_throughput(
+                    codecs.CODECS[name], payload, rounds)
+            print "  %-8s %10.0f dumps/s %10.0f loads/s %8d bytes" % (
+                    name, dumps, loads, size)
+
+    server = junction.Hub((HOST, PORT), [], codecs=names)
+    server.start()
+
+    @server.accept_rpc(SERVICE, 0, 0, "echo")
+    def echo(x):
+        return x
+
+    print "rpc round trips"
+    for i, name in enumerate(names):
+        print "  %-8s %10.0f rpcs/s" % (
+                name, rpc_throughput(name, PORT + 2 * (i + 1), server.addr))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
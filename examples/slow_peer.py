@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+'''compare selection strategies for singular RPCs when one peer is slow
+
+four hubs serve the same RPC, one of them taking much longer than the rest
+(as if it were GC-pausing or on a saturated host). a sending hub is created
+for each selection strategy and fires the same workload at them, reporting
+the response latency percentiles it saw.
+'''
+
+import sys
+import time
+import traceback
+
+import junction
+from junction.core import backend
+
+HOST = "127.0.0.1"
+PORT = 9300
+
+SERVICE = 1
+
+SERVERS = 4
+FAST = 0.001
+SLOW = 0.03
+
+REQUESTS = 2000
+CONCURRENCY = 16
+
+STRATEGIES = ["random", "least_outstanding", "p2c"]
+
+
+def serve(port, delay):
+    hub = junction.Hub((HOST, port), [])
+    hub.start()
+
+    @hub.accept_rpc(SERVICE, 0, 0, "work")
+    def work(x):
+        backend.pause_for(delay)
+        return x
+
+    return hub
+
+
+def worker(hub, count, latencies, done):
+    for i in xrange(count):
+        start = time.time()
+        hub.rpc(SERVICE, 0, "work", (i,))
+        latencies.append(time.time() - start)
+    done.append(None)
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+def run(strategy, port, servers):
+    hub = junction.Hub((HOST, port), servers, selection=strategy)
+    hub.start()
+    hub.wait_connected()
+    backend.pause_for(0.1)
+
+    latencies, done = [], []
+    for i in xrange(CONCURRENCY):
+        backend.schedule(worker,
+                args=(hub, REQUESTS // CONCURRENCY, latencies, done))
+    while len(done) < CONCURRENCY:
+        backend.pause_for(0.01)
+
+    hub.shutdown()
+
+    latencies.sort()
+    print "%-18s p50 %6.1fms  p90 %6.1fms  p99 %6.1fms  max %6.1fms" % (
+            strategy,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 90) * 1000,
+            percentile(latencies, 99) * 1000,
+            latencies[-1] * 1000)
+
+
+def main():
+    backend.handle_exception = traceback.print_exception
+
+    servers = []
+    for i in xrange(SERVERS):
+        servers.append(serve(PORT + i, SLOW if i == 0 else FAST).addr)
+
+    strategies = sys.argv[1:] or STRATEGIES
+    for i, strategy in enumerate(strategies):
+        run(strategy, PORT + SERVERS + i, servers)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,7 @@ import logging
 import sys
 
 from .hub import Hub
-from .client import Client
+from .client import Client, PooledClient
 from .core.backend import \
         activate_greenhouse, activate_gevent, activate_eventlet
 from .futures import Future, after, wait_any, wait_all
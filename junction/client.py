@@ -2,21 +2,51 @@ from __future__ import absolute_import
 
 import collections
 import logging
+import random
+import time
 import weakref
 
 from . import errors, futures
-from .core import backend, connection, const, dispatch, rpc
+from .core import backend, cache, connection, const, dispatch, rpc
 
 
 log = logging.getLogger("junction.client")
 
 
 class Client(object):
-    "A junction client without the server"
-    def __init__(self, addrs):
+    '''A junction client without the server
+
+    :param addrs:
+        the ``(host, port)`` address(es) of the hubs to proxy through, tried
+        in turn as connections fail
+    :type addrs: tuple or list of tuples
+    :param standbys:
+        the number of further connections to keep established to hubs from
+        ``addrs``, so that when the current one fails the client switches
+        over right away, re-sending its pending idempotent RPCs
+    :type standbys: int
+    :param direct:
+        if ``True``, follow the proxying hub's routing table and connect
+        straight to the other hubs handling RPCs (reconnecting with backoff
+        when those connections fail), sending singular RPCs to them directly
+        rather than through the proxy whenever such a connection is up
+    :type direct: bool
+    :param codecs:
+        the names of the serialization codecs the client's connections may
+        use, in order of preference (see :class:`Hub <junction.hub.Hub>`)
+    :type codecs: list of strings or None
+    '''
+    def __init__(self, addrs, standbys=0, direct=False, codecs=None):
+        self._codecs = codecs
         self._rpc_client = rpc.ProxiedClient(self)
-        self._dispatcher = dispatch.Dispatcher(self._rpc_client, None)
+        self._dispatcher = self._new_dispatcher(self._rpc_client)
         self._peer = None
+        self._standby_count = standbys
+        self._standbys = []
+        self._direct = direct
+        self._direct_client = rpc.DirectClient()
+        self._direct_peers = {}
+        self._routes = []
 
         # allow just a single (host, port) pair
         if (isinstance(addrs, tuple) and
@@ -26,6 +56,9 @@ class Client(object):
             addrs = [addrs]
         self._addrs = collections.deque(addrs)
 
+    def _new_dispatcher(self, rpc_client):
+        return dispatch.Dispatcher(rpc_client, None, codec_names=self._codecs)
+
     def connect(self):
         "Initiate the connection to a proxying hub"
         log.info("connecting")
@@ -36,6 +69,91 @@ class Client(object):
                 None, self._dispatcher, self._addrs.popleft(),
                 backend.Socket(), reconnect=False)
         self._peer.start()
+        if self._direct:
+            self._peer.push((const.MSG_TYPE_PROXY_WATCH_ROUTES, ()))
+
+        while len(self._standbys) < self._standby_count and self._addrs:
+            self._connect_standby()
+
+    def _connect_standby(self):
+        # every standby gets a dispatcher of its own, as the client's
+        # dispatcher only ever knows about the one peer
+        peer = connection.Peer(
+                None, self._new_dispatcher(self._rpc_client),
+                self._addrs.popleft(), backend.Socket(), reconnect=False)
+        self._standbys.append(peer)
+        peer.start()
+
+    def _lost_standby(self, peer):
+        if peer in self._standbys:
+            self._standbys.remove(peer)
+            self._addrs.append(peer.addr)
+
+    def _failover(self):
+        # switch over to an established standby connection, if there is one
+        for peer in self._standbys:
+            if peer.up:
+                break
+        else:
+            return None
+
+        log.info("failing over to a standby connection")
+        self._standbys.remove(peer)
+        peer.dispatcher.cache = self._dispatcher.cache
+        failed, self._peer, self._dispatcher = (
+                self._peer, peer, peer.dispatcher)
+        if self._direct:
+            self._peer.push((const.MSG_TYPE_PROXY_WATCH_ROUTES, ()))
+
+        # replace the standby before the failed address is back in the queue
+        if self._addrs:
+            self._connect_standby()
+        self._addrs.append(failed.addr)
+
+        return peer
+
+    def _update_routes(self, table):
+        # a new routing table from the proxying hub. keep a connection to
+        # each other hub in it that handles RPCs. those connections retry
+        # with backoff when they fail, until the hub leaves the table
+        self._routes = table
+        addrs = set(addr for addr, subs in table
+                if addr != self._peer.ident and any(
+                    sub[0] == const.MSG_TYPE_RPC_REQUEST for sub in subs))
+
+        for addr, peer in self._direct_peers.items():
+            if addr not in addrs:
+                del self._direct_peers[addr]
+                peer.go_down(reconnect=False, expected=True)
+
+        for addr in addrs:
+            if addr not in self._direct_peers:
+                peer = self._direct_peers[addr] = connection.Peer(
+                        None, self._new_dispatcher(self._direct_client),
+                        addr, backend.Socket())
+                peer.start()
+
+    def _close_direct(self):
+        peers, self._direct_peers = self._direct_peers, {}
+        for peer in peers.itervalues():
+            peer.go_down(reconnect=False, expected=True)
+
+    def _direct_target(self, service, routing_id):
+        # an up, directly connected hub handling the RPC, if there is one
+        targets = []
+        for addr, subs in self._routes:
+            peer = self._direct_peers.get(addr)
+            if peer is None or not peer.up:
+                continue
+            for msg_type, sub_service, mask, value in subs:
+                if (msg_type == const.MSG_TYPE_RPC_REQUEST and
+                        sub_service == service and
+                        routing_id & mask == value):
+                    targets.append(peer)
+                    break
+        if not targets:
+            return None
+        return random.choice(targets)
 
     def wait_connected(self, timeout=None):
         '''Wait for connections to be made and their handshakes to finish
@@ -59,18 +177,29 @@ class Client(object):
         log.info("resetting client")
         rpc_client = self._rpc_client
         self._addrs.append(self._peer.addr)
-        self.__init__(self._addrs)
+        self._close_standbys()
+        self._close_direct()
+        self.__init__(self._addrs, self._standby_count, self._direct,
+                self._codecs)
         self._rpc_client = rpc_client
         self._dispatcher.rpc_client = rpc_client
         rpc_client._client = weakref.ref(self)
 
     def shutdown(self):
-        'Close the hub connection'
+        'Close the hub connection(s)'
         log.info("shutting down")
         self._peer.go_down(reconnect=False, expected=True)
+        self._close_standbys()
+        self._close_direct()
+
+    def _close_standbys(self):
+        standbys, self._standbys = self._standbys, []
+        for peer in standbys:
+            self._addrs.append(peer.addr)
+            peer.go_down(reconnect=False, expected=True)
 
     def publish(self, service, routing_id, method, args=None, kwargs=None,
-            broadcast=False):
+            broadcast=False, conflate=False):
         '''Send a 1-way message
 
         :param service: the service name (the routing top level)
@@ -88,6 +217,12 @@ class Client(object):
         :param broadcast:
             if ``True``, send to every peer with a matching subscription
         :type broadcast: bool
+        :param conflate:
+            if ``True``, a publish with the same service, routing_id and method
+            that is still waiting to be sent (by the client or by the hub on
+            to its peers) is replaced by this one, rather than this one being
+            queued up behind it. any other hash-able, serializable value is
+            used as the key to conflate on instead.
 
         :returns: None. use 'rpc' methods for requests with responses.
 
@@ -99,7 +234,41 @@ class Client(object):
             raise errors.Unroutable()
 
         self._dispatcher.send_proxied_publish(service, routing_id, method,
-                args or (), kwargs or {}, singular=not broadcast)
+                args or (), kwargs or {}, singular=not broadcast,
+                conflate=dispatch.conflation_key(
+                    conflate, service, routing_id, method))
+
+    def publish_many(self, messages, broadcast=False):
+        '''Send many 1-way messages at once
+
+        All of the messages go to the hub in a single frame, and the hub in
+        turn groups them by the peers it forwards them to.
+
+        :param messages:
+            the messages to send, each a ``(service, routing_id, method, args,
+            kwargs)`` tuple (``args`` and ``kwargs`` may be ``None``). Chunked
+            publishes can't be sent this way.
+        :type messages: list
+        :param broadcast:
+            if ``True``, send each message to every peer with a matching
+            subscription
+        :type broadcast: bool
+
+        :returns: None. use 'rpc' methods for requests with responses.
+
+        :raises:
+            - :class:`Unroutable <junction.errors.Unroutable>` if the client
+              doesn't have a connection to a hub
+            - :class:`IllegalMessage <junction.errors.IllegalMessage>` if any
+              of the messages would have been chunked
+        '''
+        if not self._peer.up:
+            raise errors.Unroutable()
+
+        self._dispatcher.send_proxied_publish_many(
+                [(service, routing_id, method, args or (), kwargs or {},
+                    not broadcast)
+                for service, routing_id, method, args, kwargs in messages])
 
     def publish_receiver_count(
             self, service, routing_id, method, timeout=None):
@@ -130,8 +299,43 @@ class Client(object):
                 const.MSG_TYPE_PUBLISH, service, routing_id, method).wait(
                         timeout)[0]
 
+    def last_value(self, service, routing_id, method, timeout=None):
+        '''Get the arguments of the most recent publish the hub has seen
+
+        This is answered from the hub's own memory, without involving the
+        publisher. The hub only remembers publishes of methods passed to
+        its :meth:`keep_last_values <junction.hub.Hub.keep_last_values>`.
+
+        This method will block until a response arrives
+
+        :param service: the service name
+        :type service: anything hash-able
+        :param routing_id: the routing_id of the publish
+        :type routing_id: int
+        :param method: the method name
+        :type method: string
+        :param timeout: maximum time to wait for the response
+        :type timeout: int, float or None
+
+        :returns:
+            the ``(args, kwargs)`` of the last publish, or ``None`` if the hub
+            doesn't have one
+
+        :raises:
+            - :class:`Unroutable <junction.errors.Unroutable>` if the client
+              doesn't have a connection to a hub
+            - :class:`WaitTimeout <junction.errors.WaitTimeout>` if a timeout
+              was provided and it expires
+        '''
+        if not self._peer.up:
+            raise errors.Unroutable()
+
+        return self._rpc_client.last_value(self._peer,
+                service, routing_id, method).get(timeout)
+
     def send_rpc(self, service, routing_id, method, args=None, kwargs=None,
-            broadcast=False):
+            broadcast=False, quorum=None, first_k=None, reducer=None,
+            initial=None, aggregate=None, coalesce=False, idempotent=False):
         '''Send out an RPC request
 
         :param service: the service name (the routing top level)
@@ -149,6 +353,48 @@ class Client(object):
         :param broadcast:
             if ``True``, send to all peers with matching subscriptions
         :type broadcast: bool
+        :param quorum:
+            with ``broadcast``, complete as soon as this many successful
+            responses have arrived, with a list of just those. if so many
+            targets fail that the quorum can't be reached, the RPC completes
+            right away with all the results received (errors included).
+        :type quorum: int or None
+        :param first_k:
+            with ``broadcast``, complete as soon as this many responses of any
+            kind have arrived
+        :type first_k: int or None
+        :param reducer:
+            a function ``reducer(accumulator, response)`` returning the new
+            accumulator. each successful response is folded in as it arrives
+            and then dropped, and the final accumulator becomes the RPC's
+            value. error responses are kept apart, in the RPC's
+            :attr:`errors <junction.futures.RPC.errors>`.
+        :type reducer: function or None
+        :param initial: the starting accumulator for ``reducer``
+        :param aggregate:
+            with ``broadcast``, the name of an aggregator registered on the
+            proxying hub (see :meth:`Hub.register_aggregator
+            <junction.hub.Hub.register_aggregator>`). the hub combines the
+            responses and sends back just the one result, which becomes the
+            RPC's value. errors from individual peers are left out of it,
+            but show up in the RPC's :attr:`errors
+            <junction.futures.RPC.errors>`.
+        :type aggregate: anything hash-able or None
+        :param coalesce:
+            if ``True``, and an identical RPC (same service, routing_id,
+            method, arguments and ``broadcast``) sent with ``coalesce`` is
+            still in flight, don't send this one but return that RPC instead.
+            they will share a result object, so it shouldn't be mutated.
+            ignored along with any of ``quorum``, ``first_k`` or ``reducer``.
+        :type coalesce: bool
+        :param idempotent:
+            if ``True``, the request is safe to handle more than once, so if
+            the hub connection is lost while it is pending, it is re-sent
+            through a standby connection (see the ``standbys`` argument to
+            :class:`Client`) rather than failing. ignored for a
+            ``broadcast`` without ``aggregate``, which could otherwise
+            collect some of its responses twice
+        :type idempotent: bool
 
         :returns:
             a :class:`RPC <junction.futures.RPC>` object representing the
@@ -158,14 +404,41 @@ class Client(object):
             :class:`Unroutable <junction.errors.Unroutable>` if the client
             doesn't have a connection to a hub
         '''
+        if self._direct_peers and not (broadcast or coalesce or idempotent or
+                aggregate is not None or (service, method) in
+                self._dispatcher.cache.caches):
+            rpc = self._send_direct_rpc(
+                    service, routing_id, method, args or (), kwargs or {})
+            if rpc is not None:
+                return rpc
+
         if not self._peer.up:
             raise errors.Unroutable()
 
         return self._dispatcher.send_proxied_rpc(service, routing_id, method,
-                args or (), kwargs or {}, not broadcast)
+                args or (), kwargs or {}, not broadcast, aggregate, coalesce,
+                idempotent, quorum=quorum, first_k=first_k, reducer=reducer,
+                initial=initial)
+
+    def _send_direct_rpc(self, service, routing_id, method, args, kwargs):
+        if args and hasattr(args[0], '__iter__') and \
+                not hasattr(args[0], '__len__'):
+            # leave chunked requests to the proxy
+            return None
+
+        peer = self._direct_target(service, routing_id)
+        if peer is None:
+            return None
+
+        log.debug("sending direct rpc %r to %r" %
+                ((service, routing_id, method), peer.ident))
+        return self._direct_client.request([peer],
+                (service, routing_id, method, args, kwargs), True)[1]
 
     def rpc(self, service, routing_id, method, args=None, kwargs=None,
-            timeout=None, broadcast=False):
+            timeout=None, broadcast=False, quorum=None, first_k=None,
+            reducer=None, initial=None, aggregate=None, coalesce=False,
+            idempotent=False):
         '''Send an RPC request and return the corresponding response
 
         This will block waiting until the response has been received.
@@ -189,6 +462,30 @@ class Client(object):
         :param broadcast:
             if ``True``, send to all peers with matching subscriptions
         :type broadcast: bool
+        :param quorum:
+            with ``broadcast``, the number of successful responses to complete
+            on (see :meth:`send_rpc`)
+        :type quorum: int or None
+        :param first_k:
+            with ``broadcast``, the number of responses to complete on
+        :type first_k: int or None
+        :param reducer:
+            a function to fold the responses into an accumulator with as they
+            arrive (see :meth:`send_rpc`)
+        :type reducer: function or None
+        :param initial: the starting accumulator for ``reducer``
+        :param aggregate:
+            with ``broadcast``, the name of an aggregator on the proxying hub
+            to combine the responses with (see :meth:`send_rpc`)
+        :type aggregate: anything hash-able or None
+        :param coalesce:
+            whether to attach to an identical RPC in flight rather than send
+            this one (see :meth:`send_rpc`)
+        :type coalesce: bool
+        :param idempotent:
+            whether the request may be re-sent through a standby connection
+            if the hub connection is lost (see :meth:`send_rpc`)
+        :type idempotent: bool
 
         :returns:
             a list of the objects returned by the RPC's targets. these could be
@@ -201,9 +498,137 @@ class Client(object):
               was provided and it expires
         '''
         rpc = self.send_rpc(service, routing_id, method,
-                args or (), kwargs or {}, broadcast=broadcast)
+                args or (), kwargs or {}, broadcast, quorum, first_k, reducer,
+                initial, aggregate, coalesce, idempotent)
         return rpc.get(timeout)
 
+    def rpc_many(self, requests, broadcast=False):
+        '''Send out many RPC requests at once
+
+        All of the requests go to the hub in a single frame, and the hub in
+        turn groups them by the peers it forwards them to.
+
+        :param requests:
+            the requests to send, each a ``(service, routing_id, method, args,
+            kwargs)`` tuple (``args`` and ``kwargs`` may be ``None``). Chunked
+            requests can't be sent this way.
+        :type requests: list
+        :param broadcast:
+            if ``True``, send each request to all peers with matching
+            subscriptions
+        :type broadcast: bool
+
+        :returns:
+            a list of :class:`RPC <junction.futures.RPC>` objects, one for
+            each of the ``requests`` in the same order.
+
+        :raises:
+            - :class:`Unroutable <junction.errors.Unroutable>` if the client
+              doesn't have a connection to a hub
+            - :class:`IllegalMessage <junction.errors.IllegalMessage>` if any
+              of the requests would have been chunked
+        '''
+        if not self._peer.up:
+            raise errors.Unroutable()
+
+        return self._dispatcher.send_proxied_rpc_many(
+                [(service, routing_id, method, args or (), kwargs or {})
+                for service, routing_id, method, args, kwargs in requests],
+                not broadcast)
+
+    def scatter_rpc(self, service, method, requests):
+        '''Send a singular RPC to each of many routing ids, with their own args
+
+        All of the requests go to the hub in a single frame, and the hub does
+        the splitting, grouping them by the peers it forwards them to.
+
+        :param service: the service name (the routing top level)
+        :type service: anything hash-able
+        :param method: the method name to call
+        :type method: string
+        :param requests:
+            a dict mapping each routing_id to the ``(args, kwargs)`` to send
+            it (either may be ``None``). Chunked requests can't be sent this
+            way.
+        :type requests: dict
+
+        :returns:
+            a :class:`Gather <junction.futures.Gather>` future, whose value is
+            a dict mapping each routing_id to its RPC's result, or to the
+            exception it failed with (including
+            :class:`Unroutable <junction.errors.Unroutable>`)
+
+        :raises:
+            - :class:`Unroutable <junction.errors.Unroutable>` if the client
+              doesn't have a connection to a hub
+            - :class:`IllegalMessage <junction.errors.IllegalMessage>` if any
+              of the requests would have been chunked
+        '''
+        routing_ids = requests.keys()
+        rpcs = self.rpc_many([(service, routing_id, method) +
+                tuple(requests[routing_id]) for routing_id in routing_ids])
+        return futures.Gather(zip(routing_ids, rpcs))
+
+    def cache_rpc(self, service, method, ttl, size=cache.DEFAULT_SIZE):
+        '''Cache the responses to singular RPCs of a service and method
+
+        Only use this for idempotent methods. Responses are cached per
+        routing_id and arguments (a hub can also cache them on behalf of all
+        its clients, see :meth:`Hub.cache_rpc <junction.hub.Hub.cache_rpc>`).
+
+        :param service: the service of the RPCs to cache
+        :type service: anything hash-able
+        :param method: the method name of the RPCs to cache
+        :type method: string
+        :param ttl: the number of seconds a response stays usable
+        :type ttl: int or float
+        :param size:
+            the most responses to keep (the least recently used are evicted
+            first). default 1024.
+        :type size: int
+        '''
+        self._dispatcher.cache.enable(service, method, ttl, size)
+
+    def uncache_rpc(self, service, method):
+        '''Stop caching the responses to a service and method's RPCs
+
+        :returns:
+            a boolean indicating whether they were being cached (True), or not
+            (False)
+        '''
+        return self._dispatcher.cache.disable(service, method)
+
+    def invalidate_cache(self, service, method=None, mask=0, value=0):
+        '''Drop cached RPC responses
+
+        :param service: the service whose responses to drop
+        :type service: anything hash-able
+        :param method:
+            the method whose responses to drop (default all of the service's)
+        :type method: string
+        :param mask:
+            value to be bitwise-and'ed against the routing ids of cached
+            responses, the result of which must match ``value`` for them to be
+            dropped. the default matches every routing id.
+        :type mask: int
+        :param value: the routing id must match this after ``mask``
+        :type value: int
+
+        :returns: the number of responses dropped
+        '''
+        return self._dispatcher.cache.invalidate(service, method,
+                lambda routing_id: routing_id & mask == value)
+
+    def cache_stats(self):
+        '''Get the hit and miss counts of the RPC response caches
+
+        :returns:
+            a dict mapping ``(service, method)`` pairs to dicts with keys
+            ``hits``, ``misses`` and ``size`` (the number of responses
+            currently held)
+        '''
+        return self._dispatcher.cache.stats()
+
     def rpc_receiver_count(self, service, routing_id, method, timeout=None):
         '''Get the number of peers that would handle a particular RPC
 
@@ -232,3 +657,167 @@ class Client(object):
         return self._rpc_client.recipient_count(self._peer,
                 const.MSG_TYPE_RPC_REQUEST, service, routing_id, method).wait(
                         timeout)[0]
+
+
+class PooledClient(object):
+    '''A junction client spreading its traffic over several proxying hubs
+
+    Every member of the pool is a :class:`Client` with its own connection.
+    Messages go through the member picked by ``strategy``, except chunked
+    ones: those for a given service and routing_id always go through the same
+    member while it is up, so their streams stay in order relative to one
+    another. Members whose connections fail are passed over until
+    :meth:`connect` is called again.
+
+    Since consecutive messages may take different paths, publishes and RPCs
+    are not guaranteed to arrive in the order they were sent.
+
+    :param addrs: the ``(host, port)`` addresses of the hubs to proxy through
+    :type addrs: list of tuples
+    :param size:
+        the number of connections to keep (default one per address). each
+        member cycles through all of ``addrs``, starting at a different one.
+    :type size: int or None
+    :param strategy:
+        how to choose the member for a message, one of ``STRATEGIES``:
+        ``'least_outstanding'`` (the fewest RPCs awaiting responses, the
+        default) or ``'round_robin'``
+    :type strategy: str
+    '''
+    STRATEGIES = ('least_outstanding', 'round_robin')
+
+    def __init__(self, addrs, size=None, strategy='least_outstanding'):
+        if strategy not in self.STRATEGIES:
+            raise ValueError("unknown pool strategy %r" % (strategy,))
+        self._strategy = strategy
+        self._turn = 0
+
+        addrs = list(addrs)
+        self._members = []
+        for i in xrange(size or len(addrs)):
+            i %= len(addrs)
+            self._members.append(Client(addrs[i:] + addrs[:i]))
+
+    def connect(self):
+        "Initiate connections for all members that aren't connected"
+        for member in self._members:
+            if member._peer is None:
+                member.connect()
+
+    def wait_connected(self, timeout=None):
+        '''Wait for the members' connections and handshakes to finish
+
+        :param timeout:
+            maximum time to wait in seconds. with None, there is no timeout.
+        :type timeout: float or None
+
+        :returns:
+            ``True`` if all connections were made, ``False`` if one or more
+            failed.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        result = True
+        for member in self._members:
+            if member._peer is None:
+                result = False
+                continue
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0)
+            result = member.wait_connected(timeout) and result
+        return result
+
+    def shutdown(self):
+        'Close all the hub connections'
+        for member in self._members:
+            if member._peer is not None:
+                member.shutdown()
+
+    def _up(self):
+        return [m for m in self._members
+                if m._peer is not None and m._peer.up]
+
+    def _pick(self, service, routing_id, args):
+        members = self._up()
+        if not members:
+            raise errors.Unroutable()
+
+        if args and hasattr(args[0], '__iter__') and \
+                not hasattr(args[0], '__len__'):
+            # chunked. stick to one member per stream key, moving on to the
+            # next live one (in pool order) only if it has gone down
+            start = hash((service, routing_id)) % len(self._members)
+            for member in self._members[start:] + self._members[:start]:
+                if member in members:
+                    return member
+
+        if self._strategy == 'round_robin':
+            self._turn += 1
+            return members[self._turn % len(members)]
+
+        return min(members, key=lambda m: len(m._rpc_client.inflight))
+
+    def publish(self, service, routing_id, method, args=None, kwargs=None,
+            broadcast=False, conflate=False):
+        '''Send a 1-way message through one of the pool's connections
+
+        See :meth:`Client.publish` for the arguments. ``conflate`` only
+        replaces messages queued on the same connection.
+
+        :raises:
+            :class:`Unroutable <junction.errors.Unroutable>` if none of the
+            pool's connections is up
+        '''
+        self._pick(service, routing_id, args).publish(service, routing_id,
+                method, args, kwargs, broadcast, conflate)
+
+    def publish_many(self, messages, broadcast=False):
+        '''Send many 1-way messages at once, all through one connection
+
+        See :meth:`Client.publish_many` for the arguments.
+        '''
+        self._pick(None, None, None).publish_many(messages, broadcast)
+
+    def send_rpc(self, service, routing_id, method, args=None, kwargs=None,
+            **options):
+        '''Send out an RPC request through one of the pool's connections
+
+        Takes the same arguments as :meth:`Client.send_rpc`.
+
+        :returns:
+            a :class:`RPC <junction.futures.RPC>` object representing the
+            RPC and its future response.
+
+        :raises:
+            :class:`Unroutable <junction.errors.Unroutable>` if none of the
+            pool's connections is up
+        '''
+        return self._pick(service, routing_id, args).send_rpc(
+                service, routing_id, method, args, kwargs, **options)
+
+    def rpc(self, service, routing_id, method, args=None, kwargs=None,
+            timeout=None, **options):
+        '''Send an RPC request and return the corresponding response
+
+        This will block waiting until the response has been received. Takes
+        the same arguments as :meth:`Client.rpc`.
+        '''
+        return self.send_rpc(service, routing_id, method, args, kwargs,
+                **options).get(timeout)
+
+    def rpc_many(self, requests, broadcast=False):
+        '''Send out many RPC requests at once, all through one connection
+
+        See :meth:`Client.rpc_many` for the arguments and return value.
+        '''
+        return self._pick(None, None, None).rpc_many(requests, broadcast)
+
+    def publish_receiver_count(
+            self, service, routing_id, method, timeout=None):
+        'See :meth:`Client.publish_receiver_count`'
+        return self._pick(service, routing_id, None).publish_receiver_count(
+                service, routing_id, method, timeout)
+
+    def rpc_receiver_count(self, service, routing_id, method, timeout=None):
+        'See :meth:`Client.rpc_receiver_count`'
+        return self._pick(service, routing_id, None).rpc_receiver_count(
+                service, routing_id, method, timeout)
@@ -1,3 +1,4 @@
+import itertools
 import traceback
 
 try:
@@ -12,6 +13,7 @@ else:
     import gevent.event
     import gevent.queue
     import gevent.socket
+    import gevent.threadpool
 try:
     import eventlet
 except ImportError:
@@ -21,15 +23,30 @@ else:
     import eventlet.greenthread
     import eventlet.hubs
     import eventlet.green.Queue
+    import eventlet.tpool
 
 
 __all__ = ["active", "Socket", "Queue", "Event", "schedule", "schedule_in",
         "schedule_exception", "greenlet", "end", "handle_exception", "pause",
-        "getcurrent", "greenlet_class"]
+        "getcurrent", "greenlet_class", "run_queue_length", "run_in_thread"]
 
 _supported = ["greenhouse", "gevent", "eventlet"]
 active = None
 
+# how many OS threads work through run_in_thread calls (under gevent)
+THREADPOOL_SIZE = 2
+
+
+def greenhouse_run_queue_length():
+    state = greenhouse.scheduler.state
+    return len(state.to_run) + len(state.paused)
+
+
+def greenhouse_run_in_thread(func, args=()):
+    # greenhouse has no way for another thread to wake a greenlet up, so
+    # this just runs the function in place
+    return func(*args)
+
 
 def activate_greenhouse():
     globals()['Socket'] = greenhouse.Socket
@@ -44,6 +61,8 @@ def activate_greenhouse():
     globals()['pause'] = greenhouse.pause
     globals()['pause_for'] = greenhouse.pause_for
     globals()['getcurrent'] = greenhouse.getcurrent
+    globals()['run_queue_length'] = greenhouse_run_queue_length
+    globals()['run_in_thread'] = greenhouse_run_in_thread
     globals()['active'] = "greenhouse"
 
 
@@ -78,6 +97,17 @@ def gevent_schedule_exception(exception, target):
 def gevent_greenlet(func, args=(), kwargs=None):
     return gevent.Greenlet(func, *args, **(kwargs or {}))
 
+def gevent_run_queue_length():
+    return len(gevent.get_hub().loop._callbacks)
+
+_gevent_threadpool = []
+
+def gevent_run_in_thread(func, args=()):
+    if not _gevent_threadpool:
+        _gevent_threadpool.append(
+                gevent.threadpool.ThreadPool(THREADPOOL_SIZE))
+    return _gevent_threadpool[0].apply(func, args)
+
 if gevent:
     class gevent_event(gevent.event.Event):
         def wait(self, *args, **kwargs):
@@ -99,6 +129,8 @@ def activate_gevent():
     globals()['pause'] = gevent.sleep
     globals()['pause_for'] = gevent.sleep
     globals()['getcurrent'] = gevent.getcurrent
+    globals()['run_queue_length'] = gevent_run_queue_length
+    globals()['run_in_thread'] = gevent_run_in_thread
     globals()['active'] = "gevent"
 
 
@@ -130,6 +162,21 @@ def eventlet_greenlet(func, args=(), kwargs=None):
     return eventlet.spawn(func, *args, **(kwargs or {}))
 
 
+def eventlet_run_queue_length():
+    # eventlet runs greenlets off of timers, so the ones ready to go are the
+    # timers already due, whether they're in the heap or still waiting to
+    # be moved there
+    hub = eventlet.hubs.get_hub()
+    now = hub.clock()
+    return sum(1 for when, timer in itertools.chain(
+            hub.timers, hub.next_timers)
+        if when <= now and not timer.called)
+
+
+def eventlet_run_in_thread(func, args=()):
+    return eventlet.tpool.execute(func, *args)
+
+
 class eventlet_event(object):
     def __init__(self):
         self._waiters = []
@@ -193,6 +240,8 @@ def activate_eventlet():
     globals()['pause'] = eventlet.sleep
     globals()['pause_for'] = eventlet.sleep
     globals()['getcurrent'] = eventlet.getcurrent
+    globals()['run_queue_length'] = eventlet_run_queue_length
+    globals()['run_in_thread'] = eventlet_run_in_thread
     globals()['active'] = "eventlet"
 
 
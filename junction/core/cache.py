@@ -0,0 +1,166 @@
+from __future__ import absolute_import
+
+import collections
+import time
+
+import mummy
+
+from . import codecs
+
+
+# default number of responses kept per (service, method)
+DEFAULT_SIZE = 1024
+
+# returned by ResponseCache.get when there is nothing (fresh) cached
+MISS = object()
+
+
+class ResponseCache(object):
+    '''Expiring, size-bounded caches of RPC responses per (service, method)
+
+    Entries are keyed on the routing_id and the serialized arguments, and
+    the responses are stored serialized as well, so that every hit gets its
+    own copy.
+    '''
+
+    def __init__(self):
+        self.caches = {}
+
+    def enable(self, service, method, ttl, size=DEFAULT_SIZE):
+        self.caches[(service, method)] = _LRU(ttl, size)
+
+    def disable(self, service, method):
+        return self.caches.pop((service, method), None) is not None
+
+    def key(self, service, routing_id, method, args, kwargs):
+        'The cache key for a request, or ``None`` if it isn\'t cacheable'
+        if (service, method) not in self.caches:
+            return None
+        if kwargs is None:
+            # a body packed by a client is already exactly these bytes
+            return (routing_id, args)
+        try:
+            # keyed like the same body packed in mummy would be
+            return (routing_id, codecs.MUMMY.tag + mummy.dumps((args, kwargs)))
+        except TypeError:
+            # unserializable (or chunked) arguments
+            return None
+
+    def get(self, service, method, key):
+        lru = self.caches.get((service, method))
+        if lru is None:
+            return MISS
+        return lru.get(key)
+
+    def put(self, service, method, key, value):
+        lru = self.caches.get((service, method))
+        if lru is not None:
+            lru.put(key, value)
+
+    def invalidate(self, service, method=None, routing_id_matches=None):
+        '''Drop cached responses
+
+        All of them for ``service``, or just those for ``method`` if it is
+        given, and further just those whose routing_id passes the
+        ``routing_id_matches`` test function if that is given.
+
+        :returns: the number of responses dropped
+        '''
+        dropped = 0
+        for (cservice, cmethod), lru in self.caches.iteritems():
+            if cservice != service:
+                continue
+            if method is not None and cmethod != method:
+                continue
+            dropped += lru.invalidate(routing_id_matches)
+        return dropped
+
+    def stats(self):
+        return dict((key, {
+                'hits': lru.hits,
+                'misses': lru.misses,
+                'size': len(lru.entries),
+            }) for key, lru in self.caches.iteritems())
+
+
+class LastValueCache(object):
+    '''The most recent publish per (service, routing_id, method)
+
+    Publishes are only remembered for the (service, method) pairs it has been
+    enabled for, and only up to a bounded number of routing_ids for each.
+    Chunked (or otherwise unserializable) publishes aren't remembered.
+    '''
+
+    def __init__(self):
+        self.caches = {}
+
+    def enable(self, service, method, size=DEFAULT_SIZE):
+        self.caches[(service, method)] = _LRU(None, size)
+
+    def disable(self, service, method):
+        return self.caches.pop((service, method), None) is not None
+
+    def put(self, service, routing_id, method, args, kwargs):
+        lru = self.caches.get((service, method))
+        if lru is not None:
+            lru.put(routing_id, (args, kwargs))
+
+    def get(self, service, routing_id, method):
+        'The ``(args, kwargs)`` last published, or ``None``'
+        lru = self.caches.get((service, method))
+        if lru is None:
+            return None
+        value = lru.get(routing_id)
+        if value is MISS:
+            return None
+        args, kwargs = value
+        if kwargs is None:
+            # a packed body, forwarded on behalf of a client
+            return codecs.loads_body(args)
+        return value
+
+
+class _LRU(object):
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None or (entry[0] is not None and entry[0] < time.time()):
+            self.misses += 1
+            return MISS
+
+        # re-insert to mark it most recently used
+        self.entries[key] = entry
+        self.hits += 1
+        return mummy.loads(entry[1])
+
+    def put(self, key, value):
+        try:
+            value = mummy.dumps(value)
+        except TypeError:
+            return
+
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+
+        self.entries.pop(key, None)
+        self.entries[key] = (expires, value)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, routing_id_matches=None):
+        if routing_id_matches is None:
+            dropped = len(self.entries)
+            self.entries.clear()
+            return dropped
+
+        doomed = [key for key in self.entries if routing_id_matches(key[0])]
+        for key in doomed:
+            del self.entries[key]
+        return len(doomed)
@@ -0,0 +1,126 @@
+from __future__ import absolute_import
+
+import collections
+import marshal
+
+import mummy
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec(object):
+    '''A serialization format for the frames on a connection
+
+    Subclasses give it a ``name`` to negotiate it by, a one-byte ``tag``
+    marking the message bodies packed with it, and ``dumps(obj)`` and
+    ``loads(data)`` methods. ``dumps`` should raise a TypeError for anything
+    it can't serialize, and ``loads`` a ValueError for anything it can't
+    decode.
+    '''
+    name = None
+    tag = None
+
+
+class MummyCodec(Codec):
+    'The default, and the format of every handshake'
+    name = 'mummy'
+    tag = '\x01'
+
+    def dumps(self, obj):
+        return mummy.dumps(obj)
+
+    def loads(self, data):
+        return mummy.loads(data)
+
+
+class MarshalCodec(Codec):
+    '''The interpreter's own, only safe between peers running the same
+    python version
+    '''
+    name = 'marshal'
+    tag = '\x02'
+
+    def dumps(self, obj):
+        try:
+            return marshal.dumps(obj)
+        except ValueError, exc:
+            raise TypeError(*exc.args)
+
+    def loads(self, data):
+        try:
+            return marshal.loads(data)
+        except EOFError, exc:
+            raise ValueError(*exc.args)
+
+
+class MsgpackCodec(Codec):
+    '''msgpack, if it is installed
+
+    msgpack has just the one sequence type, so lists sent this way arrive as
+    tuples.
+    '''
+    name = 'msgpack'
+    tag = '\x03'
+
+    def dumps(self, obj):
+        return msgpack.packb(obj)
+
+    def loads(self, data):
+        try:
+            return msgpack.unpackb(data, use_list=False)
+        except msgpack.UnpackException, exc:
+            raise ValueError(*exc.args)
+
+
+MUMMY = MummyCodec()
+
+CODECS = collections.OrderedDict([(MUMMY.name, MUMMY),
+    (MarshalCodec.name, MarshalCodec())])
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+# packed bodies are tagged with their codec, so that hubs can forward them
+# untouched across connections negotiated differently
+BY_TAG = dict((codec.tag, codec) for codec in CODECS.itervalues())
+
+# the codecs a connection offers unless told otherwise
+DEFAULT = (MUMMY.name,)
+
+
+def get(names):
+    '''Validate a preference-ordered list of codec names
+
+    ``None`` gets the default, which is just mummy.
+    '''
+    if names is None:
+        return DEFAULT
+    for name in names:
+        if name not in CODECS:
+            raise ValueError("unknown or unavailable codec %r" % (name,))
+    return tuple(names)
+
+
+def choose(initiator_names, acceptor_names):
+    'The codec for a connection: the initiator\'s first choice both support'
+    for name in initiator_names:
+        if name in acceptor_names and name in CODECS:
+            return CODECS[name]
+    return MUMMY
+
+
+def body_codec(body):
+    'The codec a packed message body was encoded with'
+    codec = BY_TAG.get(body[:1])
+    if codec is None:
+        raise ValueError("unknown or unavailable codec tag %r" % (body[:1],))
+    return codec
+
+
+def loads_body(body):
+    '''Decode a packed message body (as ``raw`` handlers get them) into its
+    ``(args, kwargs)``
+    '''
+    return body_codec(body).loads(body[1:])
@@ -1,18 +1,30 @@
 from __future__ import absolute_import
 
+import collections
+import itertools
 import logging
 import random
 import socket
 import struct
+import time
 
-import mummy
-
-from . import backend, const
+from . import backend, codecs, const
 from .. import errors
 
 
 RECONNECT_JITTER = 0.25
 
+# the most (service, method) pairs a connection will assign integer ids
+INTERN_LIMIT = 4096
+
+# frames of at least this many bytes are encoded and decoded in a thread
+# pool, leaving the hub free to run other greenlets meanwhile (None to never)
+OFFLOAD_THRESHOLD = 1 << 20
+
+# how many items of a container, and how deep, size_hint looks at
+HINT_SAMPLE = 8
+HINT_DEPTH = 4
+
 log = logging.getLogger("junction.connection")
 
 
@@ -30,6 +42,12 @@ class Peer(object):
 
         self.attempt_reconnects = reconnect
         self.send_queue = backend.Queue()
+        self.queued_at = collections.deque()
+        self.conflating = {}
+        self.interned = {}
+        self.interns = {}
+        self.codec = codecs.MUMMY
+        self.codec_in = codecs.MUMMY
         self.established = backend.Event()
         self.reconnect_waiter = backend.Event()
 
@@ -68,11 +86,24 @@ class Peer(object):
         return self.up
 
     def push(self, msg):
-        self.send_queue.put(self.dump(msg))
+        self.push_string(self.dump(self.intern(msg)))
 
     def push_string(self, msg):
+        self.queued_at.append(time.time())
         self.send_queue.put(msg)
 
+    def push_conflated(self, key, msg):
+        # if a message with the same key is still waiting in the send queue,
+        # replace it in place rather than queueing this one behind it
+        msg = self.dump(self.intern(msg))
+        slot = self.conflating.get(key)
+        if slot is not None:
+            slot[0] = msg
+            return
+
+        slot = self.conflating[key] = [msg]
+        self.push_string((key, slot))
+
     ##
     ## Coroutines
     ##
@@ -100,14 +131,28 @@ class Peer(object):
     def sender_coro(self):
         try:
             while 1:
-                self.sock.sendall(self.send_queue.get())
+                msg = self.send_queue.get()
+                self.dispatcher.observe_queueing(
+                        time.time() - self.queued_at.popleft())
+                if isinstance(msg, tuple):
+                    key, slot = msg
+                    del self.conflating[key]
+                    msg = slot[0]
+                self.sock.sendall(msg)
         except socket.error:
             self.connection_failure()
 
     def receiver_coro(self):
         try:
             while 1:
-                self.dispatcher.incoming(self, self.recv_one())
+                try:
+                    msg = self.recv_one()
+                except ValueError:
+                    # the frame was read whole, so just drop it and carry on
+                    log.warn("dropping an undecodable frame from %r" %
+                            (self.target,))
+                    continue
+                self.dispatcher.incoming(self, msg)
         except (socket.error, errors.MessageCutOff):
             self.connection_failure()
 
@@ -166,14 +211,20 @@ class Peer(object):
         return self.attempt_handshake()
 
     def attempt_handshake(self):
+        # the peer's interned ids only last as long as the connection, and
+        # every connection starts out (and handshakes) in mummy
+        self.interns.clear()
+        self.codec_in = codecs.MUMMY
+
         peername = self.sock.getpeername()
         log.info("sending a handshake to %r" % (peername,))
 
         # send a handshake message
         try:
-            self.sock.sendall(self.dump((const.MSG_TYPE_HANDSHAKE, (
+            self.sock.sendall(dump((const.MSG_TYPE_HANDSHAKE, (
                 self.local_addr,
-                list(self.dispatcher.local_subscriptions())))))
+                list(self.dispatcher.local_subscriptions()),
+                list(self.dispatcher.codecs)))))
         except socket.error:
             return False
 
@@ -183,6 +234,9 @@ class Peer(object):
         except (socket.error, errors.MessageCutOff):
             log.warn("receiving handshake from %r failed" % (peername,))
             return False
+        except ValueError:
+            log.warn("undecodable handshake from %r" % (peername,))
+            return False
 
         # validate the peer's handshake message format
         if (not received
@@ -190,15 +244,45 @@ class Peer(object):
                 or received[0] != const.MSG_TYPE_HANDSHAKE
                 or len(received) != 2
                 or not isinstance(received[1], tuple)
-                or len(received[1]) != 2
+                or len(received[1]) not in (2, 3)
                 or not isinstance(received[1][0], (tuple, type(None)))
-                or not isinstance(received[1][1], list)):
+                or not isinstance(received[1][1], list)
+                or (len(received[1]) == 3 and
+                    not isinstance(received[1][2], list))):
             log.warn("invalid handshake from %r" % (peername,))
             return False
 
         log.info("received handshake from %r" % (peername,))
 
-        self.ident, subs = received[1]
+        self.ident, subs = received[1][:2]
+
+        # a peer not offering any codecs only speaks mummy
+        offered = received[1][2] if len(received[1]) == 3 else []
+        if self.initiator:
+            codec = codecs.choose(self.dispatcher.codecs, offered)
+        else:
+            codec = codecs.choose(offered, self.dispatcher.codecs)
+
+        # frames are serialized and interned as they are queued, so anything
+        # still queued from before a reconnect is in the codec in use then,
+        # and may use ids announced to the old connection. have the peer
+        # switch to that codec and learn all our ids first, and then switch
+        # to the new codec where it begins.
+        preamble = []
+        if self.codec is not codecs.MUMMY:
+            preamble.append(dump((const.MSG_TYPE_CODEC, self.codec.name)))
+        for key, ident in self.interned.iteritems():
+            preamble.append(
+                    self.dump((const.MSG_TYPE_INTERN, (ident,) + key)))
+        if preamble:
+            try:
+                self.sock.sendall(''.join(preamble))
+            except socket.error:
+                return False
+        if codec is not self.codec:
+            self.push_string(self.dump((const.MSG_TYPE_CODEC, codec.name)))
+            self.codec = codec
+
         self.up = True
         self.established.set()
 
@@ -244,7 +328,33 @@ class Peer(object):
         return False
 
     def dump(self, msg):
-        return dump(msg)
+        return dump(msg, self.codec)
+
+    def intern(self, msg):
+        # swap a publish or request's service and method for this
+        # connection's integer id for them, telling the peer what the id
+        # stands for the first time it is used
+        msg_type, body = msg
+        if msg_type == const.MSG_TYPE_PUBLISH:
+            key = (body[0], body[2])
+        elif msg_type == const.MSG_TYPE_RPC_REQUEST:
+            key = (body[1], body[3])
+        else:
+            return msg
+
+        ident = self.interned.get(key)
+        if ident is None:
+            if len(self.interned) >= INTERN_LIMIT:
+                return msg
+            ident = self.interned[key] = len(self.interned) + 1
+            self.push_string(
+                    self.dump((const.MSG_TYPE_INTERN, (ident,) + key)))
+
+        if msg_type == const.MSG_TYPE_PUBLISH:
+            return (const.MSG_TYPE_PUBLISH_INTERNED,
+                    (ident, body[1]) + body[3:])
+        return (const.MSG_TYPE_RPC_REQUEST_INTERNED,
+                (body[0], ident, body[2]) + body[4:])
 
     def read_bytes(self, count):
         data = [self.sock.recv(count)]
@@ -258,7 +368,7 @@ class Peer(object):
 
     def recv_one(self):
         size = struct.unpack("!I", self.read_bytes(4))[0]
-        return mummy.loads(self.read_bytes(size))
+        return loads(self.read_bytes(size), self.codec_in)
 
 
 def compare(peerA, peerB):
@@ -272,6 +382,41 @@ def compare(peerA, peerB):
     return peerB, peerA
 
 
-def dump(msg):
-    msg = mummy.dumps(msg)
+def size_hint(obj, depth=0):
+    '''A cheap, rough estimate of an object's serialized size
+
+    Strings count their length, and containers extrapolate from their first
+    few items, so it takes about the same time however big the object is.
+    '''
+    if isinstance(obj, basestring):
+        return len(obj)
+    if isinstance(obj, dict):
+        sample = list(itertools.islice(obj.iteritems(), HINT_SAMPLE))
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        sample = list(itertools.islice(obj, HINT_SAMPLE))
+    else:
+        return 8
+    if not sample:
+        return 1
+    if depth >= HINT_DEPTH:
+        return len(obj) * 8
+    total = sum(size_hint(item, depth + 1) for item in sample)
+    return len(obj) * total // len(sample) + 1
+
+
+def dumps(obj, codec=codecs.MUMMY):
+    if OFFLOAD_THRESHOLD is not None and \
+            size_hint(obj) >= OFFLOAD_THRESHOLD:
+        return backend.run_in_thread(codec.dumps, (obj,))
+    return codec.dumps(obj)
+
+
+def loads(data, codec=codecs.MUMMY):
+    if OFFLOAD_THRESHOLD is not None and len(data) >= OFFLOAD_THRESHOLD:
+        return backend.run_in_thread(codec.loads, (data,))
+    return codec.loads(data)
+
+
+def dump(msg, codec=codecs.MUMMY):
+    msg = dumps(msg, codec)
     return struct.pack("!I", len(msg)) + msg
@@ -35,6 +35,34 @@ MSG_TYPE_PROXY_PUBLISH_END_CHUNKS = 27
 MSG_TYPE_PROXY_REQUEST_END_CHUNKS = 28
 MSG_TYPE_PROXY_RESPONSE_END_CHUNKS = 29
 
+# frames carrying many publishes or requests at once
+MSG_TYPE_BATCH_PUBLISH = 30
+MSG_TYPE_BATCH_REQUEST = 31
+MSG_TYPE_PROXY_BATCH_PUBLISH = 32
+MSG_TYPE_PROXY_BATCH_REQUEST = 33
+
+# a hub's (run queue, pending handlers, send queue) load summary
+MSG_TYPE_LOAD_REPORT = 34
+
+# a client asking its hub for the last publish it saw for a
+# (service, routing_id, method)
+MSG_TYPE_PROXY_QUERY_LAST_VALUE = 35
+
+# a client asking its hub to keep it up to date on the routing table, and
+# the table itself (hub addresses and their subscriptions) sent in reply
+# and again whenever it changes
+MSG_TYPE_PROXY_WATCH_ROUTES = 36
+MSG_TYPE_PROXY_ROUTES = 37
+
+# a connection's integer id for a (service, method) pair, sent ahead of the
+# first publish or request using it, and those messages in compact form
+MSG_TYPE_INTERN = 38
+MSG_TYPE_PUBLISH_INTERNED = 39
+MSG_TYPE_RPC_REQUEST_INTERNED = 40
+
+# the name of the codec the frames that follow are serialized with
+MSG_TYPE_CODEC = 41
+
 # error codes
 RPC_ERR_MALFORMED = 1
 RPC_ERR_NOHANDLER = 2
@@ -44,6 +72,8 @@ RPC_ERR_UNKNOWN = 5
 RPC_ERR_LOST_CONN = 6
 RPC_ERR_UNSER_RESP = 7
 RPC_ERR_BADARGS = 8
+RPC_ERR_THROTTLED = 9
+RPC_ERR_OVERLOADED = 10
 
 REVERSE = dict((val, key)
         for (key, val) in globals().items()
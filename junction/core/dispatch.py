@@ -1,15 +1,18 @@
 from __future__ import absolute_import
 
 import collections
+import copy
 import inspect
 import logging
 import socket
 import sys
+import time
 import traceback
 
 import mummy
 
-from . import backend, connection, const
+from . import (backend, cache, codecs, connection, const, ratelimit,
+        selection, stats)
 from .. import errors, hooks
 
 
@@ -17,15 +20,62 @@ log = logging.getLogger("junction.dispatch")
 
 STOP = object()
 
+# response codes that count against a peer's health
+UNHEALTHY_RCS = frozenset([const.RPC_ERR_UNKNOWN, const.RPC_ERR_LOST_CONN])
+
+# hedged RPCs get a duplicate sent once they've been waiting longer than
+# this percentile of recent response times for the same service and method
+HEDGE_PERCENTILE = 95
+
+# hedges are limited to this fraction of the hedge-able RPCs sent, with
+# up to HEDGE_BURST of them allowed to accumulate
+HEDGE_BUDGET = 0.05
+HEDGE_BURST = 10.0
+
+# idempotent RPCs lost with a peer's connection are re-sent to another peer,
+# limited to this fraction of the idempotent RPCs sent, with up to
+# RETRY_BURST of them allowed to accumulate (and available from the start)
+RETRY_BUDGET = 0.1
+RETRY_BURST = 10.0
+
 
 class Dispatcher(object):
-    def __init__(self, rpc_client, hub, hooks=None):
+    def __init__(self, rpc_client, hub, hooks=None, selector=None,
+            hedge_percentile=HEDGE_PERCENTILE, hedge_budget=HEDGE_BUDGET,
+            retry_budget=RETRY_BUDGET, codec_names=None):
         self.rpc_client = rpc_client
         self.hub = hub
+        self.codecs = codecs.get(codec_names)
         self.hooks = hooks
+        self.selector = selection.get(selector)
+        self.peer_stats = stats.PeerStats()
+        self.pending_handlers = 0
+        self.method_latencies = stats.LatencyTracker()
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.hedge_tokens = 0.0
+
+        # counter: the timing entry of a singular RPC (shared with its
+        # hedges), so every response time counts toward the hedge delay
+        self.timings = {}
+        self.retry_budget = retry_budget
+        self.retry_tokens = RETRY_BURST
+        self.retries = {}
+        self.aggregators = {}
+        self.aggregating = {}
+        self.coalescing = {}
+        self.coalesced_handlers = set()
+        self.raw_handlers = set()
+        self.serving = {}
+        self.cache = cache.ResponseCache()
+        self.last_values = cache.LastValueCache()
+        self.rate_limiter = ratelimit.RateLimiter()
+        self.queueing = None
         self.peer_subs = {}
         self.local_subs = {}
         self.clients = {}
+        self.route_watchers = {}
+        self.routes_pending = False
         self.peers = {}
         self.reconnecting = {}
         self.inflight_proxies = {}
@@ -71,6 +121,7 @@ class Dispatcher(object):
                 continue
             peer.push((const.MSG_TYPE_ANNOUNCE,
                     (msg_type, service, mask, value)))
+        self.routes_changed()
 
     def remove_local_subscription(self, msg_type, service, mask, value):
         group = self.local_subs.get((msg_type, service), 0)
@@ -86,6 +137,7 @@ class Dispatcher(object):
                         continue
                     peer.push((const.MSG_TYPE_UNSUBSCRIBE,
                         (msg_type, service, mask, value)))
+                self.routes_changed()
                 return True
         return False
 
@@ -109,6 +161,7 @@ class Dispatcher(object):
                 del groups[i]
                 if not groups:
                     del self.peer_subs[(msg_type, service)]
+                self.routes_changed()
                 break
         else:
             log.warn(("unsubscribe from %r described an " +
@@ -142,8 +195,35 @@ class Dispatcher(object):
             if target.up:
                 target.push_string(msg)
 
+    def dump_frames(self, targets, msg):
+        # serialize msg just once for each codec in use among the targets
+        frames = {}
+        for target in targets:
+            if target.up and target.codec not in frames:
+                frames[target.codec] = target.dump(msg)
+        return frames
+
+    def multipush_frames(self, targets, frames):
+        for target in targets:
+            if target.up and target.codec in frames:
+                target.push_string(frames[target.codec])
+
+    def body_codec(self, targets):
+        # pack a body in the codec that every connection it goes out on
+        # speaks, falling back on mummy, which they all do, if they differ
+        in_use = set(t.codec for t in targets if t.codec is not None)
+        if len(in_use) == 1:
+            return in_use.pop()
+        return codecs.MUMMY
+
     def multipush_udp(self, targets, msg):
-        msgstr = mummy.dumps(msg)
+        # datagrams have no negotiated codec, so are always mummy, but the
+        # body inside is packed like it would be over the connections
+        msg_type, sender, body = msg
+        remote = [t for t in targets if not isinstance(t, LocalTarget)]
+        if remote:
+            msgstr = mummy.dumps((msg_type, sender, body[:3] + pack(
+                body[3], body[4], self.body_codec(remote))))
         for target in targets:
             if isinstance(target, LocalTarget):
                 target.push((msg[0], msg[2]))
@@ -156,6 +236,34 @@ class Dispatcher(object):
             for mask, value, handlers in value:
                 yield (msg_type, service, mask, value)
 
+    def routing_table(self):
+        # [(hub addr, [(msg_type, service, mask, value), ...]), ...]
+        # starting with this hub itself
+        by_peer = {}
+        for (msg_type, service), subs in self.peer_subs.iteritems():
+            for mask, value, peer in subs:
+                if peer.up:
+                    by_peer.setdefault(peer.ident, []).append(
+                            (msg_type, service, mask, value))
+
+        table = [(self.hub._ident, list(self.local_subscriptions()))]
+        table.extend(by_peer.iteritems())
+        return table
+
+    def routes_changed(self):
+        # send clients watching the routing table the new one, just once
+        # for a whole burst of changes
+        if self.route_watchers and not self.routes_pending:
+            self.routes_pending = True
+            backend.schedule(self.push_routes)
+
+    def push_routes(self):
+        self.routes_pending = False
+        table = self.routing_table()
+        for peer in self.route_watchers.itervalues():
+            if peer.up:
+                peer.push((const.MSG_TYPE_PROXY_ROUTES, table))
+
     def add_reconnecting(self, addr, peer):
         self.reconnecting[addr] = peer
 
@@ -188,12 +296,17 @@ class Dispatcher(object):
                     (peer.ident, subs))
 
     def connection_lost(self, peer, subs):
+        self.observe_result(peer, const.RPC_ERR_LOST_CONN)
         backend.schedule(hooks._get(self.hooks, "connection_lost"),
                 (peer.ident, subs))
 
     def drop_peer(self, peer):
         self.peers.pop(peer.ident, None)
+        self.peer_stats.forget(peer.ident)
         subs = self.drop_peer_subscriptions(peer)
+        self.route_watchers.pop(id(peer), None)
+        if subs:
+            self.routes_changed()
 
         channels = self.proxying_channels.pop(peer.ident, {})
         for source_counter, entry in channels.iteritems():
@@ -208,6 +321,14 @@ class Dispatcher(object):
 
         peer_ident = peer.ident or id(peer)
 
+        if peer.ident is None:
+            self.rate_limiter.forget(id(peer))
+
+        # move idempotent RPCs that were awaiting this peer over to others
+        for counter in list(self.rpc_client.by_peer.get(id(peer), ())):
+            if counter in self.retries:
+                self.retry(peer, counter)
+
         # stop sender greenlets for any outgoing chunked messages to this peer
         channels = self.outgoing_channels.pop(peer_ident, {})
         for msgtype, counter in channels.keys():
@@ -256,6 +377,7 @@ class Dispatcher(object):
         for msg_type, service, mask, value in subscriptions:
             self.peer_subs.setdefault((msg_type, service), []).append(
                     (mask, value, peer))
+        self.routes_changed()
 
     def drop_peer_subscriptions(self, peer):
         removed = []
@@ -273,74 +395,90 @@ class Dispatcher(object):
             if peer.up and routing_id & mask == value:
                 yield peer
 
-    def send_publish(self, client, service, routing_id, method, args, kwargs,
-            forwarded=False, singular=False):
+    def publish_routes(self, client, service, routing_id, method, singular):
         # get the peers registered for this publish
-        peers = list(self.find_peer_routes(
+        targets = list(self.find_peer_routes(
                 const.MSG_TYPE_PUBLISH, service, routing_id))
 
         # handle locally if we have a hander for it
         handler, schedule = self.find_local_handler(
                 const.MSG_TYPE_PUBLISH, service, routing_id, method)
-
-        targets = peers[:]
         if handler:
             targets.append(LocalTarget(self, handler, schedule, client))
 
-        if not targets:
-            return False
-
-        if singular:
+        if singular and targets:
             targets = [self.target_selection(
                 targets, service, routing_id, method)]
-            if not isinstance(targets[0], LocalTarget):
-                handler = None
+
+        return targets
+
+    def send_publish(self, client, service, routing_id, method, args, kwargs,
+            forwarded=False, singular=False, conflate=None):
+        targets = self.publish_routes(
+                client, service, routing_id, method, singular)
+        self.last_values.put(service, routing_id, method, args, kwargs)
+        if not targets:
+            return False
 
         if args and hasattr(args[0], "__iter__") \
                 and not hasattr(args[0], "__len__"):
+            if conflate is not None:
+                raise errors.IllegalMessage(
+                        "conflated publishes cannot be chunked")
             counter = self.rpc_client.next_counter()
             glet = backend.greenlet(self.send_chunked_publish,
                     (service, routing_id, method, counter,
                         args, kwargs, targets, False))
-            self.register_outgoing_channel(peers,
+            self.register_outgoing_channel(targets,
                     const.MSG_TYPE_PUBLISH_IS_CHUNKED, counter, glet)
             backend.schedule(glet)
-            return bool(handler or peers)
+            return True
 
         msg = (const.MSG_TYPE_PUBLISH,
                 (service, routing_id, method, args, kwargs))
 
-        if handler is not None:
+        local = [t for t in targets if isinstance(t, LocalTarget)]
+        if local:
             log.debug("locally handling publish %r %s" %
-                    (msg[1][:3], "scheduled" if schedule else "immediately"))
+                    (msg[1][:3], "scheduled" if local[0].schedule
+                        else "immediately"))
 
-        if peers and not (singular and handler):
+        if len(targets) > len(local):
             log.debug("sending publish %r to %d peers" % (
-                msg[1][:3], len(peers)))
-
-        self.multipush(targets, msg)
+                msg[1][:3], len(targets) - len(local)))
+
+        remote = [t for t in targets if not isinstance(t, LocalTarget)]
+        if remote:
+            # peers get the body packed, so it is only decoded by the one
+            # that handles it, and the frame is only serialized the once
+            packed = (msg[0], msg[1][:3] +
+                    pack(args, kwargs, self.body_codec(remote)))
+
+        if conflate is None:
+            self.multipush(local, msg)
+            if len(remote) == 1:
+                self.multipush(remote, packed)
+            elif remote:
+                # without each connection's own interned ids, and serialized
+                # just once for each codec in use rather than for each peer
+                self.multipush_frames(remote,
+                        self.dump_frames(remote, packed))
+        else:
+            for target in local:
+                target.push_conflated(conflate, msg)
+            for target in remote:
+                if target.up:
+                    target.push_conflated(conflate, packed)
 
-        return bool(handler or peers)
+        return True
 
     def send_publish_udp(self, client, service, routing_id, method, args,
             kwargs, singular=False):
-        # get the peers registered for this publish
-        peers = list(self.find_peer_routes(
-            const.MSG_TYPE_PUBLISH, service, routing_id))
-
-        # handle locally if we have a handler for it
-        handler, schedule = self.find_local_handler(
-                const.MSG_TYPE_PUBLISH, service, routing_id, method)
-
-        targets = peers[:]
-        if handler:
-            targets.append(LocalTarget(self, handler, schedule, client))
-
-        if singular:
-            targets = [self.target_selection(
-                targets, service, routing_id, method)]
-            if not isinstance(targets[0], LocalTarget):
-                handler = None
+        targets = self.publish_routes(
+                client, service, routing_id, method, singular)
+        self.last_values.put(service, routing_id, method, args, kwargs)
+        if not targets:
+            return False
 
         if args and hasattr(args[0], '__iter__') \
                 and not hasattr(args[0], '__len__'):
@@ -349,17 +487,62 @@ class Dispatcher(object):
         msg = (const.MSG_TYPE_PUBLISH, self.hub._ident,
                 (service, routing_id, method, args, kwargs))
 
-        if handler is not None:
+        local = [t for t in targets if isinstance(t, LocalTarget)]
+        if local:
             log.debug("locally handling UDP publish %r %s" %
-                    (msg[1][:3], "scheduled" if schedule else "immediately"))
+                    (msg[2][:3], "scheduled" if local[0].schedule
+                        else "immediately"))
 
-        if peers and not (singular and handler):
+        if len(targets) > len(local):
             log.debug("sending UDP publish %r to %d peers" % (
-                msg[1][:3], len(peers)))
+                msg[2][:3], len(targets) - len(local)))
 
         self.multipush_udp(targets, msg)
 
-        return bool(handler or peers)
+        return True
+
+    def send_publish_many(self, client, messages):
+        # messages are (service, routing_id, method, args, kwargs, singular)
+        for msg in messages:
+            args = msg[3]
+            if args and hasattr(args[0], "__iter__") \
+                    and not hasattr(args[0], "__len__"):
+                raise errors.IllegalMessage("batched publishes cannot be " +
+                        "chunked")
+
+        unroutable = []
+        by_target = collections.OrderedDict()
+        for i, msg in enumerate(messages):
+            service, routing_id, method, args, kwargs, singular = msg
+            self.last_values.put(service, routing_id, method, args, kwargs)
+            targets = self.publish_routes(
+                    client, service, routing_id, method, singular)
+            if not targets:
+                unroutable.append(i)
+                continue
+
+            packed = None
+            for target in targets:
+                entry = msg[:5]
+                if not isinstance(target, LocalTarget):
+                    if packed is None:
+                        packed = msg[:3] + pack(
+                                args, kwargs, self.body_codec(targets))
+                    entry = packed
+                by_target.setdefault(id(target), (target, []))[1].append(
+                        entry)
+
+        for target, entries in by_target.itervalues():
+            if not target.up:
+                continue
+            if len(entries) == 1:
+                target.push((const.MSG_TYPE_PUBLISH, entries[0]))
+            else:
+                log.debug("sending batch_publish of %d to %r" %
+                        (len(entries), target.ident))
+                target.push((const.MSG_TYPE_BATCH_PUBLISH, tuple(entries)))
+
+        return unroutable
 
     def send_chunked_publish(self, service, routing_id, method,
             counter, args, kwargs, targets, proxied=False):
@@ -396,17 +579,18 @@ class Dispatcher(object):
                 err = True
 
             try:
-                msg = connection.dump((msgtype + 3, (counter, rc, chunk)))
+                frames = self.dump_frames(targets,
+                        (msgtype + 3, (counter, rc, chunk)))
             except TypeError:
                 log.error("sending RPC_ERR_UNSER_RESP as final publish chunk")
-                msg = connection.dump((msgtype + 3,
+                frames = self.dump_frames(targets, (msgtype + 3,
                         (counter, const.RPC_ERR_UNSER_RESP, repr(chunk))))
                 err = True
 
             if not err:
                 log.debug("sending publish_chunk %r" % ((counter, rc),))
 
-            self.multipush_str(targets, msg)
+            self.multipush_frames(targets, frames)
             backend.pause()
 
         if not err:
@@ -422,15 +606,44 @@ class Dispatcher(object):
             del self.proxying_channels[peer_ident]
         return entry
 
-    def send_proxied_rpc(
-            self, service, routing_id, method, args, kwargs, singular):
+    def send_proxied_rpc(self, service, routing_id, method, args, kwargs,
+            singular, aggregate=None, coalesce=False, idempotent=False,
+            **options):
+        if singular and aggregate is None and \
+                all(v is None for v in options.itervalues()):
+            return self.cached(service, routing_id, method, args, kwargs,
+                    self._send_proxied_rpc, service, routing_id, method, args,
+                    kwargs, singular, None, coalesce, idempotent)
+        return self._send_proxied_rpc(service, routing_id, method, args,
+                kwargs, singular, aggregate, coalesce, idempotent, **options)
+
+    def _send_proxied_rpc(self, service, routing_id, method, args, kwargs,
+            singular, aggregate=None, coalesce=False, idempotent=False,
+            **options):
+        if coalesce and all(v is None for v in options.itervalues()):
+            key = coalescing_key(
+                    service, routing_id, method, args, kwargs, singular)
+            if key is not None:
+                return self.coalesced(key + (aggregate,),
+                        self._send_proxied_rpc, service, routing_id, method,
+                        args, kwargs, singular, aggregate, False, idempotent)
+
+        msg = (service, routing_id, method, bool(singular))
+        if aggregate is not None:
+            # the hub sends back just the one combined response
+            singular = True
+
         if args and hasattr(args[0], '__iter__') and \
                 not hasattr(args[0], '__len__'):
+            if aggregate is not None:
+                raise errors.IllegalMessage(
+                        "aggregated RPCs cannot be chunked")
             log.debug("sending proxied chunked rpc %r" %
                     ((service, routing_id, method),))
             counter = self.rpc_client.next_counter()
             routes = [self.peers.values()[0]]
-            rpc = self.rpc_client.chunked_request(counter, routes, singular)
+            rpc = self.rpc_client.chunked_request(
+                    counter, routes, singular, **options)
             if rpc:
                 glet = backend.greenlet(self.send_chunked_rpc,
                         args=(service, routing_id, method, args, kwargs,
@@ -440,66 +653,330 @@ class Dispatcher(object):
                 backend.schedule(glet)
             return rpc
 
+        peer = self.peers.values()[0]
+        msg += pack(args, kwargs, peer.codec)
+        if aggregate is not None:
+            msg += (aggregate,)
+
         log.debug("sending proxied_rpc %r" % ((service, routing_id, method),))
-        return self.rpc_client.request(
-                [self.peers.values()[0]],
-                (service, routing_id, method, bool(singular), args, kwargs),
-                singular)[1]
+        counter, rpc = self.rpc_client.request(
+                [self.peers.values()[0]], msg, singular, **options)
+        if idempotent and singular and rpc is not None:
+            # safe to re-send through a standby hub if this one is lost.
+            # a broadcast may already have some of its responses, which a
+            # re-send would deliver again, so only singular ones qualify
+            self.rpc_client.replayable[counter] = msg
+        return rpc
+
+    def send_proxied_rpc_many(self, requests, singular):
+        peer = self.peers.values()[0]
+        batch = []
+        for service, routing_id, method, args, kwargs in requests:
+            if args and hasattr(args[0], '__iter__') and \
+                    not hasattr(args[0], '__len__'):
+                raise errors.IllegalMessage("batched RPCs cannot be chunked")
+            batch.append(([peer], (service, routing_id, method,
+                bool(singular)) + pack(args, kwargs, peer.codec)))
+
+        log.debug("sending %d proxied_rpcs in a batch" % len(batch))
+
+        return [rpc for counter, rpc in
+                self.rpc_client.request_many(batch, singular)]
 
     def target_selection(self, peers, service, routing_id, method):
-        by_addr = {}
-        for peer in peers:
-            if isinstance(peer, LocalTarget):
-                by_addr[None] = peer
-            else:
-                by_addr[peer.ident] = peer
-        choice = hooks._get(self.hooks, 'select_peer')(
-                by_addr.keys(), service, routing_id, method)
-        return by_addr[choice]
+        # leave out ejected peers, unless that would leave nothing at all
+        eligible = [p for p in peers
+                if p.ident is None or self.peer_stats.eligible(p.ident)]
+        return self.selector.select(
+                self, eligible or peers, service, routing_id, method)
+
+    def observe_response(self, peer, counter, rc):
+        self.retries.pop(counter, None)
+
+        sent_at = self.rpc_client.sent_at.get(counter)
+        if sent_at is not None:
+            self.peer_stats.observe_latency(peer.ident, time.time() - sent_at)
+        self.observe_result(peer, rc)
+
+        timing = self.timings.pop(counter, None)
+        if timing is not None:
+            for other in timing['counters']:
+                self.timings.pop(other, None)
+            if not rc:
+                self.method_latencies.observe(
+                        timing['key'], time.time() - timing['start'])
+
+    def observe_result(self, peer, rc):
+        if not peer.ident:
+            return
 
-    def send_rpc(self, service, routing_id, method, args, kwargs,
-            singular):
+        change = self.peer_stats.observe_result(
+                peer.ident, rc in UNHEALTHY_RCS)
+        if change == stats.EJECTED:
+            error_rate = self.peer_stats.error_rate(peer.ident)
+            log.warn("ejecting %r from target selection (error rate %.2f)" %
+                    (peer.ident, error_rate))
+            backend.schedule(hooks._get(self.hooks, "peer_ejected"),
+                    (peer.ident, error_rate))
+        elif change == stats.READMITTED:
+            log.info("readmitting %r to target selection" % (peer.ident,))
+            backend.schedule(hooks._get(self.hooks, "peer_readmitted"),
+                    (peer.ident,))
+
+    def admit(self, peer, service, method, publish):
+        if not self.rate_limiter.limits:
+            return True
+
+        # per-client limits apply to junction.Clients (which have no ident)
+        client = id(peer) if peer.ident is None else None
+        if self.rate_limiter.admit(client, service, method, publish):
+            return True
+
+        log.debug("rate limit refused %s %r from %r" % (
+                "publish" if publish else "rpc_request",
+                (service, method), peer.ident))
+        return False
+
+    def observe_queueing(self, delay):
+        if self.queueing is not None:
+            self.queueing.observe(delay)
+
+    def shed(self, peer, service, method):
+        if self.queueing is None or not self.queueing.overloaded():
+            return False
+
+        self.queueing.shed += 1
+        log.debug("overloaded, shedding rpc_request %r from %r" %
+                ((service, method), peer.ident))
+        return True
+
+    def load_summary(self, peer):
+        return (backend.run_queue_length(), self.pending_handlers,
+                peer.send_queue.qsize())
+
+    def report_load(self):
+        for peer in self.peers.values():
+            if peer.up:
+                peer.push((const.MSG_TYPE_LOAD_REPORT,
+                        self.load_summary(peer)))
+
+    def rpc_routes(self, service, routing_id, method, singular):
         handler, schedule = self.find_local_handler(
                 const.MSG_TYPE_RPC_REQUEST, service, routing_id, method)
         routes = []
         if handler is not None:
             routes.append(LocalTarget(self, handler, schedule))
 
-        peers = list(self.find_peer_routes(
+        routes.extend(self.find_peer_routes(
             const.MSG_TYPE_RPC_REQUEST, service, routing_id))
-        routes.extend(peers)
 
         if singular and len(routes) > 1:
             routes = [self.target_selection(
                     routes, service, routing_id, method)]
-            if not isinstance(routes[0], LocalTarget):
-                handler = None
 
-        if handler is not None:
+        return routes
+
+    def send_rpc(self, service, routing_id, method, args, kwargs,
+            singular, hedge=False, coalesce=False, idempotent=False,
+            **options):
+        if singular and all(v is None for v in options.itervalues()):
+            return self.cached(service, routing_id, method, args, kwargs,
+                    self._send_rpc, service, routing_id, method, args, kwargs,
+                    singular, hedge, coalesce, idempotent)
+        return self._send_rpc(service, routing_id, method, args, kwargs,
+                singular, hedge, coalesce, idempotent, **options)
+
+    def _send_rpc(self, service, routing_id, method, args, kwargs,
+            singular, hedge=False, coalesce=False, idempotent=False,
+            **options):
+        if coalesce and all(v is None for v in options.itervalues()):
+            key = coalescing_key(
+                    service, routing_id, method, args, kwargs, singular)
+            if key is not None:
+                return self.coalesced(key, self._send_rpc, service,
+                        routing_id, method, args, kwargs, singular, hedge,
+                        False, idempotent)
+
+        routes = self.rpc_routes(service, routing_id, method, singular)
+
+        local = [r for r in routes if isinstance(r, LocalTarget)]
+        if local:
             log.debug("locally handling rpc_request %r %s" %
                     ((service, routing_id, method),
-                    "scheduled" if schedule else "immediately"))
+                    "scheduled" if local[0].schedule else "immediately"))
 
-        if peers and not (singular and handler):
+        if len(routes) > len(local):
             log.debug("sending rpc_request %r to %d peers" %
                     ((service, routing_id, method),
-                    len(routes) - bool(handler)))
+                    len(routes) - len(local)))
 
         if args and hasattr(args[0], '__iter__') and \
                 not hasattr(args[0], '__len__'):
             counter = self.rpc_client.next_counter()
-            rpc = self.rpc_client.chunked_request(counter, routes, singular)
+            rpc = self.rpc_client.chunked_request(
+                    counter, routes, singular, **options)
             if rpc:
                 glet = backend.greenlet(self.send_chunked_rpc,
                         args=(service, routing_id, method, args, kwargs,
                             routes, counter, singular))
-                self.register_outgoing_channel(peers,
+                self.register_outgoing_channel(routes,
                         const.MSG_TYPE_REQUEST_IS_CHUNKED, counter, glet)
                 backend.schedule(glet)
             return rpc
 
-        return self.rpc_client.request(routes,
-                (service, routing_id, method, args, kwargs), singular)[1]
+        msg = (service, routing_id, method, args, kwargs)
+        if len(routes) > len(local):
+            msg = msg[:3] + pack(args, kwargs, self.body_codec(routes))
+        counter, rpc = self.rpc_client.request(
+                routes, msg, singular, **options)
+
+        if singular and rpc and not local:
+            timing = self.time_rpc(counter, rpc, msg)
+            if hedge:
+                self.schedule_hedge(timing, rpc, routes[0], msg)
+
+        if singular and rpc and not local and idempotent:
+            self.retry_tokens = min(
+                    self.retry_tokens + self.retry_budget, RETRY_BURST)
+            self.retries[counter] = msg
+
+        return rpc
+
+    def retry(self, peer, counter):
+        msg = self.retries.pop(counter)
+        rpc = self.rpc_client.rpcs.get(counter)
+
+        # once nothing is waiting on the RPC any more (the caller timed out
+        # and let go of it), there's no reason to try again
+        if rpc is None or rpc.complete:
+            return
+
+        if self.retry_tokens < 1:
+            log.debug("retry budget exhausted for %r" % (msg[:3],))
+            return
+
+        # the lost peer's subscriptions are already gone
+        service, routing_id, method = msg[:3]
+        routes = self.rpc_routes(service, routing_id, method, True)
+        if not routes:
+            return
+        target = routes[0]
+
+        self.retry_tokens -= 1
+        log.info("retrying rpc_request %r lost with %r on %r" %
+                (msg[:3], peer.ident, target.ident))
+
+        self.timings.pop(counter, None)
+        counter = self.rpc_client.retry(counter, peer, target, msg)
+        if not isinstance(target, LocalTarget):
+            self.retries[counter] = msg
+
+    def cached(self, service, routing_id, method, args, kwargs, send, *a):
+        # answer from the response cache if we can, or else send it and
+        # cache the response if it succeeds
+        key = self.cache.key(service, routing_id, method, args, kwargs)
+        if key is None:
+            return send(*a)
+
+        value = self.cache.get(service, method, key)
+        if value is not cache.MISS:
+            log.debug("answering rpc_request %r from the response cache" %
+                    ((service, routing_id, method),))
+            return self.rpc_client.completed(value)
+
+        rpc = send(*a)
+        if rpc is not None:
+            rpc.on_finish(lambda value: self.cache.put(
+                service, method, key, value))
+        return rpc
+
+    def coalesced(self, key, send, *args):
+        # attach to an identical RPC that's still in flight, or else send it
+        # and have identical ones attach to it until it completes
+        rpc = self.coalescing.get(key)
+        if rpc is not None:
+            log.debug("coalescing rpc_request %r with one in flight" %
+                    (key[:3],))
+            return rpc
+
+        rpc = send(*args)
+        if rpc is None or rpc.complete:
+            return rpc
+
+        def forget(*args):
+            if self.coalescing.get(key) is rpc:
+                del self.coalescing[key]
+
+        self.coalescing[key] = rpc
+        rpc.on_finish(forget)
+        rpc.on_abort(forget)
+        return rpc
+
+    def time_rpc(self, counter, rpc, msg):
+        entry = {'key': (msg[0], msg[2]), 'start': time.time(),
+                'counters': [counter]}
+        self.timings[counter] = entry
+
+        # a response that never comes (a timeout, or a lost connection)
+        # shouldn't leave the entry behind
+        def forget(*args):
+            for other in entry['counters']:
+                self.timings.pop(other, None)
+
+        rpc.on_finish(forget)
+        rpc.on_abort(forget)
+        return entry
+
+    def schedule_hedge(self, entry, rpc, primary, msg):
+        self.hedge_tokens = min(
+                self.hedge_tokens + self.hedge_budget, HEDGE_BURST)
+
+        # until there are enough response times we can't know when to hedge
+        delay = self.method_latencies.percentile(
+                entry['key'], self.hedge_percentile)
+        if delay is not None:
+            backend.schedule_in(delay, self.send_hedge,
+                    args=(entry, rpc, primary, msg))
+
+    def send_hedge(self, entry, rpc, primary, msg):
+        if rpc.complete:
+            return
+
+        if self.hedge_tokens < 1:
+            log.debug("hedge budget exhausted for %r" % (entry['key'],))
+            return
+
+        service, routing_id, method = msg[:3]
+        routes = [r for r in self.find_peer_routes(
+                    const.MSG_TYPE_RPC_REQUEST, service, routing_id)
+                if r.ident != primary.ident]
+        if not routes:
+            return
+        target = self.target_selection(routes, service, routing_id, method)
+
+        self.hedge_tokens -= 1
+        log.debug("hedging rpc_request %r to %r" % (msg[:3], target.ident))
+
+        counter = self.rpc_client.hedge(rpc, target, msg)
+        entry['counters'].append(counter)
+        self.timings[counter] = entry
+
+    def send_rpc_many(self, requests, singular):
+        # requests are (service, routing_id, method, args, kwargs)
+        batch = []
+        for service, routing_id, method, args, kwargs in requests:
+            if args and hasattr(args[0], '__iter__') and \
+                    not hasattr(args[0], '__len__'):
+                raise errors.IllegalMessage("batched RPCs cannot be chunked")
+            routes = self.rpc_routes(service, routing_id, method, singular)
+            if any(not isinstance(r, LocalTarget) for r in routes):
+                args, kwargs = pack(args, kwargs, self.body_codec(routes))
+            batch.append((routes, (service, routing_id, method, args, kwargs)))
+
+        log.debug("sending %d rpc_requests in batches" % len(batch))
+
+        return [rpc for counter, rpc in
+                self.rpc_client.request_many(batch, singular)]
 
     def send_chunked_rpc(self, service, routing_id, method, args, kwargs,
             targets, counter, singular=False, proxied=False):
@@ -512,7 +989,8 @@ class Dispatcher(object):
         else:
             is_chunked_msg = (msgtype,
                     (service, routing_id, method, counter, args, kwargs))
-        self.multipush_str(targets, connection.dump(is_chunked_msg))
+        self.multipush_frames(targets,
+                self.dump_frames(targets, is_chunked_msg))
 
         chunks = iter(chunks)
         err = False
@@ -537,14 +1015,15 @@ class Dispatcher(object):
                 err = True
 
             try:
-                msg = connection.dump((msgtype + 3, (counter, rc, chunk)))
+                frames = self.dump_frames(targets,
+                        (msgtype + 3, (counter, rc, chunk)))
             except TypeError:
                 log.error("sending RPC_ERR_UNSER_RESP as final request chunk")
-                msg = connection.dump((msgtype + 3,
+                frames = self.dump_frames(targets, (msgtype + 3,
                         (counter, const.RPC_ERR_UNSER_RESP, repr(chunk))))
                 err = True
 
-            self.multipush_str(targets, msg)
+            self.multipush_frames(targets, frames)
             if not err:
                 backend.pause()
 
@@ -610,12 +1089,15 @@ class Dispatcher(object):
                 const.MSG_TYPE_RESPONSE_IS_CHUNKED, counter)
 
     def send_proxied_publish(self, service, routing_id, method, args, kwargs,
-            singular=False):
+            singular=False, conflate=None):
         log.debug("sending proxied_publish %r" %
                 ((service, routing_id, method),))
         peer = self.peers.values()[0]
         if args and hasattr(args[0], "__iter__") \
                 and not hasattr(args[0], "__len__"):
+            if conflate is not None:
+                raise errors.IllegalMessage(
+                        "conflated publishes cannot be chunked")
             counter = self.rpc_client.next_counter()
             glet = backend.greenlet(self.send_chunked_publish,
                     args=(service, routing_id, method, counter,
@@ -623,27 +1105,95 @@ class Dispatcher(object):
             self.register_outgoing_channel([peer],
                     const.MSG_TYPE_PUBLISH_IS_CHUNKED, counter, glet)
             backend.schedule(glet)
-        else:
+        elif conflate is None:
+            args, kwargs = pack(args, kwargs, peer.codec)
             peer.push((const.MSG_TYPE_PROXY_PUBLISH,
                     (service, routing_id, method, args, kwargs, singular)))
+        else:
+            # the hub conflates on the key too when forwarding it
+            args, kwargs = pack(args, kwargs, peer.codec)
+            peer.push_conflated(conflate, (const.MSG_TYPE_PROXY_PUBLISH,
+                    (service, routing_id, method, args, kwargs, singular,
+                        conflate)))
+
+    def send_proxied_publish_many(self, messages):
+        for msg in messages:
+            args = msg[3]
+            if args and hasattr(args[0], "__iter__") \
+                    and not hasattr(args[0], "__len__"):
+                raise errors.IllegalMessage("batched publishes cannot be " +
+                        "chunked")
+
+        log.debug("sending %d proxied_publishes in a batch" % len(messages))
+        peer = self.peers.values()[0]
+        peer.push((const.MSG_TYPE_PROXY_BATCH_PUBLISH,
+                tuple(msg[:3] + pack(msg[3], msg[4], peer.codec) + msg[5:]
+                    for msg in messages)))
+
+    def handler_args(self, handler, args, kwargs):
+        # bodies are decoded only now that a handler is about to run, and
+        # not at all for handlers that take them raw
+        if handler in self.raw_handlers:
+            return (pack(args, kwargs)[0],), {}
+        return unpack(args, kwargs)
+
+    def publish_handler(self, handler, msg, source, args, kwargs,
+            queued_at=None):
+        if queued_at is not None:
+            self.observe_queueing(time.time() - queued_at)
+
+        try:
+            args, kwargs = self.handler_args(handler, args, kwargs)
+        except (TypeError, ValueError):
+            log.warn("received undecodable publish %r from %r" %
+                    (msg, source))
+            return
 
-    def publish_handler(self, handler, msg, source, args, kwargs):
         log.debug("executing publish handler for %r from %r" % (msg, source))
+        self.pending_handlers += 1
         try:
             handler(*args, **kwargs)
         except Exception:
             log.error("exception handling publish %r from %r" % (msg, source))
             backend.handle_exception(*sys.exc_info())
+        finally:
+            self.pending_handlers -= 1
 
     def rpc_handler(self, peer, counter, handler, args, kwargs,
-            proxied=False, scheduled=False):
+            proxied=False, scheduled=False, queued_at=None):
+        if queued_at is not None:
+            self.observe_queueing(time.time() - queued_at)
+
         req_type = "proxy_request" if proxied else "rpc_request"
+
+        body = (args, kwargs)
+        try:
+            args, kwargs = self.handler_args(handler, args, kwargs)
+        except (TypeError, ValueError):
+            log.warn("received undecodable %s %d from %r" %
+                    (req_type, counter, peer.ident))
+            self.send_rpc_response(
+                    peer, counter, const.RPC_ERR_MALFORMED, None, proxied)
+            return
+
+        key = None
+        if handler in self.coalesced_handlers:
+            try:
+                key = (handler, mummy.dumps((args, kwargs)))
+            except TypeError:
+                pass
+            else:
+                if key in self.serving:
+                    log.debug("coalescing %s handler for %d from %r" %
+                            (req_type, counter, peer.ident))
+                    self.serving[key].append((peer, counter, proxied))
+                    return
+                self.serving[key] = []
+
         log.debug("executing %s handler for %d from %r" %
                 (req_type, counter, peer.ident))
 
-        response = (proxied and const.MSG_TYPE_PROXY_RESPONSE
-                or const.MSG_TYPE_RPC_RESPONSE)
-
+        self.pending_handlers += 1
         try:
             rc = 0
             result = handler(*args, **kwargs)
@@ -675,8 +1225,19 @@ class Dispatcher(object):
             rc = const.RPC_ERR_UNKNOWN
             result = ''.join(traceback.format_exception(*sys.exc_info()))
             backend.handle_exception(*sys.exc_info())
+        finally:
+            self.pending_handlers -= 1
+
+        waiters = self.serving.pop(key, ()) if key is not None else ()
 
         if hasattr(result, "__iter__") and not hasattr(result, "__len__"):
+            # a generator can't be shared, so any identical requests that
+            # were waiting on this one get the handler run for them again
+            for w_peer, w_counter, w_proxied in waiters:
+                backend.schedule(self.rpc_handler,
+                        args=(w_peer, w_counter, handler) + body,
+                        kwargs={'proxied': w_proxied, 'scheduled': True})
+
             if scheduled:
                 self.register_outgoing_channel([peer],
                         const.MSG_TYPE_RESPONSE_IS_CHUNKED, counter,
@@ -690,8 +1251,26 @@ class Dispatcher(object):
                 backend.schedule(glet)
             return
 
+        self.send_rpc_response(peer, counter, rc, result, proxied)
+        for w_peer, w_counter, w_proxied in waiters:
+            self.send_rpc_response(w_peer, w_counter, rc, result, w_proxied)
+
+    def send_rpc_response(self, peer, counter, rc, result, proxied,
+            failures=()):
+        req_type = "proxy_request" if proxied else "rpc_request"
+        response = (proxied and const.MSG_TYPE_PROXY_RESPONSE
+                or const.MSG_TYPE_RPC_RESPONSE)
+
+        msg = (counter, rc, result)
+        if not proxied and peer.ident:
+            # let the requesting hub know how busy we are
+            msg += (self.load_summary(peer),)
+        elif proxied and failures:
+            # the error responses left out of an aggregated result
+            msg += (failures,)
+
         try:
-            msg = peer.dump((response, (counter, rc, result)))
+            msg = peer.dump((response, msg))
         except TypeError:
             log.error("responding with RPC_ERR_UNSER_RESP to %s %d" %
                     (req_type, counter))
@@ -821,6 +1400,9 @@ class Dispatcher(object):
 
         service, routing_id, method, args, kwargs = msg
 
+        if not self.admit(peer, service, method, True):
+            return
+
         handler, schedule = self.find_local_handler(
                 const.MSG_TYPE_PUBLISH, service, routing_id, method)
         if handler is None:
@@ -829,13 +1411,16 @@ class Dispatcher(object):
                     (msg[:3], peer.ident))
             return
 
+        self.last_values.put(service, routing_id, method, args, kwargs)
+
         log.debug("handling publish %r from %r %s" %
                 (msg[:3], peer.ident,
                 "scheduled" if schedule else "immediately"))
 
         if schedule:
             backend.schedule(self.publish_handler,
-                    args=(handler, msg[:3], peer.ident, args, kwargs))
+                    args=(handler, msg[:3], peer.ident, args, kwargs),
+                    kwargs={'queued_at': time.time()})
         else:
             self.publish_handler(handler, msg[:3], peer.ident, args, kwargs)
 
@@ -847,6 +1432,16 @@ class Dispatcher(object):
 
         counter, service, routing_id, method, args, kwargs = msg
 
+        if not self.admit(peer, service, method, False):
+            peer.push((const.MSG_TYPE_RPC_RESPONSE,
+                    (counter, const.RPC_ERR_THROTTLED, None)))
+            return
+
+        if self.shed(peer, service, method):
+            peer.push((const.MSG_TYPE_RPC_RESPONSE,
+                    (counter, const.RPC_ERR_OVERLOADED, None)))
+            return
+
         handler, schedule = self.find_local_handler(
                 const.MSG_TYPE_RPC_REQUEST, service, routing_id, method)
         if handler is None:
@@ -872,18 +1467,107 @@ class Dispatcher(object):
         if schedule:
             backend.schedule(self.rpc_handler,
                     args=(peer, counter, handler, args, kwargs),
-                    kwargs={'scheduled': True})
+                    kwargs={'scheduled': True, 'queued_at': time.time()})
         else:
             self.rpc_handler(peer, counter, handler, args, kwargs)
 
+    def incoming_codec(self, peer, msg):
+        if msg not in codecs.CODECS:
+            log.warn("received unknown codec %r from %r" % (msg, peer.ident))
+            return
+
+        log.debug("switching to codec %r from %r" % (msg, peer.ident))
+
+        peer.codec_in = codecs.CODECS[msg]
+
+    def incoming_intern(self, peer, msg):
+        if not isinstance(msg, tuple) or len(msg) != 3 or \
+                not isinstance(msg[0], (int, long)):
+            # drop malformed messages
+            log.warn("received malformed intern from %r" % (peer.ident,))
+            return
+
+        log.debug("received intern %r from %r" % (msg, peer.ident))
+
+        peer.interns[msg[0]] = msg[1:]
+
+    def incoming_publish_interned(self, peer, msg):
+        if not isinstance(msg, tuple) or len(msg) != 4 or \
+                not isinstance(msg[0], (int, long)):
+            # drop malformed messages
+            log.warn("received malformed publish_interned from %r" %
+                    (peer.ident,))
+            return
+
+        ident, routing_id, args, kwargs = msg
+        if ident not in peer.interns:
+            log.warn("received publish_interned with unknown id %r from %r" %
+                    (ident, peer.ident))
+            return
+
+        service, method = peer.interns[ident]
+        self.incoming_publish(
+                peer, (service, routing_id, method, args, kwargs))
+
+    def incoming_rpc_request_interned(self, peer, msg):
+        if not isinstance(msg, tuple) or len(msg) != 5 or \
+                not isinstance(msg[1], (int, long)):
+            # drop malformed messages
+            log.warn("received malformed rpc_request_interned from %r" %
+                    (peer.ident,))
+            return
+
+        counter, ident, routing_id, args, kwargs = msg
+        if ident not in peer.interns:
+            log.warn("received rpc_request_interned with unknown id %r "
+                    "from %r" % (ident, peer.ident))
+            peer.push((const.MSG_TYPE_RPC_RESPONSE,
+                    (counter, const.RPC_ERR_MALFORMED, None)))
+            return
+
+        service, method = peer.interns[ident]
+        self.incoming_rpc_request(
+                peer, (counter, service, routing_id, method, args, kwargs))
+
+    def incoming_batch_publish(self, peer, msg):
+        if not isinstance(msg, tuple):
+            # drop malformed messages
+            log.warn("received malformed batch_publish from %r" %
+                    (peer.ident,))
+            return
+
+        log.debug("received batch_publish of %d from %r" %
+                (len(msg), peer.ident))
+
+        for entry in msg:
+            self.incoming_publish(peer, entry)
+
+    def incoming_batch_request(self, peer, msg):
+        if not isinstance(msg, tuple):
+            # drop malformed messages
+            log.warn("received malformed batch_request from %r" %
+                    (peer.ident,))
+            return
+
+        log.debug("received batch_request of %d from %r" %
+                (len(msg), peer.ident))
+
+        for entry in msg:
+            self.incoming_rpc_request(peer, entry)
+
     def incoming_rpc_response(self, peer, msg):
-        if not isinstance(msg, tuple) or len(msg) != 3:
+        if not isinstance(msg, tuple) or len(msg) not in (3, 4):
             # drop malformed responses
             log.warn("received malformed rpc_response from %r" % (peer.ident,))
             return
 
+        if len(msg) == 4:
+            self.incoming_load_report(peer, msg[3])
+            msg = msg[:3]
         counter, rc, result = msg
 
+        self.observe_response(peer, counter, rc)
+
         if counter in self.inflight_proxies:
             log.debug("received a proxied response %r from %r" %
                     (msg[:2], peer.ident))
@@ -899,6 +1583,14 @@ class Dispatcher(object):
 
         self.rpc_client.response(peer, counter, rc, result)
 
+    def incoming_load_report(self, peer, msg):
+        if (not isinstance(msg, tuple) or len(msg) != 3 or
+                not all(isinstance(x, (int, long)) for x in msg)):
+            log.warn("received malformed load_report from %r" % (peer.ident,))
+            return
+
+        self.peer_stats.observe_load(peer.ident, msg)
+
     def proxied_response(self, counter, rc, result):
         entry = self.inflight_proxies[counter]
         entry['awaiting'] -= 1
@@ -908,95 +1600,223 @@ class Dispatcher(object):
         log.debug("forwarding proxied response to %r, %d remaining" %
                 (entry['peer'].ident, entry['awaiting']))
 
+        if not rc and entry.get('cache'):
+            service, method, key = entry['cache']
+            self.cache.put(service, method, key, result)
+
         entry['peer'].push((const.MSG_TYPE_PROXY_RESPONSE,
                 (entry['client_counter'], rc, result)))
 
     def incoming_proxy_publish(self, peer, msg):
-        if not isinstance(msg, tuple) or len(msg) != 6:
+        if not isinstance(msg, tuple) or len(msg) not in (6, 7) or \
+                not _hashable(msg[6:]):
             # drop malformed messages
             log.warn("received malformed proxy_publish from %r" %
                     (peer.ident,))
             return
 
+        if not self.admit(peer, msg[0], msg[2], True):
+            return
+
         log.debug("forwarding a proxy_publish %r from %r" %
                 (msg[:3], peer.ident))
 
-        self.send_publish(peer, *(msg[:5] + (True, msg[5])))
+        # an optional 7th element is the key to conflate it on
+        self.send_publish(peer, *(msg[:5] + (True,) + msg[5:]))
+
+    def incoming_proxy_batch_publish(self, peer, msg):
+        if not isinstance(msg, tuple) or not all(
+                isinstance(m, tuple) and len(m) == 6 for m in msg):
+            # drop malformed messages
+            log.warn("received malformed proxy_batch_publish from %r" %
+                    (peer.ident,))
+            return
+
+        msg = tuple(m for m in msg if self.admit(peer, m[0], m[2], True))
+
+        log.debug("forwarding a proxy_batch_publish of %d from %r" %
+                (len(msg), peer.ident))
+
+        try:
+            self.send_publish_many(peer, msg)
+        except errors.IllegalMessage:
+            log.warn("received chunked publish in proxy_batch_publish " +
+                    "from %r" % (peer.ident,))
 
     def incoming_proxy_request(self, peer, msg):
-        if not isinstance(msg, tuple) or len(msg) != 7:
+        if not isinstance(msg, tuple) or len(msg) not in (7, 8):
             # drop badly formed messages
             log.warn("received malformed proxy_request from %r" %
                     (peer.ident,))
             return
-        cli_counter, service, routing_id, method, singular, args, kwargs = msg
 
-        # find local handlers
-        handler, schedule = self.find_local_handler(
-                const.MSG_TYPE_RPC_REQUEST, service, routing_id, method)
+        self.proxy_requests(peer, [msg])
 
-        # find remote targets and count up total handlers
-        targets = list(self.find_peer_routes(
-                const.MSG_TYPE_RPC_REQUEST, service, routing_id))
-        target_count = len(targets) + bool(handler)
-
-        # pick the single target for 'singular' proxy RPCs
-        if target_count > 1 and singular:
-            target_count = 1
-            target = self.target_selection(
-                    targets + [LocalTarget(self, handler, schedule, client)],
-                    service, routing_id, method)
-            if isinstance(target, LocalTarget):
-                targets = []
-            else:
-                handler = None
-                targets = [target]
+    def incoming_proxy_batch_request(self, peer, msg):
+        if not isinstance(msg, tuple) or not all(
+                isinstance(m, tuple) and len(m) in (7, 8) for m in msg):
+            # drop badly formed messages
+            log.warn("received malformed proxy_batch_request from %r" %
+                    (peer.ident,))
+            return
 
-        # handle it locally if it's aimed at us
-        if handler is not None:
-            log.debug("locally handling proxy_request %r %s" % (
-                    msg[:4], "scheduled" if schedule else "immediately"))
-            if schedule:
-                backend.schedule(self.rpc_handler,
-                        args=(peer, cli_counter, handler, args, kwargs),
-                        kwargs={'proxied': True, 'scheduled': True})
-            else:
-                self.rpc_handler(
-                        peer, cli_counter, handler, args, kwargs, True)
+        log.debug("received proxy_batch_request of %d from %r" %
+                (len(msg), peer.ident))
+
+        self.proxy_requests(peer, msg)
 
-        if targets:
-            log.debug("forwarding proxy_request %r to %d peers" %
-                    (msg[:4], target_count - bool(handler)))
+    def proxy_requests(self, peer, requests):
+        forwards = []
+        counts = []
+        for msg in requests:
+            (cli_counter, service, routing_id, method, singular,
+                    args, kwargs) = msg[:7]
 
-            counter, rpc = self.rpc_client.request(
-                    targets, (service, routing_id, method, args, kwargs))
+            if not self.admit(peer, service, method, False):
+                counts.append(
+                        (cli_counter, 1, (const.RPC_ERR_THROTTLED, None)))
+                continue
+
+            if self.shed(peer, service, method):
+                counts.append(
+                        (cli_counter, 1, (const.RPC_ERR_OVERLOADED, None)))
+                continue
 
+            if len(msg) == 8 and not singular:
+                counts.append(self.proxy_aggregated(peer, msg[7], cli_counter,
+                        service, routing_id, method, args, kwargs))
+                continue
+
+            cache_key = None
+            if singular:
+                cache_key = self.cache.key(
+                        service, routing_id, method, args, kwargs)
+            if cache_key is not None:
+                value = self.cache.get(service, method, cache_key)
+                if value is not cache.MISS:
+                    log.debug("answering proxy_request %r from the "
+                            "response cache" % (msg[:4],))
+                    counts.append((cli_counter, 1, (0, value)))
+                    continue
+
+            # find local handlers
+            handler, schedule = self.find_local_handler(
+                    const.MSG_TYPE_RPC_REQUEST, service, routing_id, method)
+
+            # find remote targets and count up total handlers
+            targets = list(self.find_peer_routes(
+                    const.MSG_TYPE_RPC_REQUEST, service, routing_id))
+            target_count = len(targets) + bool(handler)
+
+            # pick the single target for 'singular' proxy RPCs
+            if target_count > 1 and singular:
+                target_count = 1
+                if handler is not None:
+                    targets.append(LocalTarget(self, handler, schedule, peer))
+                target = self.target_selection(
+                        targets, service, routing_id, method)
+                if isinstance(target, LocalTarget):
+                    targets = []
+                else:
+                    handler = None
+                    targets = [target]
+
+            # handle it locally if it's aimed at us
+            if handler is not None:
+                log.debug("locally handling proxy_request %r %s" % (
+                        msg[:4], "scheduled" if schedule else "immediately"))
+                if schedule:
+                    backend.schedule(self.rpc_handler,
+                            args=(peer, cli_counter, handler, args, kwargs),
+                            kwargs={'proxied': True, 'scheduled': True,
+                                'queued_at': time.time()})
+                else:
+                    self.rpc_handler(
+                            peer, cli_counter, handler, args, kwargs, True)
+
+            if targets:
+                log.debug("forwarding proxy_request %r to %d peers" %
+                        (msg[:4], target_count - bool(handler)))
+                forwards.append((cli_counter, targets,
+                        (service, routing_id, method, args, kwargs),
+                        cache_key and (service, method, cache_key)))
+
+            response = None
+            if handler is None and not targets and self.locally_handles(
+                    const.MSG_TYPE_RPC_REQUEST, service, routing_id):
+                # if there are no remote handlers and we only fail locally
+                # because of the method, send a NOMETHOD error and include
+                # ourselves in the target_count so the client can distinguish
+                # between "no method" and "unroutable"
+                log.warn("received proxy_request %r for unknown method" %
+                        (msg[:4],))
+                target_count += 1
+                response = (const.RPC_ERR_NOMETHOD, None)
+
+            counts.append((cli_counter, target_count, response))
+
+        # requests forwarded to the same peer go out together in one frame
+        sent = self.rpc_client.request_many(
+                [(targets, fwd) for cli_counter, targets, fwd, c in forwards])
+        for (cli_counter, targets, fwd, caching), (counter, rpc) in zip(
+                forwards, sent):
             self.inflight_proxies[counter] = {
                 'awaiting': len(targets),
                 'client_counter': cli_counter,
                 'peer': peer,
+                'cache': caching,
             }
 
-        send_nomethod = False
-        if handler is None and not targets and self.locally_handles(
-                const.MSG_TYPE_RPC_REQUEST, service, routing_id):
-            # if there are no remote handlers and we only fail locally because
-            # of the method, send a NOMETHOD error and include ourselves in the
-            # target_count so the client can distinguish between "no method"
-            # and "unroutable"
-            log.warn("received proxy_request %r for unknown method" %
-                    (msg[:4],))
-            target_count += 1
-            send_nomethod = True
-
-        peer.push((const.MSG_TYPE_PROXY_RESPONSE_COUNT,
-                (cli_counter, target_count)))
-
-        # must send the response after the response_count
-        # or the client gets confused
-        if send_nomethod:
-            peer.push((const.MSG_TYPE_PROXY_RESPONSE,
-                (cli_counter, const.RPC_ERR_NOMETHOD, None)))
+        for cli_counter, target_count, response in counts:
+            peer.push((const.MSG_TYPE_PROXY_RESPONSE_COUNT,
+                    (cli_counter, target_count)))
+
+            # must send the response after the response_count
+            # or the client gets confused
+            if response is not None:
+                peer.push((const.MSG_TYPE_PROXY_RESPONSE,
+                    (cli_counter,) + response))
+
+    def proxy_aggregated(self, peer, name, cli_counter, service, routing_id,
+            method, args, kwargs):
+        # broadcast it ourselves, folding the responses together with the
+        # named aggregator, and send the client a single PROXY_RESPONSE
+        if name not in self.aggregators:
+            log.warn("received proxy_request %r for unknown aggregator %r" %
+                    ((cli_counter, service, routing_id, method), name))
+            return (cli_counter, 1,
+                    (const.RPC_ERR_UNKNOWN, "unknown aggregator %r" % (name,)))
+
+        func, initial = self.aggregators[name]
+        rpc = self.send_rpc(service, routing_id, method, args, kwargs, False,
+                reducer=func, initial=copy.deepcopy(initial))
+        if rpc is None:
+            return (cli_counter, 0, None)
+
+        log.debug("aggregating proxy_request %r with %r over %d peers" %
+                ((cli_counter, service, routing_id, method), name,
+                    rpc.target_count))
+
+        # the rpc client only holds RPCs weakly
+        key = (id(peer), cli_counter)
+        self.aggregating[key] = rpc
+
+        def respond(value):
+            del self.aggregating[key]
+            # the errors didn't fold in, so the client gets them separately
+            self.send_rpc_response(peer, cli_counter, 0, value, True,
+                    tuple(rpc._failures))
+
+        def fail(klass, exc, tb):
+            del self.aggregating[key]
+            peer.push((const.MSG_TYPE_PROXY_RESPONSE, (cli_counter,
+                    const.RPC_ERR_UNKNOWN, "aggregator %r failed: %r" %
+                    (name, exc))))
+
+        rpc.on_finish(respond)
+        rpc.on_abort(fail)
+
+        return (cli_counter, 1, None)
 
     def incoming_proxy_query_count(self, peer, msg):
         if not isinstance(msg, tuple) or len(msg) != 5:
@@ -1019,14 +1839,54 @@ class Dispatcher(object):
 
         peer.push((const.MSG_TYPE_PROXY_RESPONSE, (counter, 0, target_count)))
 
+    def incoming_proxy_query_last_value(self, peer, msg):
+        if not isinstance(msg, tuple) or len(msg) != 4:
+            # drop malformed queries
+            log.warn("received malformed proxy_query_last_value from %r" %
+                    (peer.ident,))
+            return
+        counter, service, routing_id, method = msg
+
+        log.debug("received proxy_query_last_value %r from %r" %
+                (msg, peer.ident))
+
+        peer.push((const.MSG_TYPE_PROXY_RESPONSE, (counter, 0,
+                self.last_values.get(service, routing_id, method))))
+
+    def incoming_proxy_watch_routes(self, peer, msg):
+        if msg != ():
+            # drop malformed requests
+            log.warn("received malformed proxy_watch_routes from %r" %
+                    (peer.ident,))
+            return
+
+        log.debug("received proxy_watch_routes from %r" % (peer.ident,))
+
+        self.route_watchers[id(peer)] = peer
+        peer.push((const.MSG_TYPE_PROXY_ROUTES, self.routing_table()))
+
+    def incoming_proxy_routes(self, peer, msg):
+        if not isinstance(msg, list) or not all(
+                isinstance(x, tuple) and len(x) == 2 and
+                isinstance(x[1], list) for x in msg):
+            # drop malformed tables
+            log.warn("received malformed proxy_routes from %r" %
+                    (peer.ident,))
+            return
+
+        log.debug("received proxy_routes from %r" % (peer.ident,))
+
+        self.rpc_client.routes(msg)
+
     def incoming_proxy_response(self, peer, msg):
-        if not isinstance(msg, tuple) or len(msg) != 3:
+        if not isinstance(msg, tuple) or len(msg) not in (3, 4) or (
+                len(msg) == 4 and not isinstance(msg[3], tuple)):
             # drop malformed responses
             log.warn("received malformed proxy_response from %r" %
                     (peer.ident,))
             return
 
-        counter, rc, result = msg
+        counter, rc, result = msg[:3]
 
         if counter not in self.rpc_client.inflight:
             # drop mistaken responses
@@ -1037,6 +1897,12 @@ class Dispatcher(object):
         log.debug("received proxy_response %r from %r" %
                 (msg[:2], peer.ident))
 
+        if len(msg) == 4:
+            rpc = self.rpc_client.rpcs.get(counter)
+            if rpc is not None:
+                rpc._forwarded_errors([f for f in msg[3]
+                    if isinstance(f, tuple) and len(f) == 3])
+
         self.rpc_client.response(peer, counter, rc, result)
 
     def incoming_proxy_response_count(self, peer, msg):
@@ -1063,6 +1929,10 @@ class Dispatcher(object):
         log.debug("received proxy_publish_is_chunked %r from %r" %
                 (msg[:4], peer.addr))
 
+        # the chunks that follow are dropped along with it
+        if not self.admit(peer, service, method, True):
+            return
+
         dest_counter = self.rpc_client.next_counter()
         peers = list(self.find_peer_routes(
                 const.MSG_TYPE_PUBLISH, service, routing_id))
@@ -1135,6 +2005,10 @@ class Dispatcher(object):
 
         service, routing_id, method, counter, args, kwargs = msg
 
+        # the chunks that follow are dropped along with it
+        if not self.admit(peer, service, method, True):
+            return
+
         handler, schedule = self.find_local_handler(
                 const.MSG_TYPE_PUBLISH, service, routing_id, method)
         if handler is None:
@@ -1189,6 +2063,11 @@ class Dispatcher(object):
 
         service, routing_id, method, counter, args, kwargs = msg
 
+        if not self.admit(peer, service, method, False):
+            peer.push((const.MSG_TYPE_RPC_RESPONSE,
+                    (counter, const.RPC_ERR_THROTTLED, None)))
+            return
+
         handler, schedule = self.find_local_handler(
                 const.MSG_TYPE_RPC_REQUEST, service, routing_id, method)
         if handler is None:
@@ -1258,6 +2137,13 @@ class Dispatcher(object):
         log.debug("received proxy_request_is_chunked %r from %r" %
                 (msg[:4], peer.addr))
 
+        if not self.admit(peer, service, method, False):
+            peer.push((const.MSG_TYPE_PROXY_RESPONSE_COUNT,
+                (source_counter, 1)))
+            peer.push((const.MSG_TYPE_PROXY_RESPONSE,
+                (source_counter, const.RPC_ERR_THROTTLED, None)))
+            return
+
         peers = list(self.find_peer_routes(
             const.MSG_TYPE_RPC_REQUEST, service, routing_id))
         targets = peers[:]
@@ -1359,6 +2245,8 @@ class Dispatcher(object):
                     (peer.ident,))
             return
 
+        self.observe_response(peer, msg, 0)
+
         if msg in self.inflight_proxies:
             log.debug("received a proxied response_is_chunked %r from %r" %
                     (msg, peer.ident))
@@ -1486,6 +2374,13 @@ class Dispatcher(object):
         const.MSG_TYPE_PROXY_RESPONSE: incoming_proxy_response,
         const.MSG_TYPE_PROXY_RESPONSE_COUNT: incoming_proxy_response_count,
         const.MSG_TYPE_PROXY_QUERY_COUNT: incoming_proxy_query_count,
+        const.MSG_TYPE_PROXY_QUERY_LAST_VALUE: incoming_proxy_query_last_value,
+        const.MSG_TYPE_PROXY_WATCH_ROUTES: incoming_proxy_watch_routes,
+        const.MSG_TYPE_PROXY_ROUTES: incoming_proxy_routes,
+        const.MSG_TYPE_CODEC: incoming_codec,
+        const.MSG_TYPE_INTERN: incoming_intern,
+        const.MSG_TYPE_PUBLISH_INTERNED: incoming_publish_interned,
+        const.MSG_TYPE_RPC_REQUEST_INTERNED: incoming_rpc_request_interned,
         const.MSG_TYPE_PUBLISH_IS_CHUNKED: incoming_publish_is_chunked,
         const.MSG_TYPE_PUBLISH_CHUNK: incoming_publish_chunk,
         const.MSG_TYPE_PUBLISH_END_CHUNKS: incoming_publish_end_chunks,
@@ -1511,9 +2406,58 @@ class Dispatcher(object):
         const.MSG_TYPE_PROXY_RESPONSE_CHUNK: incoming_proxy_response_chunk,
         const.MSG_TYPE_PROXY_RESPONSE_END_CHUNKS:
                 incoming_proxy_response_end_chunks,
+
+        const.MSG_TYPE_BATCH_PUBLISH: incoming_batch_publish,
+        const.MSG_TYPE_BATCH_REQUEST: incoming_batch_request,
+        const.MSG_TYPE_PROXY_BATCH_PUBLISH: incoming_proxy_batch_publish,
+        const.MSG_TYPE_PROXY_BATCH_REQUEST: incoming_proxy_batch_request,
+        const.MSG_TYPE_LOAD_REPORT: incoming_load_report,
     }
 
 
+def conflation_key(conflate, service, routing_id, method):
+    # the ``conflate`` argument to publishes is True for the default key,
+    # or a key of the caller's own
+    if conflate is True:
+        return (service, routing_id, method)
+    if conflate is False:
+        return None
+    return conflate
+
+
+def pack(args, kwargs, codec=codecs.MUMMY):
+    # serialize a publish or request body up front, so hubs can route and
+    # forward it on (service, routing_id, method) alone, passing the bytes
+    # along untouched. it travels in place of the args, with kwargs of None,
+    # and starts with the codec's tag so any hub can decode it
+    if kwargs is None:
+        return args, None
+    return codec.tag + connection.dumps((args, kwargs), codec), None
+
+
+def unpack(args, kwargs):
+    if kwargs is None:
+        args, kwargs = connection.loads(args[1:], codecs.body_codec(args))
+    return args, kwargs
+
+
+def _hashable(obj):
+    try:
+        hash(obj)
+    except TypeError:
+        return False
+    return True
+
+
+def coalescing_key(service, routing_id, method, args, kwargs, singular):
+    try:
+        return (service, routing_id, method, singular,
+                mummy.dumps((args, kwargs)))
+    except TypeError:
+        # unserializable (or chunked) arguments
+        return None
+
+
 class LocalTarget(object):
     def __init__(self, dispatcher, handler, schedule, client=None,
             client_counter=None):
@@ -1522,12 +2466,22 @@ class LocalTarget(object):
         self.schedule = schedule
         self.ident = None
         self.up = True
+        self.codec = None
         self.client = client
         self.client_counter = client_counter
 
     def push(self, msg):
         msgtype, msg = msg
-        if msgtype == const.MSG_TYPE_RPC_REQUEST:
+        if msgtype == const.MSG_TYPE_BATCH_PUBLISH:
+            # batches are grouped by target, and this one is local
+            for entry in msg:
+                self.push((const.MSG_TYPE_PUBLISH, entry))
+
+        elif msgtype == const.MSG_TYPE_BATCH_REQUEST:
+            for entry in msg:
+                self.push((const.MSG_TYPE_RPC_REQUEST, entry))
+
+        elif msgtype == const.MSG_TYPE_RPC_REQUEST:
             counter, service, routing_id, method, args, kwargs = msg
             if self.schedule:
                 backend.schedule(self.dispatcher.rpc_handler,
@@ -1543,6 +2497,13 @@ class LocalTarget(object):
 
         elif msgtype == const.MSG_TYPE_PUBLISH:
             service, routing_id, method, args, kwargs = msg
+            try:
+                args, kwargs = self.dispatcher.handler_args(
+                        self.handler, args, kwargs)
+            except (TypeError, ValueError):
+                log.warn("undecodable local publish %r" %
+                        ((service, routing_id, method),))
+                return
             if self.schedule:
                 backend.schedule(self.handler, args=args, kwargs=kwargs)
             else:
@@ -1584,6 +2545,10 @@ class LocalTarget(object):
     # we'll skip the "dump" phase and just "push" the object itself
     push_string = push
 
+    def push_conflated(self, key, msg):
+        # nothing queues up on the way to a local handler
+        self.push(msg)
+
     def dump(self, msg):
         return msg
 
@@ -1635,6 +2600,14 @@ def _check_error(log, source_peer, rc, data):
                 (source_peer,))
         return errors.BadArguments(data)
 
+    if rc == const.RPC_ERR_THROTTLED:
+        log.error("request refused by a rate limit at %r" % (source_peer,))
+        return errors.Throttled(source_peer)
+
+    if rc == const.RPC_ERR_OVERLOADED:
+        log.error("request shed by overloaded %r" % (source_peer,))
+        return errors.Overloaded(source_peer)
+
     log.error("error message with unrecognized return code from %r" %
             (source_peer,))
     return errors.UnrecognizedRemoteProblem(source_peer, rc, data)
@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+
+import time
+
+
+class TokenBucket(object):
+    'Allows ``rate`` messages a second, with bursts of up to ``burst``'
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.time()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.burst,
+                self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return self.tokens
+
+
+class RateLimiter(object):
+    '''Admission control for incoming publishes and RPCs
+
+    A limit applies to everything, to one service, or to one service's
+    method, and either to all senders together or separately to each
+    connected client. A message is only admitted if every limit covering it
+    has a token to spare.
+    '''
+
+    def __init__(self):
+        # (service, method, per_client): (rate, burst)
+        self.limits = {}
+
+        # (service, method, client id or None): TokenBucket
+        self.buckets = {}
+
+        # (service, method): {'dropped': count, 'throttled': count}
+        self.refused = {}
+
+    def limit(self, rate, burst, service=None, method=None, per_client=False):
+        self.limits[(service, method, per_client)] = (rate, burst)
+        for key in self.buckets.keys():
+            if key[:2] == (service, method) and \
+                    (key[2] is not None) == per_client:
+                del self.buckets[key]
+
+    def unlimit(self, service=None, method=None, per_client=False):
+        if self.limits.pop((service, method, per_client), None) is None:
+            return False
+        for key in self.buckets.keys():
+            if key[:2] == (service, method) and \
+                    (key[2] is not None) == per_client:
+                del self.buckets[key]
+        return True
+
+    def admit(self, client, service, method, publish):
+        '''Take a token from every bucket covering a message
+
+        :param client: the ``id()`` of the sending client, or ``None``
+        :param bool publish: whether it is a publish (or else an RPC)
+
+        :returns: whether the message was admitted
+        '''
+        buckets = []
+        for (lservice, lmethod, per_client), (rate, burst) in \
+                self.limits.iteritems():
+            if lservice is not None and lservice != service:
+                continue
+            if lmethod is not None and lmethod != method:
+                continue
+            if per_client and client is None:
+                continue
+
+            key = (lservice, lmethod, client if per_client else None)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(rate, burst)
+
+            if bucket.refill() < 1:
+                counts = self.refused.setdefault(
+                        (service, method), {'dropped': 0, 'throttled': 0})
+                counts['dropped' if publish else 'throttled'] += 1
+                return False
+            buckets.append(bucket)
+
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return True
+
+    def forget(self, client):
+        for key in self.buckets.keys():
+            if key[2] == client:
+                del self.buckets[key]
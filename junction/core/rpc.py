@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+import collections
+import time
 import weakref
 
 from . import backend, connection, const
@@ -9,11 +11,13 @@ from .. import errors, futures
 class RPCClient(object):
     REQUEST = const.MSG_TYPE_RPC_REQUEST
     CHUNKED_REQUEST = const.MSG_TYPE_REQUEST_IS_CHUNKED
+    BATCH_REQUEST = const.MSG_TYPE_BATCH_REQUEST
 
     def __init__(self):
         self.counter = 1
         self.inflight = {}
         self.by_peer = {}
+        self.sent_at = {}
         self.rpcs = weakref.WeakValueDictionary()
 
     def next_counter(self):
@@ -21,7 +25,7 @@ class RPCClient(object):
         self.counter += 1
         return counter
 
-    def request(self, targets, msg, singular=False):
+    def request(self, targets, msg, singular=False, **options):
         if not targets:
             return 0, None
 
@@ -29,7 +33,7 @@ class RPCClient(object):
 
         self.sent(counter, targets)
 
-        rpc = futures.RPC(len(targets), singular)
+        rpc = futures.RPC(len(targets), singular, **options)
         self.rpcs[counter] = rpc
 
         for peer in targets:
@@ -37,13 +41,75 @@ class RPCClient(object):
 
         return counter, rpc
 
-    def chunked_request(self, counter, targets, singular=False):
+    def completed(self, value):
+        # an RPC that already has its one response (from a cache)
+        rpc = futures.RPC(1, True)
+        rpc.finish(value)
+        return rpc
+
+    def request_many(self, batch, singular=False):
+        # batch is a list of (targets, msg) pairs. every msg gets its own
+        # counter and RPC, but all the requests headed to the same peer are
+        # pushed together in a single batch frame
+        results = []
+        by_target = collections.OrderedDict()
+        for targets, msg in batch:
+            if not targets:
+                results.append((0, None))
+                continue
+
+            counter = self.next_counter()
+
+            self.sent(counter, targets)
+
+            rpc = futures.RPC(len(targets), singular)
+            self.rpcs[counter] = rpc
+
+            for peer in targets:
+                by_target.setdefault(id(peer), (peer, []))[1].append(
+                        (counter,) + msg)
+
+            results.append((counter, rpc))
+
+        for peer, entries in by_target.itervalues():
+            if len(entries) == 1:
+                peer.push((self.REQUEST, entries[0]))
+            else:
+                peer.push((self.BATCH_REQUEST, tuple(entries)))
+
+        return results
+
+    def hedge(self, rpc, target, msg):
+        # a duplicate of an in-flight singular request, under a new counter
+        # but completing the same RPC; whichever response arrives first wins
+        counter = self.next_counter()
+
+        self.sent(counter, [target])
+        self.rpcs[counter] = rpc
+
+        target.push((self.REQUEST, (counter,) + msg))
+
+        return counter
+
+    def retry(self, counter, peer, target, msg):
+        # move an in-flight singular request off of a lost peer and onto
+        # another one, under a new counter but completing the same RPC
+        rpc = self.rpcs.pop(counter)
+        self.arrival(counter, peer)
+        del self.inflight[counter]
+        self.sent_at.pop(counter, None)
+        if not self.by_peer[id(peer)]:
+            del self.by_peer[id(peer)]
+
+        return self.hedge(rpc, target, msg)
+
+    def chunked_request(self, counter, targets, singular=False, **options):
         if not targets:
             return None
 
         self.sent(counter, targets)
 
-        rpc = futures.RPC(len(targets), singular)
+        rpc = futures.RPC(len(targets), singular, **options)
         self.rpcs[counter] = rpc
 
         return rpc
@@ -52,6 +118,10 @@ class RPCClient(object):
         for counter in list(self.by_peer.get(id(peer), [])):
             self.response(peer, counter, const.RPC_ERR_LOST_CONN, None)
 
+    def routes(self, table):
+        # only clients watch the routing table
+        pass
+
     def response(self, peer, counter, rc, result):
         self.arrival(counter, peer)
 
@@ -59,11 +129,13 @@ class RPCClient(object):
             self.rpcs[counter]._incoming(peer.ident, rc, result)
             if not self.inflight[counter]:
                 del self.inflight[counter]
+                self.sent_at.pop(counter, None)
             if not self.by_peer[id(peer)]:
                 del self.by_peer[id(peer)]
 
     def sent(self, counter, targets):
         self.inflight[counter] = set(x.ident for x in targets)
+        self.sent_at[counter] = time.time()
         for peer in targets:
             self.by_peer.setdefault(id(peer), set()).add(counter)
 
@@ -75,11 +147,15 @@ class RPCClient(object):
 class ProxiedClient(RPCClient):
     REQUEST = const.MSG_TYPE_PROXY_REQUEST
     CHUNKED_REQUEST = const.MSG_TYPE_PROXY_REQUEST_IS_CHUNKED
+    BATCH_REQUEST = const.MSG_TYPE_PROXY_BATCH_REQUEST
 
     def __init__(self, client):
         super(ProxiedClient, self).__init__()
         self._client = weakref.ref(client)
 
+        # counter: msg, for idempotent requests that may be re-sent
+        self.replayable = {}
+
     def sent(self, counter, targets):
         self.inflight[counter] = 0
         for peer in targets:
@@ -116,9 +192,67 @@ class ProxiedClient(RPCClient):
 
         return rpc
 
-    def connection_down(self, peer):
-        super(ProxiedClient, self).connection_down(peer)
+    def last_value(self, target, service, routing_id, method):
+        counter = self.next_counter()
 
+        target.push((const.MSG_TYPE_PROXY_QUERY_LAST_VALUE,
+                (counter, service, routing_id, method)))
+
+        self.sent(counter, set([target]))
+
+        rpc = futures.RPC(1, True)
+        self.rpcs[counter] = rpc
+
+        self.expect(target, counter, 1)
+
+        return rpc
+
+    def response(self, peer, counter, rc, result):
+        super(ProxiedClient, self).response(peer, counter, rc, result)
+        if counter not in self.inflight:
+            self.replayable.pop(counter, None)
+
+    def replay(self, peer, target):
+        # move the pending idempotent requests off of a lost hub connection
+        # and re-send them, under the same counters, through another one
+        pending = self.by_peer.get(id(peer), {})
+        for counter in list(pending):
+            msg = self.replayable.get(counter)
+            if msg is None or counter not in self.rpcs:
+                continue
+
+            del pending[counter]
+            self.inflight[counter] = 0
+            self.by_peer.setdefault(id(target), {})[counter] = 0
+
+            target.push((self.REQUEST, (counter,) + msg))
+
+        if not pending:
+            self.by_peer.pop(id(peer), None)
+
+    def routes(self, table):
         client = self._client()
         if client:
+            client._update_routes(table)
+
+    def connection_down(self, peer):
+        client = self._client()
+        if client and peer is not client._peer:
+            # a standby connection, with nothing in flight
+            client._lost_standby(peer)
+            return
+
+        standby = client._failover() if client else None
+        if standby is not None:
+            self.replay(peer, standby)
+
+        super(ProxiedClient, self).connection_down(peer)
+
+        if client and standby is None:
             client.reset()
+
+
+class DirectClient(RPCClient):
+    # plain RPCs sent by a junction.Client straight to the handling hubs,
+    # over connections that reconnect on their own when they fail
+    pass
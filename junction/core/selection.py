@@ -0,0 +1,137 @@
+from __future__ import absolute_import
+
+import hashlib
+import random
+
+from .. import hooks
+
+
+# floor on the latency used in cost estimates, so that outstanding request
+# counts still matter for peers with no (or negligible) measured latency
+MIN_LATENCY = 0.0001
+
+
+class Selector(object):
+    '''Strategy for choosing the single target of a singular message
+
+    Subclasses override ``select``; this one defers to the ``select_peer``
+    hook, which makes a random choice unless it has been replaced.
+    '''
+
+    def select(self, dispatcher, targets, service, routing_id, method):
+        '''Pick one of ``targets``
+
+        ``targets`` holds connected peers and possibly a local target (with
+        an ``ident`` of ``None``) if the hub can handle the message itself.
+        '''
+        by_addr = {}
+        for target in targets:
+            by_addr[target.ident] = target
+        choice = hooks._get(dispatcher.hooks, 'select_peer')(
+                by_addr.keys(), service, routing_id, method)
+        return by_addr[choice]
+
+    def outstanding(self, dispatcher, target):
+        return len(dispatcher.rpc_client.by_peer.get(id(target), ()))
+
+    def busyness(self, dispatcher, target):
+        # the load a peer reports already covers whatever of our own RPCs it
+        # is working on, so don't count those twice
+        return max(self.outstanding(dispatcher, target),
+                dispatcher.peer_stats.load(target.ident))
+
+    def local(self, targets):
+        for target in targets:
+            if target.ident is None:
+                return target
+        return None
+
+
+class RandomSelector(Selector):
+    'Defer to the ``select_peer`` hook (a random choice by default)'
+
+
+class LeastOutstandingSelector(Selector):
+    '''Choose the least busy peer
+
+    Busyness is the number of our RPCs awaiting responses from the peer, or
+    the load it last reported if that is greater. Ties are broken by the
+    lower average response latency.
+    '''
+
+    def select(self, dispatcher, targets, service, routing_id, method):
+        local = self.local(targets)
+        if local is not None:
+            return local
+
+        stats = dispatcher.peer_stats
+        return min(targets, key=lambda t: (
+            self.busyness(dispatcher, t), stats.latency(t.ident)))
+
+
+class PowerOfTwoSelector(Selector):
+    '''Compare two random peers and choose the cheaper one
+
+    A peer's cost is its average response latency scaled by the number of
+    RPCs it already has outstanding (or the load it last reported), so a slow
+    or backed up peer is avoided without herding every message onto the
+    single best-looking one.
+    '''
+
+    def select(self, dispatcher, targets, service, routing_id, method):
+        local = self.local(targets)
+        if local is not None:
+            return local
+
+        if len(targets) == 1:
+            return targets[0]
+
+        return min(random.sample(targets, 2),
+                key=lambda t: self.cost(dispatcher, t))
+
+    def cost(self, dispatcher, target):
+        latency = max(dispatcher.peer_stats.latency(target.ident),
+                MIN_LATENCY)
+        return latency * (self.busyness(dispatcher, target) + 1)
+
+
+class RendezvousSelector(Selector):
+    '''Consistently choose the same peer for a given service and routing_id
+
+    Every target is scored by a hash of ``(service, routing_id, ident)`` and
+    the highest score wins (rendezvous hashing), so as long as membership is
+    stable a routing_id keeps landing on the same peer, and when a peer joins
+    or leaves only the roughly 1/N of routing_ids it wins (or won) move.
+
+    The local target is scored under the hub's own identity, so every hub in
+    the mesh makes the same choice.
+    '''
+
+    def select(self, dispatcher, targets, service, routing_id, method):
+        return max(targets, key=lambda t: self.score(
+            service, routing_id, t.ident or dispatcher.hub._ident))
+
+    def score(self, service, routing_id, ident):
+        return hashlib.md5(repr((service, routing_id, ident))).digest()
+
+
+SELECTORS = {
+    'random': RandomSelector,
+    'least_outstanding': LeastOutstandingSelector,
+    'p2c': PowerOfTwoSelector,
+    'consistent_hash': RendezvousSelector,
+}
+
+
+def get(selection):
+    '''Produce a Selector from a name in ``SELECTORS`` or an instance
+
+    ``None`` gets the default, :class:`RandomSelector`.
+    '''
+    if selection is None:
+        return RandomSelector()
+    if isinstance(selection, Selector):
+        return selection
+    if selection not in SELECTORS:
+        raise ValueError("unknown selection strategy %r" % (selection,))
+    return SELECTORS[selection]()
@@ -0,0 +1,199 @@
+from __future__ import absolute_import
+
+import collections
+import random
+import time
+
+
+# weight given to each new latency sample in the moving average
+LATENCY_EWMA_WEIGHT = 0.25
+
+# weight given to each new outcome in the moving average error rate
+ERROR_EWMA_WEIGHT = 0.1
+
+# error rate at which a peer is ejected from singular target selection,
+# once at least EJECTION_MIN_SAMPLES outcomes have been observed
+EJECTION_THRESHOLD = 0.5
+EJECTION_MIN_SAMPLES = 10
+
+# seconds an ejected peer sits out, doubling with each consecutive ejection
+EJECTION_TIME = 5.0
+MAX_EJECTION_TIME = 60.0
+
+# fraction of selections an ejected peer is let back into once its ejection
+# time is up, until a probe succeeds (readmitting it) or fails (re-ejecting)
+PROBE_FRACTION = 0.1
+
+EJECTED = "ejected"
+READMITTED = "readmitted"
+
+# number of recent samples kept per (service, method) by LatencyTracker,
+# and the number needed before percentiles are reported at all
+LATENCY_WINDOW = 100
+LATENCY_MIN_SAMPLES = 10
+
+# a hub counts as overloaded once messages have been queueing for longer than
+# SHED_TARGET seconds, without a break, for at least SHED_INTERVAL seconds
+SHED_TARGET = 0.005
+SHED_INTERVAL = 0.1
+
+
+class PeerStats(object):
+    'Per-peer latency, load and health bookkeeping for a single Dispatcher'
+
+    def __init__(self, weight=LATENCY_EWMA_WEIGHT):
+        self.weight = weight
+        self.latencies = {}
+        self.loads = {}
+        self.error_rates = {}
+        self.samples = {}
+
+        # ident: (ejected until, consecutive ejections)
+        self.ejected = {}
+        self.ejections = 0
+
+    def observe_latency(self, ident, elapsed):
+        previous = self.latencies.get(ident)
+        if previous is None:
+            self.latencies[ident] = elapsed
+        else:
+            self.latencies[ident] = previous + self.weight * (
+                    elapsed - previous)
+
+    def latency(self, ident):
+        # peers we haven't heard from yet look as fast as can be,
+        # so that they get a chance to be measured
+        return self.latencies.get(ident, 0.0)
+
+    def observe_load(self, ident, load):
+        self.loads[ident] = load
+
+    def load(self, ident):
+        '''The sum of the latest load summary a peer reported
+
+        That is its run queue length, its number of pending handlers, and the
+        depth of its send queue to us. Zero if it hasn't reported yet.
+        '''
+        return sum(self.loads.get(ident, ()))
+
+    def observe_result(self, ident, failed):
+        '''Record the outcome of a response (or lost connection) from a peer
+
+        :returns:
+            ``EJECTED`` or ``READMITTED`` if this changed the peer's standing,
+            otherwise ``None``
+        '''
+        previous = self.error_rates.get(ident, 0.0)
+        self.error_rates[ident] = previous + ERROR_EWMA_WEIGHT * (
+                int(failed) - previous)
+        self.samples[ident] = self.samples.get(ident, 0) + 1
+
+        if ident in self.ejected:
+            until, count = self.ejected[ident]
+            if time.time() < until:
+                # stragglers from before the ejection
+                return None
+            if failed:
+                self.eject(ident, count + 1)
+                return EJECTED
+            del self.ejected[ident]
+            self.error_rates[ident] = 0.0
+            self.samples[ident] = 0
+            return READMITTED
+
+        if (self.samples[ident] >= EJECTION_MIN_SAMPLES and
+                self.error_rates[ident] >= EJECTION_THRESHOLD):
+            self.eject(ident, 1)
+            return EJECTED
+
+        return None
+
+    def eject(self, ident, count):
+        duration = min(EJECTION_TIME * 2 ** (count - 1), MAX_EJECTION_TIME)
+        self.ejected[ident] = (time.time() + duration, count)
+        self.ejections += 1
+
+    def error_rate(self, ident):
+        return self.error_rates.get(ident, 0.0)
+
+    def eligible(self, ident):
+        'Whether a peer may be chosen as the target of a singular message'
+        if ident not in self.ejected:
+            return True
+        if time.time() < self.ejected[ident][0]:
+            return False
+        return random.random() < PROBE_FRACTION
+
+    def forget(self, ident):
+        # health is deliberately kept, so that a peer can't clear its
+        # ejection just by reconnecting
+        self.latencies.pop(ident, None)
+        self.loads.pop(ident, None)
+
+    def snapshot(self, ident):
+        return {
+            'latency': self.latency(ident),
+            'load': self.loads.get(ident),
+            'error_rate': self.error_rate(ident),
+            'ejected': ident in self.ejected,
+        }
+
+
+class LatencyTracker(object):
+    'Recent RPC response times per (service, method), for percentiles'
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self.samples = {}
+
+    def observe(self, key, elapsed):
+        ring = self.samples.setdefault(key, collections.deque(
+            maxlen=self.window))
+        ring.append(elapsed)
+
+    def percentile(self, key, pct):
+        '''The ``pct`` percentile response time seen for ``key``
+
+        ``None`` if there aren't yet enough samples to say.
+        '''
+        ring = self.samples.get(key, ())
+        if len(ring) < LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(ring)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+class QueueingDelay(object):
+    '''Overload detection from queueing delays, in the style of CoDel
+
+    It isn't the size of a delay that counts but how long it stands: a burst
+    that drains within ``interval`` is fine, but if every delay observed for
+    a whole ``interval`` is above ``target`` the queue isn't draining and the
+    hub is overloaded, until a delay under ``target`` is seen again.
+    '''
+
+    def __init__(self, target=SHED_TARGET, interval=SHED_INTERVAL):
+        self.target = target
+        self.interval = interval
+        self.above_since = None
+        self.last_sample = 0
+        self.dropping = False
+        self.shed = 0
+
+    def observe(self, delay):
+        now = time.time()
+        self.last_sample = now
+        if delay < self.target:
+            self.above_since = None
+            self.dropping = False
+        elif self.above_since is None:
+            self.above_since = now
+        elif now - self.above_since >= self.interval:
+            self.dropping = True
+
+    def overloaded(self):
+        if self.dropping and time.time() - self.last_sample > self.interval:
+            # nothing has come through the queues lately to say otherwise
+            self.above_since = None
+            self.dropping = False
+        return self.dropping
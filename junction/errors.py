@@ -71,6 +71,14 @@ class IllegalMessage(Exception):
     "Restrictions on message types violated"
 
 
+class Throttled(Exception):
+    "Request refused by a rate limit on the receiving hub"
+
+
+class Overloaded(Exception):
+    "Request refused by a receiving hub that is shedding load"
+
+
 HANDLED_ERROR_TYPES = {}
 
 
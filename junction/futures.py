@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+import copy
+import functools
 import logging
 import sys
 import time
@@ -210,11 +212,21 @@ class RPC(Future):
     :meth:`Hub.send_rpc <junction.hub.Hub.send_rpc>`.
     '''
 
-    def __init__(self, target_count, singular):
+    def __init__(self, target_count, singular, quorum=None, first_k=None,
+            reducer=None, initial=None):
         super(RPC, self).__init__()
         self._target_count = target_count
         self._singular = singular
+        self._quorum = quorum
+        self._first_k = first_k
+        self._reducer = reducer
+        self._accumulator = initial
         self._results = []
+        self._errors = []
+        # (target, rc, data) of the error responses, for passing them on
+        self._failures = []
+        self._received = 0
+        self._successes = 0
         self._arrival = backend.Event()
 
     @property
@@ -232,12 +244,21 @@ class RPC(Future):
         '''
         return self._arrival
 
+    @property
+    def errors(self):
+        'The error responses (as exception instances) received so far'
+        return list(self._errors)
+
     @property
     def partial_results(self):
         '''The results that the RPC has received *so far*
 
         This may also be the complete results if :attr:`complete` is ``True``.
+        With a ``reducer`` this is the accumulated value so far instead.
         '''
+        if self._reducer is not None:
+            return deepcopy(self._accumulator)
+
         results = []
         for r in self._results:
             if isinstance(r, Exception):
@@ -260,24 +281,73 @@ class RPC(Future):
         self._target_count = count
         if count == 0:
             self.abort(errors.Unroutable, errors.Unroutable())
-        elif count == len(self._results):
+        elif self._enough():
             self._finish()
 
     def _incoming(self, target, rc, data):
         if self._done.is_set():
+            # a straggler after a quorum or first_k completion
             return
 
-        self._results.append(
-                dispatch._check_error(log, target, rc, data))
+        result = dispatch._check_error(log, target, rc, data)
+        self._received += 1
+        if isinstance(result, Exception):
+            self._errors.append(result)
+            self._failures.append((target, rc, data))
+        else:
+            self._successes += 1
+
+        if self._reducer is None:
+            self._results.append(result)
+        elif not isinstance(result, Exception):
+            # fold it in now rather than holding onto every response
+            try:
+                self._accumulator = self._reducer(self._accumulator, result)
+            except Exception:
+                self.abort(*sys.exc_info())
+                return
+        del result
+
         self._arrival.set()
         self._arrival.clear()
 
-        if len(self._results) == self._target_count:
+        if self._enough():
             self._finish()
 
+    def _forwarded_errors(self, failures):
+        # error responses that an aggregating hub received on our behalf
+        for target, rc, data in failures:
+            self._errors.append(dispatch._check_error(log, target, rc, data))
+
+    def _enough(self):
+        received = self._received
+        if received == self._target_count:
+            return True
+        if self._first_k is not None and received >= self._first_k:
+            return True
+        if self._quorum is not None:
+            if self._successes >= self._quorum:
+                return True
+            # too many failures for the quorum to be reachable
+            failures = received - self._successes
+            if failures > self._target_count - self._quorum:
+                return True
+        return False
+
     def _finish(self):
+        if self._reducer is not None:
+            self._results = None
+            if self._singular and self._errors:
+                error = self._errors[0]
+                self.abort(type(error), error)
+                return
+            self.finish(self._accumulator)
+            return
+
         final = self._results
         self._results = None
+        if self._quorum is not None and self._successes >= self._quorum:
+            final = [r for r in final if not isinstance(r, Exception)]
         if self._singular:
             final = final[0]
             if isinstance(final, Exception):
@@ -286,6 +356,47 @@ class RPC(Future):
         self.finish(final)
 
 
+class Gather(Future):
+    '''A future for a dict of futures, completing with a dict of their values
+
+    A key whose future is aborted maps to the exception instead, so that one
+    failure doesn't hide the rest of the results.
+
+    Instances of this class shouldn't be created directly; they are returned
+    by :meth:`Hub.scatter_rpc <junction.hub.Hub.scatter_rpc>`.
+    '''
+
+    def __init__(self, futures):
+        super(Gather, self).__init__()
+        self._futures = dict(futures)
+        self._gathered = {}
+
+        if not self._futures:
+            self.finish({})
+
+        for key, future in self._futures.iteritems():
+            future.on_finish(functools.partial(self._arrived, key))
+            future.on_abort(functools.partial(self._failed, key))
+
+    @property
+    def partial_results(self):
+        'The values (or exceptions) gathered *so far*, keyed the same way'
+        return dict(self._gathered)
+
+    def _arrived(self, key, value):
+        self._gathered[key] = value
+        self._check()
+
+    def _failed(self, key, klass, exc, tb):
+        self._gathered[key] = exc
+        self._check()
+
+    def _check(self):
+        if len(self._gathered) == len(self._futures):
+            self._futures = None
+            self.finish(self._gathered)
+
+
 class Dependent(Future):
     '''A future with a function to run after termination of it's parent futures
 
@@ -441,4 +552,8 @@ class _Wait(object):
 
 
 def deepcopy(item):
-    return mummy.loads(mummy.dumps(item))
+    try:
+        return mummy.loads(mummy.dumps(item))
+    except TypeError:
+        # something only the connection's own codec could carry
+        return copy.deepcopy(item)
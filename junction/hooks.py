@@ -59,6 +59,30 @@ def connection_received(peer, subscriptions):
     pass
 
 
+def peer_ejected(peer, error_rate):
+    '''A peer's error rate got it ejected from singular target selection
+
+    It will sit out for a while, then get probed with a trickle of traffic
+    until a success readmits it or a failure ejects it again, for longer.
+
+    :param peer: the ``(host, port)`` with which the peer identified itself
+    :type peer: ``(host, port)`` tuple
+    :param error_rate:
+        the peer's recent rate of failed responses and lost connections
+    :type error_rate: float
+    '''
+    pass
+
+
+def peer_readmitted(peer):
+    '''A previously ejected peer was readmitted to singular target selection
+
+    :param peer: the ``(host, port)`` with which the peer identified itself
+    :type peer: ``(host, port)`` tuple
+    '''
+    pass
+
+
 def _get(hooks, name):
     log.info("invoking hook %s" % name)
 
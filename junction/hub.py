@@ -8,7 +8,7 @@ import time
 import mummy
 
 from . import errors, futures
-from .core import backend, connection, const, dispatch, rpc
+from .core import backend, cache, connection, const, dispatch, rpc, stats
 
 
 log = logging.getLogger("junction.hub")
@@ -20,10 +20,60 @@ log = logging.getLogger("junction.hub")
 #  _____
 MAX_UDP_PACKET_SIZE = 65507
 
+# seconds between load summaries sent to all peers
+LOAD_REPORT_INTERVAL = 1.0
+
 
 class Hub(object):
-    'A hub in the server graph'
-    def __init__(self, addr, peer_addrs, hostname=None, hooks=None):
+    '''A hub in the server graph
+
+    :param addr: the ``(host, port)`` address on which to listen
+    :type addr: tuple
+    :param peer_addrs: ``(host, port)`` addresses of the hubs to connect to
+    :type peer_addrs: list
+    :param hostname:
+        the host name to identify as to peers, defaults to ``addr[0]``
+    :type hostname: str or None
+    :param hooks:
+        an object with any of the functions in :mod:`junction.hooks` as
+        attributes, to override the defaults
+    :param selection:
+        the strategy for choosing the target of singular publishes and RPCs
+        when several peers are eligible. ``"random"`` (the default) uses the
+        ``select_peer`` hook, ``"least_outstanding"`` picks the peer with the
+        fewest RPCs awaiting a response, ``"p2c"`` compares two random
+        peers by average response latency and outstanding RPCs, and
+        ``"consistent_hash"`` sends each ``(service, routing_id)`` to the same
+        peer for as long as the set of eligible peers is stable. Instances of
+        :class:`junction.core.selection.Selector` subclasses are accepted as
+        well.
+    :type selection: str or Selector
+    :param hedge_percentile:
+        for RPCs sent with ``hedge=True``, the percentile of recent response
+        times for the same service and method after which a duplicate request
+        is sent to a second peer
+    :type hedge_percentile: int or float
+    :param hedge_budget:
+        the most that hedging may add to the load of hedge-able RPCs, as a
+        fraction of them (``0.05`` is 5%)
+    :type hedge_budget: float
+    :param retry_budget:
+        the most that re-sending idempotent RPCs lost with a peer's connection
+        may add to their load, as a fraction of them (``0.1`` is 10%)
+    :type retry_budget: float
+    :param codecs:
+        the names of the serialization codecs this hub's connections may use,
+        in order of preference, from ``'mummy'``, ``'marshal'`` (only for
+        meshes all on the same python version) and ``'msgpack'`` (if it is
+        installed). examples/codec_benchmark.py compares them. each
+        connection uses the first of its initiating side's codecs that the
+        other side also has. the default is just mummy.
+    :type codecs: list of strings or None
+    '''
+    def __init__(self, addr, peer_addrs, hostname=None, hooks=None,
+            selection=None, hedge_percentile=dispatch.HEDGE_PERCENTILE,
+            hedge_budget=dispatch.HEDGE_BUDGET,
+            retry_budget=dispatch.RETRY_BUDGET, codecs=None):
         self.addr = addr
         self._ident = (hostname or addr[0], addr[1])
         self._peers = peer_addrs
@@ -31,9 +81,12 @@ class Hub(object):
         self._closing = False
         self._listener_coro = None
         self._udp_listener_coro = None
+        self._load_reporter_coro = None
 
         self._rpc_client = rpc.RPCClient()
-        self._dispatcher = dispatch.Dispatcher(self._rpc_client, self, hooks)
+        self._dispatcher = dispatch.Dispatcher(
+                self._rpc_client, self, hooks, selection,
+                hedge_percentile, hedge_budget, retry_budget, codecs)
 
     def wait_connected(self, conns=None, timeout=None):
         '''Wait for connections to be made and their handshakes to finish
@@ -78,9 +131,11 @@ class Hub(object):
         if self._udp_listener_coro:
             backend.schedule_exception(
                     errors._BailOutOfListener(), self._udp_listener_coro)
+        if self._load_reporter_coro:
+            backend.end(self._load_reporter_coro)
 
-    def accept_publish(
-            self, service, mask, value, method, handler=None, schedule=False):
+    def accept_publish(self, service, mask, value, method, handler=None,
+            schedule=False, raw=False):
         '''Set a handler for incoming publish messages
 
         :param service: the incoming message must have this service
@@ -102,6 +157,13 @@ class Hub(object):
             whether to schedule a separate greenlet running ``handler`` for
             each matching message. default ``False``.
         :type schedule: bool
+        :param raw:
+            if ``True``, ``handler`` is called with just the one argument, the
+            message's still-serialized ``(args, kwargs)`` (which
+            :func:`junction.core.codecs.loads_body` decodes, whichever codec
+            the sender used), rather than with the decoded arguments. default
+            ``False``.
+        :type raw: bool
 
         :raises:
             - :class:`ImpossibleSubscription
@@ -116,7 +178,7 @@ class Hub(object):
         # support @hub.accept_publish(serv, mask, val, meth) decorator usage
         if handler is None:
             return lambda h: self.accept_publish(
-                    service, mask, value, method, h, schedule)
+                    service, mask, value, method, h, schedule, raw)
 
         log.info("accepting publishes%s %r" % (
                 " scheduled" if schedule else "",
@@ -124,6 +186,8 @@ class Hub(object):
 
         self._dispatcher.add_local_subscription(const.MSG_TYPE_PUBLISH,
                 service, mask, value, method, handler, schedule)
+        if raw:
+            self._dispatcher.raw_handlers.add(handler)
 
         return handler
 
@@ -147,7 +211,7 @@ class Hub(object):
                 const.MSG_TYPE_PUBLISH, service, mask, value)
 
     def publish(self, service, routing_id, method, args=None, kwargs=None,
-            broadcast=False, udp=False):
+            broadcast=False, udp=False, conflate=False):
         '''Send a 1-way message
 
         :param service: the service name (the routing top level)
@@ -164,21 +228,114 @@ class Hub(object):
         :param bool broadcast:
             if ``True``, send to every peer with a matching subscription.
         :param bool udp: deliver the message over UDP instead of the usual TCP
+        :param conflate:
+            if ``True``, a publish with the same service, routing_id and method
+            that is still waiting in a peer's send queue is replaced by this
+            one, rather than this one being queued up behind it. this lets
+            slow subscribers to state updates skip straight to the latest.
+            any other hash-able, serializable value is used as the key to
+            conflate on instead. doesn't apply to UDP publishes.
 
         :returns: None. use 'rpc' methods for requests with responses.
 
         :raises:
-            :class:`Unroutable <junction.errors.Unroutable>` if no peers are
-            registered to receive the message
+            - :class:`Unroutable <junction.errors.Unroutable>` if no peers are
+              registered to receive the message
+            - :class:`IllegalMessage <junction.errors.IllegalMessage>` if a
+              conflated publish would have been chunked
         '''
         if udp:
-            func = self._dispatcher.send_publish_udp
+            sent = self._dispatcher.send_publish_udp(None, service,
+                    routing_id, method, args or (), kwargs or {},
+                    singular=not broadcast)
         else:
-            func = self._dispatcher.send_publish
-        if not func(None, service, routing_id, method,
-                args or (), kwargs or {}, singular=not broadcast):
+            sent = self._dispatcher.send_publish(None, service, routing_id,
+                    method, args or (), kwargs or {}, singular=not broadcast,
+                    conflate=dispatch.conflation_key(
+                        conflate, service, routing_id, method))
+        if not sent:
             raise errors.Unroutable()
 
+    def publish_many(self, messages, broadcast=False):
+        '''Send many 1-way messages at once
+
+        The messages are routed individually, but all of those headed to the
+        same peer are sent together in a single frame.
+
+        :param messages:
+            the messages to send, each a ``(service, routing_id, method, args,
+            kwargs)`` tuple (``args`` and ``kwargs`` may be ``None``). Chunked
+            publishes can't be sent this way.
+        :type messages: list
+        :param bool broadcast:
+            if ``True``, send each message to every peer with a matching
+            subscription.
+
+        :returns: None. use 'rpc' methods for requests with responses.
+
+        :raises:
+            - :class:`Unroutable <junction.errors.Unroutable>` if any of the
+              messages had no registered receivers. Its argument is the list
+              of indexes of those messages, the others will still have been
+              sent.
+            - :class:`IllegalMessage <junction.errors.IllegalMessage>` if any
+              of the messages would have been chunked
+        '''
+        unroutable = self._dispatcher.send_publish_many(None,
+                [(service, routing_id, method, args or (), kwargs or {},
+                    not broadcast)
+                for service, routing_id, method, args, kwargs in messages])
+        if unroutable:
+            raise errors.Unroutable(unroutable)
+
+    def keep_last_values(self, service, method, size=cache.DEFAULT_SIZE):
+        '''Remember the most recent publish per routing_id of a method
+
+        This covers publishes the hub sends itself, those it forwards for
+        :class:`Clients <junction.client.Client>`, and those it receives.
+        They can then be read with :meth:`last_value`, or by clients with
+        :meth:`Client.last_value <junction.client.Client.last_value>`.
+
+        :param service: the service of the publishes to remember
+        :type service: anything hash-able
+        :param method: the method name of the publishes to remember
+        :type method: string
+        :param size:
+            the most routing_ids to remember publishes for (the least recently
+            used are forgotten first). default 1024.
+        :type size: int
+        '''
+        log.info("keeping last published values %r" % ((service, method),))
+        self._dispatcher.last_values.enable(service, method, size)
+
+    def forget_last_values(self, service, method):
+        '''Stop remembering the most recent publishes of a method
+
+        :returns:
+            a boolean indicating whether they were being remembered (True), or
+            not (False)
+        '''
+        return self._dispatcher.last_values.disable(service, method)
+
+    def last_value(self, service, routing_id, method):
+        '''Get the arguments of the most recent publish this hub has seen
+
+        Only publishes of methods passed to :meth:`keep_last_values` are
+        remembered.
+
+        :param service: the service name
+        :type service: anything hash-able
+        :param routing_id: the routing_id of the publish
+        :type routing_id: int
+        :param method: the method name
+        :type method: string
+
+        :returns:
+            the ``(args, kwargs)`` of the last publish, or ``None`` if there
+            isn't one remembered
+        '''
+        return self._dispatcher.last_values.get(service, routing_id, method)
+
     def publish_receiver_count(self, service, routing_id):
         '''Get the number of peers that would handle a particular publish
 
@@ -195,7 +352,7 @@ class Hub(object):
         return peers
 
     def accept_rpc(self, service, mask, value, method,
-            handler=None, schedule=True):
+            handler=None, schedule=True, coalesce=False, raw=False):
         '''Set a handler for incoming RPCs
 
         :param service: the incoming RPC must have this service
@@ -217,6 +374,17 @@ class Hub(object):
             whether to schedule a separate greenlet running ``handler`` for
             each matching message. default ``True``.
         :type schedule: bool
+        :param coalesce:
+            if ``True``, a request arriving with the same arguments as one the
+            handler is already working on waits for and shares that one's
+            response, rather than running the handler again. default
+            ``False``.
+        :type coalesce: bool
+        :param raw:
+            if ``True``, ``handler`` is called with just the one argument, the
+            request's still-serialized ``(args, kwargs)`` (see
+            :meth:`accept_publish`). default ``False``.
+        :type raw: bool
 
         :raises:
             - :class:`ImpossibleSubscription
@@ -230,18 +398,239 @@ class Hub(object):
         '''
         # support @hub.accept_rpc(serv, mask, val, meth) decorator usage
         if handler is None:
-            return lambda h: self.accept_rpc(
-                    service, mask, value, method, h, schedule)
+            return lambda h: self.accept_rpc(service, mask, value, method,
+                    h, schedule, coalesce, raw)
 
-        log.info("accepting RPCs%s %r" % (
+        log.info("accepting RPCs%s%s %r" % (
                 " scheduled" if schedule else "",
+                " coalesced" if coalesce else "",
                 (service, (mask, value), method),))
 
         self._dispatcher.add_local_subscription(const.MSG_TYPE_RPC_REQUEST,
                 service, mask, value, method, handler, schedule)
+        if coalesce:
+            self._dispatcher.coalesced_handlers.add(handler)
+        if raw:
+            self._dispatcher.raw_handlers.add(handler)
 
         return handler
 
+    def register_aggregator(self, name, func=None, initial=None):
+        '''Name a function for combining broadcast RPC responses
+
+        A :class:`Client <junction.client.Client>` broadcasting an RPC through
+        this hub can name the aggregator, and the hub will fold the responses
+        together as they arrive and send the client only the final result.
+
+        :param name: the name clients will refer to the aggregator by
+        :type name: anything hash-able
+        :param func:
+            a function ``func(accumulator, response)`` returning the new
+            accumulator
+        :type func: function
+        :param initial:
+            the starting accumulator, copied for each RPC it is used on
+        '''
+        # support @hub.register_aggregator(name, initial=x) decorator usage
+        if func is None:
+            return lambda f: self.register_aggregator(name, f, initial)
+
+        log.info("registering aggregator %r" % (name,))
+
+        self._dispatcher.aggregators[name] = (func, initial)
+
+        return func
+
+    def cache_rpc(self, service, method, ttl, size=cache.DEFAULT_SIZE):
+        '''Cache the responses to singular RPCs of a service and method
+
+        Only use this for idempotent methods. Responses are cached per
+        routing_id and arguments, and are used both for this hub's own
+        singular RPCs and for those that :class:`Clients
+        <junction.client.Client>` send through it.
+
+        :param service: the service of the RPCs to cache
+        :type service: anything hash-able
+        :param method: the method name of the RPCs to cache
+        :type method: string
+        :param ttl: the number of seconds a response stays usable
+        :type ttl: int or float
+        :param size:
+            the most responses to keep (the least recently used are evicted
+            first). default 1024.
+        :type size: int
+        '''
+        log.info("caching rpc responses %r" % ((service, method),))
+        self._dispatcher.cache.enable(service, method, ttl, size)
+
+    def uncache_rpc(self, service, method):
+        '''Stop caching the responses to a service and method's RPCs
+
+        :returns:
+            a boolean indicating whether they were being cached (True), or not
+            (False)
+        '''
+        return self._dispatcher.cache.disable(service, method)
+
+    def invalidate_cache(self, service, method=None, mask=0, value=0):
+        '''Drop cached RPC responses
+
+        :param service: the service whose responses to drop
+        :type service: anything hash-able
+        :param method:
+            the method whose responses to drop (default all of the service's)
+        :type method: string
+        :param mask:
+            value to be bitwise-and'ed against the routing ids of cached
+            responses, the result of which must match ``value`` for them to be
+            dropped. the default matches every routing id.
+        :type mask: int
+        :param value: the routing id must match this after ``mask``
+        :type value: int
+
+        :returns: the number of responses dropped
+        '''
+        return self._dispatcher.cache.invalidate(service, method,
+                lambda routing_id: routing_id & mask == value)
+
+    def invalidate_cache_on_publish(self, service, mask, value, method,
+            cached_method=None):
+        '''Drop cached RPC responses when a matching publish arrives
+
+        This makes a publish subscription (with the same restrictions as
+        :meth:`accept_publish`), which drops the service's cached responses
+        for routing ids matching ``mask`` and ``value``.
+
+        :param service: the service of the publishes and cached responses
+        :type service: anything hash-able
+        :param mask: the mask of the publish subscription
+        :type mask: int
+        :param value: the value of the publish subscription
+        :type value: int
+        :param method: the method name of the publishes
+        :type method: string
+        :param cached_method:
+            the method whose responses to drop (default all of the service's)
+        :type cached_method: string
+        '''
+        def invalidate(*args, **kwargs):
+            self.invalidate_cache(service, cached_method, mask, value)
+
+        self.accept_publish(service, mask, value, method, invalidate)
+
+    def cache_stats(self):
+        '''Get the hit and miss counts of the RPC response caches
+
+        :returns:
+            a dict mapping ``(service, method)`` pairs to dicts with keys
+            ``hits``, ``misses`` and ``size`` (the number of responses
+            currently held)
+        '''
+        return self._dispatcher.cache.stats()
+
+    def rate_limit(self, rate, burst=None, service=None, method=None,
+            per_client=False):
+        '''Limit the rate of incoming publishes and RPC requests
+
+        Publishes over the limit are dropped, and RPC requests over it are
+        answered with a :class:`Throttled <junction.errors.Throttled>` error.
+        Both are counted in :meth:`rate_limit_stats`.
+
+        Setting a limit again for the same service, method and ``per_client``
+        replaces it.
+
+        :param rate: the number of messages allowed per second
+        :type rate: int or float
+        :param burst:
+            the most messages allowed through at once after a quiet period
+            (default one second's worth)
+        :type burst: int
+        :param service:
+            the service the limit applies to (default ``None`` for all
+            services together)
+        :type service: anything hash-able
+        :param method:
+            the method of ``service`` the limit applies to (default ``None``
+            for all of the service's methods together)
+        :type method: string
+        :param per_client:
+            if ``True``, the limit applies separately to each connected
+            :class:`Client <junction.client.Client>`, and not at all to peer
+            hubs. default ``False``.
+        :type per_client: bool
+        '''
+        if burst is None:
+            burst = max(rate, 1)
+
+        log.info("rate limiting %r to %r/s%s" % ((service, method), rate,
+                " per client" if per_client else ""))
+
+        self._dispatcher.rate_limiter.limit(
+                rate, burst, service, method, per_client)
+
+    def remove_rate_limit(self, service=None, method=None, per_client=False):
+        '''Remove a limit set with :meth:`rate_limit`
+
+        :returns:
+            a boolean indicating whether the limit was there (True) and
+            removed, or not (False)
+        '''
+        return self._dispatcher.rate_limiter.unlimit(
+                service, method, per_client)
+
+    def rate_limit_stats(self):
+        '''Get the counts of messages refused by rate limits
+
+        :returns:
+            a dict mapping the ``(service, method)`` of refused messages to
+            dicts with keys ``dropped`` (the number of publishes dropped) and
+            ``throttled`` (the number of RPC requests refused)
+        '''
+        return dict((key, dict(counts)) for key, counts in
+                self._dispatcher.rate_limiter.refused.iteritems())
+
+    def shed_load(self, target=stats.SHED_TARGET,
+            interval=stats.SHED_INTERVAL):
+        '''Reject incoming RPC requests early while the hub is overloaded
+
+        The hub tracks how long messages wait in its queues: scheduled
+        handlers between arrival and starting, and outgoing messages between
+        being queued and written to the socket. Once those delays have stayed
+        above ``target`` for ``interval`` (the approach of the CoDel queue
+        discipline) new RPC requests are answered straight away with an
+        :class:`Overloaded <junction.errors.Overloaded>` error, so callers
+        can try elsewhere rather than wait on a backed up hub.
+
+        :param target:
+            the queueing delay in seconds that is acceptable to stand. default
+            0.005, or ``None`` to stop shedding load.
+        :type target: int, float or None
+        :param interval:
+            how long in seconds delays must stay above ``target`` before
+            requests are shed. default 0.1.
+        :type interval: int or float
+        '''
+        if target is None:
+            log.info("no longer shedding load")
+            self._dispatcher.queueing = None
+            return
+
+        log.info("shedding load above %rs of queueing delay" % (target,))
+        self._dispatcher.queueing = stats.QueueingDelay(target, interval)
+
+    def load_shedding_stats(self):
+        '''Get the state of load shedding set up by :meth:`shed_load`
+
+        :returns:
+            a dict with keys ``overloaded`` (whether requests are currently
+            being shed) and ``shed`` (the number of requests shed so far), or
+            ``None`` if load shedding isn't on
+        '''
+        queueing = self._dispatcher.queueing
+        if queueing is None:
+            return None
+        return {'overloaded': queueing.overloaded(), 'shed': queueing.shed}
+
     def unsubscribe_rpc(self, service, mask, value):
         '''Remove a rpc subscription
 
@@ -263,7 +652,8 @@ class Hub(object):
                 const.MSG_TYPE_RPC_REQUEST, service, mask, value)
 
     def send_rpc(self, service, routing_id, method, args=None, kwargs=None,
-            broadcast=False):
+            broadcast=False, hedge=False, quorum=None, first_k=None,
+            reducer=None, initial=None, coalesce=False, idempotent=False):
         '''Send out an RPC request
 
         :param service: the service name (the routing top level)
@@ -284,6 +674,46 @@ class Hub(object):
         :param broadcast:
             if ``True``, send to every peer with a matching subscription
         :type broadcast: bool
+        :param hedge:
+            whether the request is safe to send more than once. if so and it
+            takes unusually long (see ``hedge_percentile`` on :class:`Hub`),
+            a duplicate is sent to another eligible peer and the first
+            response from either is used. ignored with ``broadcast``.
+        :type hedge: bool
+        :param quorum:
+            with ``broadcast``, complete as soon as this many successful
+            responses have arrived, with a list of just those. if so many
+            targets fail that the quorum can't be reached, the RPC completes
+            right away with all the results received (errors included).
+        :type quorum: int or None
+        :param first_k:
+            with ``broadcast``, complete as soon as this many responses of any
+            kind have arrived
+        :type first_k: int or None
+        :param reducer:
+            a function ``reducer(accumulator, response)`` returning the new
+            accumulator. each successful response is folded in as it arrives
+            and then dropped, and the final accumulator becomes the RPC's
+            value. error responses are kept apart, in the RPC's
+            :attr:`errors <junction.futures.RPC.errors>`.
+        :type reducer: function or None
+        :param initial: the starting accumulator for ``reducer``
+        :param coalesce:
+            if ``True``, and an identical RPC (same service, routing_id,
+            method, arguments and ``broadcast``) sent with ``coalesce`` is
+            still in flight, don't send this one but return that RPC instead.
+            they will share a result object, so it shouldn't be mutated.
+            ignored along with any of ``quorum``, ``first_k`` or ``reducer``.
+        :type coalesce: bool
+        :param idempotent:
+            whether the request is safe to send more than once. if so and the
+            connection to its target is lost before the response arrives, it
+            is re-sent to another eligible peer (within the ``retry_budget``
+            of :class:`Hub`) rather than failing with
+            :class:`LostConnection <junction.errors.LostConnection>`, for as
+            long as the returned RPC is still referenced. ignored with
+            ``broadcast``.
+        :type idempotent: bool
 
         :returns:
             a :class:`RPC <junction.futures.RPC>` object representing the
@@ -294,7 +724,9 @@ class Hub(object):
             registered to receive the message
         '''
         rpc = self._dispatcher.send_rpc(service, routing_id, method,
-                args or (), kwargs or {}, not broadcast)
+                args or (), kwargs or {}, not broadcast, hedge, coalesce,
+                idempotent, quorum=quorum, first_k=first_k, reducer=reducer,
+                initial=initial)
 
         if not rpc:
             raise errors.Unroutable()
@@ -302,7 +734,9 @@ class Hub(object):
         return rpc
 
     def rpc(self, service, routing_id, method, args=None, kwargs=None,
-            timeout=None, broadcast=False):
+            timeout=None, broadcast=False, hedge=False, quorum=None,
+            first_k=None, reducer=None, initial=None, coalesce=False,
+            idempotent=False):
         '''Send an RPC request and return the corresponding response
 
         This will block waiting until the response has been received.
@@ -329,6 +763,30 @@ class Hub(object):
         :param broadcast:
             if ``True``, send to every peer with a matching subscription
         :type broadcast: bool
+        :param hedge:
+            whether the request is safe to send more than once (see
+            :meth:`send_rpc`)
+        :type hedge: bool
+        :param quorum:
+            with ``broadcast``, the number of successful responses to complete
+            on (see :meth:`send_rpc`)
+        :type quorum: int or None
+        :param first_k:
+            with ``broadcast``, the number of responses to complete on
+        :type first_k: int or None
+        :param reducer:
+            a function to fold the responses into an accumulator with as they
+            arrive (see :meth:`send_rpc`)
+        :type reducer: function or None
+        :param initial: the starting accumulator for ``reducer``
+        :param coalesce:
+            whether to attach to an identical RPC in flight rather than send
+            this one (see :meth:`send_rpc`)
+        :type coalesce: bool
+        :param idempotent:
+            whether to re-send the request to another peer if the connection
+            to its target is lost, until ``timeout`` (see :meth:`send_rpc`)
+        :type idempotent: bool
 
         :returns:
             a list of the objects returned by the RPC's targets. these could be
@@ -341,9 +799,80 @@ class Hub(object):
               was provided and it expires
         '''
         rpc = self.send_rpc(service, routing_id, method,
-                args or (), kwargs or {}, broadcast)
+                args or (), kwargs or {}, broadcast, hedge, quorum, first_k,
+                reducer, initial, coalesce, idempotent)
         return rpc.get(timeout)
 
+    def rpc_many(self, requests, broadcast=False):
+        '''Send out many RPC requests at once
+
+        The requests are routed individually, but all of those headed to the
+        same peer are sent together in a single frame.
+
+        :param requests:
+            the requests to send, each a ``(service, routing_id, method, args,
+            kwargs)`` tuple (``args`` and ``kwargs`` may be ``None``). Chunked
+            requests can't be sent this way.
+        :type requests: list
+        :param broadcast:
+            if ``True``, send each request to every peer with a matching
+            subscription
+        :type broadcast: bool
+
+        :returns:
+            a list of :class:`RPC <junction.futures.RPC>` objects, one for
+            each of the ``requests`` in the same order. Those with no
+            registered receivers will already be aborted with
+            :class:`Unroutable <junction.errors.Unroutable>`.
+
+        :raises:
+            :class:`IllegalMessage <junction.errors.IllegalMessage>` if any of
+            the requests would have been chunked
+        '''
+        singular = not broadcast
+        rpcs = self._dispatcher.send_rpc_many(
+                [(service, routing_id, method, args or (), kwargs or {})
+                for service, routing_id, method, args, kwargs in requests],
+                singular)
+
+        for i, rpc in enumerate(rpcs):
+            if rpc is None:
+                rpcs[i] = rpc = futures.RPC(0, singular)
+                rpc.abort(errors.Unroutable, errors.Unroutable())
+
+        return rpcs
+
+    def scatter_rpc(self, service, method, requests):
+        '''Send a singular RPC to each of many routing ids, with their own args
+
+        Routes are resolved for every routing_id up front, and the requests
+        that end up headed to the same peer are sent in a single frame.
+
+        :param service: the service name (the routing top level)
+        :type service: anything hash-able
+        :param method: the method name to call
+        :type method: string
+        :param requests:
+            a dict mapping each routing_id to the ``(args, kwargs)`` to send
+            it (either may be ``None``). Chunked requests can't be sent this
+            way.
+        :type requests: dict
+
+        :returns:
+            a :class:`Gather <junction.futures.Gather>` future, whose value is
+            a dict mapping each routing_id to its RPC's result, or to the
+            exception it failed with (including
+            :class:`Unroutable <junction.errors.Unroutable>`)
+
+        :raises:
+            :class:`IllegalMessage <junction.errors.IllegalMessage>` if any of
+            the requests would have been chunked
+        '''
+        routing_ids = requests.keys()
+        rpcs = self.rpc_many([(service, routing_id, method) +
+                tuple(requests[routing_id]) for routing_id in routing_ids])
+        return futures.Gather(zip(routing_ids, rpcs))
+
     def rpc_receiver_count(self, service, routing_id):
         '''Get the number of peers that would handle a particular RPC
 
@@ -363,14 +892,31 @@ class Hub(object):
             return peers + 1
         return peers
 
+    def peer_stats(self):
+        '''Get the health and performance figures kept on connected peers
+
+        :returns:
+            a dict mapping peer ``(host, port)`` identities to dicts with keys
+            ``latency`` (the moving average RPC response time in seconds),
+            ``load`` (the last reported ``(run queue, pending handlers, send
+            queue)``, or ``None``), ``error_rate`` (the moving average rate of
+            failed responses), and ``ejected`` (whether the peer is currently
+            left out of singular target selection for its error rate)
+        '''
+        stats = self._dispatcher.peer_stats
+        return dict((ident, stats.snapshot(ident))
+                for ident in self._dispatcher.peers)
+
     def start(self):
         "Start up the hub's server, and have it start initiating connections"
         log.info("starting")
 
         self._listener_coro = backend.greenlet(self._listener)
         self._udp_listener_coro = backend.greenlet(self._udp_listener)
+        self._load_reporter_coro = backend.greenlet(self._load_reporter)
         backend.schedule(self._listener_coro)
         backend.schedule(self._udp_listener_coro)
+        backend.schedule(self._load_reporter_coro)
 
         for addr in self._peers:
             self.add_peer(addr)
@@ -413,6 +959,11 @@ class Hub(object):
             # collected if it goes down in the meantime.
             del client, peer
 
+    def _load_reporter(self):
+        while not self._closing:
+            backend.pause_for(LOAD_REPORT_INTERVAL)
+            self._dispatcher.report_load()
+
     def _udp_listener(self):
         sock = backend.Socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -425,7 +976,7 @@ class Hub(object):
                 msg, addr = sock.recvfrom(MAX_UDP_PACKET_SIZE)
             except errors._BailOutOfListener:
                 log.info("closing listener socket")
-                server.close()
+                sock.close()
                 break
 
             msg = mummy.loads(msg)
@@ -3,11 +3,14 @@
 
 import logging
 import sys
+import time
 import traceback
 import unittest
 
 import gevent.coros
 import junction
+import junction.core.codecs
+import junction.core.selection
 import junction.errors
 from junction.core import backend
 
@@ -341,6 +344,354 @@ class JunctionTests(object):
 
         self.assertEqual(results, [1,2])
 
+    def test_publish_many(self):
+        results = []
+        ev = backend.Event()
+
+        @self.peer.accept_publish("service", 0, 0, "method")
+        def handler(item):
+            results.append(item)
+            if len(results) == 4:
+                ev.set()
+
+        backend.pause_for(TIMEOUT)
+
+        self.sender.publish_many([("service", 0, "method", (i,), None)
+                for i in xrange(1, 5)])
+
+        ev.wait(TIMEOUT)
+
+        self.assertEqual(results, [1, 2, 3, 4])
+
+    def test_rpc_many(self):
+        handler_results = []
+
+        @self.peer.accept_rpc("service", 0, 0, "method")
+        def handler(x):
+            handler_results.append(x)
+            return x ** 2
+
+        backend.pause_for(TIMEOUT)
+
+        rpcs = self.sender.rpc_many([("service", 0, "method", (i,), {})
+                for i in xrange(1, 5)])
+        junction.wait_all(rpcs, TIMEOUT)
+
+        self.assertEqual(sorted(handler_results), [1, 2, 3, 4])
+        self.assertEqual([rpc.value for rpc in rpcs], [1, 4, 9, 16])
+
+    def test_rpc_many_unroutable(self):
+        self.peer.accept_rpc("service", 0, 0, "method", lambda: 1)
+
+        backend.pause_for(TIMEOUT)
+
+        rpcs = self.sender.rpc_many([
+            ("service", 0, "method", None, None),
+            ("other", 0, "method", None, None)])
+        junction.wait_all(rpcs, TIMEOUT)
+
+        self.assertEqual(rpcs[0].value, 1)
+        self.assertRaises(junction.errors.Unroutable, lambda: rpcs[1].value)
+
+    def test_rpc_quorum_and_first_k(self):
+        # a second handler, reachable by whichever hub routes our RPCs
+        if isinstance(self.sender, junction.Hub):
+            other = self.create_hub([self.sender.addr])
+        else:
+            other = self.create_hub([self.connection.addr])
+        other.wait_connected()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler():
+            return 1
+
+        @other.accept_rpc('service', 0, 0, 'method')
+        def handler():
+            backend.pause_for(TIMEOUT * 20)
+            return 2
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            self.assertEqual(self.sender.rpc('service', 0, 'method',
+                timeout=TIMEOUT * 5, broadcast=True, quorum=1), [1])
+            self.assertEqual(self.sender.rpc('service', 0, 'method',
+                timeout=TIMEOUT * 5, broadcast=True, first_k=1), [1])
+        finally:
+            other.shutdown()
+
+    def test_rpc_reducer(self):
+        if isinstance(self.sender, junction.Hub):
+            other = self.create_hub([self.sender.addr])
+        else:
+            other = self.create_hub([self.connection.addr])
+        other.wait_connected()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return [x, x + 1]
+
+        @other.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            raise ValueError(x)
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            rpc = self.sender.send_rpc('service', 0, 'method', (3,),
+                    broadcast=True, reducer=lambda acc, r: acc + sum(r),
+                    initial=10)
+            self.assertEqual(rpc.get(TIMEOUT), 17)
+            self.assertEqual(len(rpc.errors), 1)
+            self.assertEqual(type(rpc.errors[0]),
+                    junction.errors.RemoteException)
+        finally:
+            other.shutdown()
+
+    def test_scatter_rpc(self):
+        if isinstance(self.sender, junction.Hub):
+            other = self.create_hub([self.sender.addr])
+        else:
+            other = self.create_hub([self.connection.addr])
+        other.wait_connected()
+
+        @self.peer.accept_rpc('service', 3, 0, 'method')
+        def handler(keys):
+            return ('peer', keys)
+
+        @other.accept_rpc('service', 3, 1, 'method')
+        def handler(keys, extra=None):
+            return ('other', keys, extra)
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            gather = self.sender.scatter_rpc('service', 'method', {
+                0: ((['a', 'b'],), None),
+                1: ((['c'],), {'extra': 1}),
+                2: ((['d'],), None),
+            })
+            results = gather.get(TIMEOUT)
+            self.assertEqual(results[0], ('peer', ['a', 'b']))
+            self.assertEqual(results[1], ('other', ['c'], 1))
+            self.assertEqual(type(results[2]), junction.errors.Unroutable)
+        finally:
+            other.shutdown()
+
+    def test_rpc_coalescing(self):
+        calls = []
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            calls.append(x)
+            backend.pause_for(TIMEOUT)
+            return x * 2
+
+        backend.pause_for(TIMEOUT)
+
+        rpcs = [self.sender.send_rpc('service', 0, 'method', (1,),
+            coalesce=True) for i in xrange(3)]
+        rpcs.append(self.sender.send_rpc('service', 0, 'method', (2,),
+            coalesce=True))
+
+        self.assert_(rpcs[0] is rpcs[1] is rpcs[2])
+        self.assertEqual([rpc.get(TIMEOUT * 4) for rpc in rpcs], [2, 2, 2, 4])
+        self.assertEqual(sorted(calls), [1, 2])
+
+        # and once it's done, the next one gets sent
+        rpc = self.sender.send_rpc('service', 0, 'method', (1,), coalesce=True)
+        self.assert_(rpc is not rpcs[0])
+        self.assertEqual(rpc.get(TIMEOUT * 4), 2)
+
+    def test_rpc_handler_coalescing(self):
+        calls = []
+
+        @self.peer.accept_rpc('service', 0, 0, 'method', coalesce=True)
+        def handler(x):
+            calls.append(x)
+            backend.pause_for(TIMEOUT)
+            return x * 2
+
+        backend.pause_for(TIMEOUT)
+
+        rpcs = [self.sender.send_rpc('service', 0, 'method', (1,))
+                for i in xrange(3)]
+        self.assertEqual([rpc.get(TIMEOUT * 4) for rpc in rpcs], [2, 2, 2])
+        self.assertEqual(calls, [1])
+
+    def test_rpc_response_cache(self):
+        calls = []
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            calls.append(x)
+            return [x, len(calls)]
+
+        self.sender.cache_rpc('service', 'method', 60)
+
+        backend.pause_for(TIMEOUT)
+
+        first = self.sender.rpc('service', 0, 'method', (1,), timeout=TIMEOUT)
+        self.assertEqual(first, [1, 1])
+
+        # hits each get their own copy
+        first.append(None)
+        self.assertEqual(
+                self.sender.rpc('service', 0, 'method', (1,), timeout=TIMEOUT),
+                [1, 1])
+        self.assertEqual(
+                self.sender.rpc('service', 0, 'method', (2,), timeout=TIMEOUT),
+                [2, 2])
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(self.sender.cache_stats(),
+                {('service', 'method'): {'hits': 1, 'misses': 2, 'size': 2}})
+
+        self.assertEqual(self.sender.invalidate_cache('service', 'method'), 2)
+        self.assertEqual(
+                self.sender.rpc('service', 0, 'method', (1,), timeout=TIMEOUT),
+                [1, 3])
+
+    def test_conflated_publish(self):
+        received = []
+
+        @self.peer.accept_publish('service', 0, 0, 'state')
+        def handler(x):
+            received.append(x)
+
+        backend.pause_for(TIMEOUT)
+
+        # none of these get sent before the next is queued behind it
+        for i in xrange(5):
+            self.sender.publish('service', 0, 'state', (i,), conflate=True)
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(received, [4])
+
+        for i in xrange(3):
+            self.sender.publish('service', 0, 'state', (i,))
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(received, [4, 0, 1, 2])
+
+    def test_rate_limiting(self):
+        received = []
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x
+
+        @self.peer.accept_publish('service', 0, 0, 'event')
+        def handler(x):
+            received.append(x)
+
+        self.peer.rate_limit(0.01, 2, service='service', method='method')
+        self.peer.rate_limit(0.01, 1, service='service', method='event')
+
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(self.sender.rpc('service', 0, 'method', (1,),
+            timeout=TIMEOUT), 1)
+        self.assertEqual(self.sender.rpc('service', 0, 'method', (2,),
+            timeout=TIMEOUT), 2)
+        self.assertRaises(junction.errors.Throttled, self.sender.rpc,
+                'service', 0, 'method', (3,), timeout=TIMEOUT)
+
+        for i in xrange(3):
+            self.sender.publish('service', 0, 'event', (i,))
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(received, [0])
+        self.assertEqual(self.peer.rate_limit_stats(), {
+            ('service', 'method'): {'dropped': 0, 'throttled': 1},
+            ('service', 'event'): {'dropped': 2, 'throttled': 0}})
+
+        self.assert_(self.peer.remove_rate_limit('service', 'method'))
+        self.assertEqual(self.sender.rpc('service', 0, 'method', (4,),
+            timeout=TIMEOUT), 4)
+
+    def test_load_shedding(self):
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x
+
+        self.peer.shed_load(0.01, 0.05)
+        queueing = self.peer._dispatcher.queueing
+
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(self.sender.rpc('service', 0, 'method', (1,),
+            timeout=TIMEOUT), 1)
+
+        # a queueing delay that has stood above target for the interval
+        queueing.observe(1.0)
+        time.sleep(0.06)
+        queueing.observe(1.0)
+
+        self.assertRaises(junction.errors.Overloaded, self.sender.rpc,
+                'service', 0, 'method', (2,), timeout=TIMEOUT)
+        self.assertEqual(self.peer.load_shedding_stats()['shed'], 1)
+
+        # and it recovers as soon as the delay drops
+        queueing.observe(0.0)
+        self.assertEqual(self.peer.load_shedding_stats(),
+                {'overloaded': False, 'shed': 1})
+        self.assertEqual(self.sender.rpc('service', 0, 'method', (3,),
+            timeout=TIMEOUT), 3)
+
+    def test_raw_handlers(self):
+        bodies = []
+        ev = backend.Event()
+
+        @self.peer.accept_publish('service', 0, 0, 'method', raw=True)
+        def handler(body):
+            bodies.append(junction.core.codecs.loads_body(body))
+            ev.set()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method', raw=True)
+        def handler(body):
+            args, kwargs = junction.core.codecs.loads_body(body)
+            return args[0] + kwargs['y']
+
+        backend.pause_for(TIMEOUT)
+
+        self.sender.publish('service', 0, 'method', (1,), {'y': 2})
+        ev.wait(TIMEOUT)
+        self.assertEqual(bodies, [((1,), {'y': 2})])
+
+        self.assertEqual(self.sender.rpc('service', 0, 'method', (1,),
+            {'y': 2}, timeout=TIMEOUT), 3)
+
+    def test_chunked_rate_limiting(self):
+        received = []
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(chunks):
+            return list(chunks)
+
+        @self.peer.accept_publish('service', 0, 0, 'event')
+        def handler(chunks):
+            received.append(list(chunks))
+
+        self.peer.rate_limit(0.01, 1, service='service')
+
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(self.sender.rpc('service', 0, 'method',
+            ((x for x in xrange(2)),), timeout=TIMEOUT), [0, 1])
+        self.assertRaises(junction.errors.Throttled, self.sender.rpc,
+                'service', 0, 'method', ((x for x in xrange(2)),),
+                timeout=TIMEOUT)
+
+        for i in xrange(2):
+            self.sender.publish('service', 0, 'event',
+                    ((x for x in xrange(i + 1)),))
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(received, [])
+        self.assertEqual(self.peer.rate_limit_stats(), {
+            ('service', 'method'): {'dropped': 0, 'throttled': 1},
+            ('service', 'event'): {'dropped': 2, 'throttled': 0}})
+
 
 class HubTests(JunctionTests, GeventTestCase):
     def build_sender(self):
@@ -380,6 +731,534 @@ class HubTests(JunctionTests, GeventTestCase):
         self.assertEqual(2,
                 self.sender.publish_receiver_count('service', 0))
 
+    def test_latency_aware_selection(self):
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x * 2
+
+        hub = junction.Hub(("127.0.0.1", self.peer.addr[1] + 1),
+                [self.peer.addr], selection="p2c")
+        hub.start()
+        hub.wait_connected()
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            self.assertEqual(hub.rpc('service', 0, 'method', (4,),
+                timeout=TIMEOUT), 8)
+            self.assertEqual(hub._dispatcher.peer_stats.latencies.keys(),
+                    [self.peer._ident])
+        finally:
+            hub.shutdown()
+
+    def test_unknown_selection(self):
+        self.assertRaises(ValueError, junction.Hub,
+                ("127.0.0.1", self.peer.addr[1] + 1), [], selection="bogus")
+
+    def test_consistent_hash_selection(self):
+        class Target(object):
+            def __init__(self, ident):
+                self.ident = ident
+
+        selector = junction.core.selection.get("consistent_hash")
+        targets = [Target(("127.0.0.1", port)) for port in xrange(10)]
+        targets.append(Target(None))
+        select = lambda rid: selector.select(
+                self.sender._dispatcher, targets, 'service', rid, 'method')
+
+        chosen = dict((rid, select(rid)) for rid in xrange(200))
+        self.assertEqual(chosen, dict((rid, select(rid)) for rid in xrange(200)))
+        self.assert_(len(set(chosen.values())) > 1)
+
+        # dropping a target only moves the routing_ids it had been chosen for
+        gone = targets.pop(3)
+        for rid, target in chosen.iteritems():
+            if target is not gone:
+                self.assertEqual(select(rid), target)
+
+    def test_load_feedback(self):
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler():
+            return 1
+
+        backend.pause_for(TIMEOUT)
+
+        loads = self.sender._dispatcher.peer_stats.loads
+        self.assertEqual(self.sender.rpc('service', 0, 'method', (),
+            timeout=TIMEOUT), 1)
+        self.assertEqual(loads.keys(), [self.peer._ident])
+        self.assertEqual(len(loads[self.peer._ident]), 3)
+
+        loads.clear()
+        self.peer._dispatcher.report_load()
+        backend.pause_for(TIMEOUT)
+        self.assertEqual(loads.keys(), [self.peer._ident])
+
+    def test_unhealthy_peer_ejection(self):
+        class Hooks(object):
+            ejected = []
+
+            def peer_ejected(self, peer, error_rate):
+                self.ejected.append(peer)
+
+        self.sender._dispatcher.hooks = Hooks()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler():
+            raise ValueError("broken")
+
+        backend.pause_for(TIMEOUT)
+
+        for i in xrange(20):
+            self.assertRaises(junction.errors.RemoteException,
+                    self.sender.rpc, 'service', 0, 'method', (),
+                    timeout=TIMEOUT)
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(Hooks.ejected, [self.peer._ident])
+        stats = self.sender.peer_stats()[self.peer._ident]
+        self.assert_(stats['ejected'])
+        self.assert_(stats['error_rate'] >= 0.5)
+
+        # with nowhere else to go, the ejected peer still gets the RPCs
+        self.assertRaises(junction.errors.RemoteException,
+                self.sender.rpc, 'service', 0, 'method', (), timeout=TIMEOUT)
+
+    def test_hedged_rpc(self):
+        other = self.create_hub([self.sender.addr])
+        other.wait_connected()
+
+        slow = []
+        seen = set()
+
+        def handler(i):
+            if i in seen:
+                return 'hedge'
+            seen.add(i)
+            if slow:
+                backend.pause_for(TIMEOUT * 20)
+            return 'first'
+
+        self.peer.accept_rpc('service', 0, 0, 'method', handler)
+        other.accept_rpc('service', 0, 0, 'method', handler)
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            for i in xrange(20):
+                self.assertEqual(self.sender.rpc('service', 0, 'method', (i,),
+                    timeout=TIMEOUT, hedge=True), 'first')
+
+            slow.append(None)
+            self.assertEqual(self.sender.rpc('service', 0, 'method', (20,),
+                timeout=TIMEOUT * 10, hedge=True), 'hedge')
+        finally:
+            other.shutdown()
+
+    def test_rpc_cache_invalidated_by_publish(self):
+        calls = []
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler():
+            calls.append(None)
+            return len(calls)
+
+        self.sender.cache_rpc('service', 'method', 60)
+        self.sender.invalidate_cache_on_publish('service', 0, 0, 'changed')
+
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(self.sender.rpc('service', 0, 'method'), 1)
+        self.assertEqual(self.sender.rpc('service', 0, 'method'), 1)
+
+        self.peer.publish('service', 0, 'changed')
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(self.sender.rpc('service', 0, 'method'), 2)
+
+    def test_last_value_cache(self):
+        received = []
+
+        @self.peer.accept_publish('service', 0, 0, 'price')
+        def handler(price):
+            received.append(price)
+
+        self.sender.keep_last_values('service', 'price')
+        self.peer.keep_last_values('service', 'price')
+
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(self.sender.last_value('service', 0, 'price'), None)
+
+        self.sender.publish('service', 0, 'price', (10,))
+        self.sender.publish('service', 0, 'price', (11,))
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(received, [10, 11])
+        self.assertEqual(self.sender.last_value('service', 0, 'price'),
+                ((11,), {}))
+        self.assertEqual(self.peer.last_value('service', 0, 'price'),
+                ((11,), {}))
+        self.assertEqual(self.sender.last_value('service', 1, 'price'), None)
+
+    def test_idempotent_rpc_retry(self):
+        other = self.create_hub([self.sender.addr])
+        other.wait_connected()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return 'peer'
+
+        @other.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            backend.pause_for(TIMEOUT * 20)
+            return 'other'
+
+        class PreferOther(junction.core.selection.Selector):
+            def select(self, dispatcher, targets, service, routing_id, method):
+                for target in targets:
+                    if target.ident == other._ident:
+                        return target
+                return targets[0]
+
+        self.sender._dispatcher.selector = PreferOther()
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            retried = self.sender.send_rpc('service', 0, 'method', (1,),
+                    idempotent=True)
+            lost = self.sender.send_rpc('service', 0, 'method', (2,))
+            backend.pause_for(TIMEOUT)
+
+            # the connection drops with both requests in flight
+            for peer in other._dispatcher.peers.values():
+                peer.sock.close()
+
+            self.assertEqual(retried.get(TIMEOUT * 4), 'peer')
+            self.assertRaises(junction.errors.LostConnection, lost.get,
+                    TIMEOUT * 4)
+        finally:
+            other.shutdown()
+
+    def test_interned_service_and_method(self):
+        results = []
+        ev = backend.Event()
+
+        @self.peer.accept_publish('service', 0, 0, 'method')
+        def handler(x):
+            results.append(x)
+            ev.set()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x * 2
+
+        backend.pause_for(TIMEOUT)
+
+        self.sender.publish('service', 0, 'method', (1,))
+        ev.wait(TIMEOUT)
+        self.assertEqual(results, [1])
+
+        for i in xrange(3):
+            self.assertEqual(self.sender.rpc('service', 0, 'method', (i,),
+                timeout=TIMEOUT), i * 2)
+
+        # just the one id, for the pair, on each end of the connection
+        sent = self.sender._dispatcher.peers[self.peer._ident]
+        received = self.peer._dispatcher.peers[self.sender._ident]
+        self.assertEqual(sent.interned, {('service', 'method'): 1})
+        self.assertEqual(received.interns, {1: ('service', 'method')})
+
+    def test_negotiated_codecs(self):
+        global PORT
+        hubs = []
+        for codecs in [['marshal', 'mummy'], ['marshal', 'mummy'], None]:
+            hub = junction.Hub(("127.0.0.1", PORT),
+                    [h.addr for h in hubs[:1]], codecs=codecs)
+            PORT += 2
+            hub.start()
+            hubs.append(hub)
+        server, fast, plain = hubs
+
+        @server.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return [x, {'y': (x,)}]
+
+        client = junction.Client(server.addr, codecs=['marshal'])
+        client.connect()
+        client.wait_connected()
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            self.assertEqual(
+                    fast._dispatcher.peers[server._ident].codec.name,
+                    'marshal')
+            self.assertEqual(
+                    plain._dispatcher.peers[server._ident].codec.name,
+                    'mummy')
+            self.assertEqual(client._peer.codec.name, 'marshal')
+
+            for hub in (fast, plain):
+                self.assertEqual(hub.rpc('service', 0, 'method', (1,),
+                    timeout=TIMEOUT), [1, {'y': (1,)}])
+            self.assertEqual(client.rpc('service', 0, 'method', (2,),
+                timeout=TIMEOUT), [2, {'y': (2,)}])
+
+            self.assertRaises(ValueError, junction.Hub,
+                    ("127.0.0.1", PORT), [], codecs=['bogus'])
+        finally:
+            client.shutdown()
+            for hub in hubs:
+                hub.shutdown()
+
+    def test_offloaded_large_frames(self):
+        from junction.core import backend as junction_backend
+        from junction.core import connection
+        global PORT
+        hubs = []
+        for i in xrange(2):
+            hub = junction.Hub(("127.0.0.1", PORT),
+                    [h.addr for h in hubs])
+            PORT += 2
+            hub.start()
+            hubs.append(hub)
+        server, sender = hubs
+
+        @server.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x[::-1]
+
+        offloaded = []
+        run_in_thread = junction_backend.run_in_thread
+        def counting(func, args=()):
+            offloaded.append(func)
+            return run_in_thread(func, args)
+
+        threshold = connection.OFFLOAD_THRESHOLD
+        connection.OFFLOAD_THRESHOLD = 1024
+        junction_backend.run_in_thread = counting
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            self.assertEqual(sender.rpc('service', 0, 'method', ([1],),
+                timeout=TIMEOUT), [1])
+            self.assertEqual(offloaded, [])
+
+            big = range(5000)
+            self.assertEqual(sender.rpc('service', 0, 'method', (big,),
+                timeout=TIMEOUT), big[::-1])
+            self.assertNotEqual(offloaded, [])
+        finally:
+            connection.OFFLOAD_THRESHOLD = threshold
+            junction_backend.run_in_thread = run_in_thread
+            for hub in hubs:
+                hub.shutdown()
+
+    def test_batch_to_local_target(self):
+        from junction.core import const, dispatch
+        results = []
+
+        def handler(x):
+            results.append(x)
+            return x * 10
+
+        dispatcher = self.sender._dispatcher
+        target = dispatch.LocalTarget(dispatcher, handler, False)
+
+        # entries headed for the same target are batched, local or not
+        target.push((const.MSG_TYPE_BATCH_PUBLISH, (
+            ("service", 0, "method", (1,), {}),
+            ("service", 0, "method", (2,), {}))))
+        rpcs = dispatcher.rpc_client.request_many([
+            ([target], ("service", 0, "method", (3,), {})),
+            ([target], ("service", 0, "method", (4,), {}))])
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(results, [1, 2, 3, 4])
+        self.assertEqual([rpc.get(TIMEOUT) for counter, rpc in rpcs],
+                [[30], [40]])
+
+    def test_interned_frames_queued_across_reconnect(self):
+        from junction.core import const, dispatch
+        results = []
+
+        @self.peer.accept_publish('service', 0, 0, 'method')
+        def handler(x):
+            results.append(x)
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x * 2
+
+        backend.pause_for(TIMEOUT)
+
+        self.sender.publish('service', 0, 'method', (1,))
+        backend.pause_for(TIMEOUT)
+        self.assertEqual(results, [1])
+
+        # frames using the id are still queued when the connection drops
+        peer = self.sender._dispatcher.peers[self.peer._ident]
+        peer.go_down(reconnect=True)
+        peer.push((const.MSG_TYPE_PUBLISH,
+            ('service', 0, 'method') + dispatch.pack((2,), {})))
+        counter, rpc = self.sender._dispatcher.rpc_client.request([peer],
+                ('service', 0, 'method') + dispatch.pack((3,), {}))
+
+        self.assertEqual(rpc.get(TIMEOUT * 4), [6])
+        self.assertEqual(results, [1, 2])
+
+    def test_chunked_messages_in_negotiated_codec(self):
+        global PORT
+        hubs = []
+        for i in xrange(2):
+            hub = junction.Hub(("127.0.0.1", PORT),
+                    [h.addr for h in hubs], codecs=['marshal'])
+            PORT += 2
+            hub.start()
+            hubs.append(hub)
+        server, sender = hubs
+
+        published = []
+        ev = backend.Event()
+
+        @server.accept_publish('service', 0, 0, 'method')
+        def handler(items):
+            published.extend(items)
+            ev.set()
+
+        @server.accept_rpc('service', 0, 0, 'method')
+        def handler(items):
+            return sum(items)
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            self.assertEqual(
+                    sender._dispatcher.peers[server._ident].codec.name,
+                    'marshal')
+
+            sender.publish('service', 0, 'method', ((x for x in xrange(3)),))
+            ev.wait(TIMEOUT)
+            self.assertEqual(published, [0, 1, 2])
+
+            self.assertEqual(sender.rpc('service', 0, 'method',
+                ((x for x in xrange(4)),), timeout=TIMEOUT), 6)
+            self.assertEqual(sender.rpc('service', 0, 'method', ([5],),
+                timeout=TIMEOUT), 5)
+        finally:
+            for hub in hubs:
+                hub.shutdown()
+
+    def test_undecodable_frame_dropped(self):
+        import struct
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x * 2
+
+        backend.pause_for(TIMEOUT)
+
+        sent = self.sender._dispatcher.peers[self.peer._ident]
+        received = self.peer._dispatcher.peers[self.sender._ident]
+
+        sent.push_string(struct.pack("!I", 9) + "\xff\x01garbage")
+        backend.pause_for(TIMEOUT)
+
+        # the connection carries on past the frame
+        self.assertTrue(received.up)
+        self.assertEqual(self.sender.rpc('service', 0, 'method', (4,),
+            timeout=TIMEOUT), 8)
+
+    def test_hedge_delay_learned_from_all_rpcs(self):
+        global PORT
+        sender = junction.Hub(("127.0.0.1", PORT), [self.peer.addr],
+                hedge_budget=1.0)
+        PORT += 2
+        sender.start()
+        sender.wait_connected()
+        other = self.create_hub([sender.addr])
+        other.wait_connected()
+
+        slow = []
+        seen = set()
+
+        def handler(i):
+            if i in seen:
+                return 'hedge'
+            seen.add(i)
+            if slow:
+                backend.pause_for(TIMEOUT * 20)
+            return 'first'
+
+        self.peer.accept_rpc('service', 0, 0, 'method', handler)
+        other.accept_rpc('service', 0, 0, 'method', handler)
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            # none of these hedge, but their response times all count
+            for i in xrange(20):
+                self.assertEqual(sender.rpc('service', 0, 'method', (i,),
+                    timeout=TIMEOUT), 'first')
+            self.assertEqual(sender._dispatcher.timings, {})
+
+            slow.append(None)
+            self.assertEqual(sender.rpc('service', 0, 'method', (20,),
+                timeout=TIMEOUT * 10, hedge=True), 'hedge')
+        finally:
+            other.shutdown()
+            sender.shutdown()
+
+    def test_bodies_packed_in_connection_codec(self):
+        global PORT
+        hubs = []
+        for codecs in [['marshal', 'mummy'], ['marshal', 'mummy'], None]:
+            hub = junction.Hub(("127.0.0.1", PORT),
+                    [h.addr for h in hubs[:1]], codecs=codecs)
+            PORT += 2
+            hub.start()
+            hubs.append(hub)
+        proxy, server, plain = hubs
+
+        # complex numbers are beyond mummy, but not marshal
+        @server.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x * 2
+
+        @plain.accept_rpc('service2', 0, 0, 'method')
+        def handler(x):
+            return x.imag
+
+        client = junction.Client(proxy.addr, codecs=['marshal'])
+        client.connect()
+        client.wait_connected()
+
+        for i in xrange(20):
+            if proxy.rpc_receiver_count('service', 0) and \
+                    proxy.rpc_receiver_count('service2', 0):
+                break
+            backend.pause_for(TIMEOUT)
+
+        try:
+            self.assertEqual(proxy.rpc('service', 0, 'method', (1j,),
+                timeout=TIMEOUT, broadcast=True), [2j])
+            self.assertEqual(client.rpc('service', 0, 'method', (2j,),
+                timeout=TIMEOUT), 4j)
+
+            # forwarded untouched over a mummy connection, and still decoded
+            self.assertEqual(
+                    proxy._dispatcher.peers[plain._ident].codec.name,
+                    'mummy')
+            self.assertEqual(client.rpc('service2', 0, 'method', (3j,),
+                timeout=TIMEOUT), 3.0)
+        finally:
+            client.shutdown()
+            for hub in hubs:
+                hub.shutdown()
+
 
 class ClientTests(JunctionTests, GeventTestCase):
     def build_sender(self):
@@ -387,6 +1266,303 @@ class ClientTests(JunctionTests, GeventTestCase):
         self.sender.connect()
         self.sender.wait_connected()
 
+    def test_aggregated_rpc(self):
+        other = self.create_hub([self.connection.addr])
+        other.wait_connected()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return [x]
+
+        @other.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return [x * 2]
+
+        self.connection.register_aggregator(
+                'concat', lambda acc, r: acc + r, [])
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            result = self.sender.rpc('service', 0, 'method', (3,),
+                    timeout=TIMEOUT, broadcast=True, aggregate='concat')
+            self.assertEqual(sorted(result), [3, 6])
+
+            self.assertRaises(junction.errors.RemoteException,
+                    self.sender.rpc, 'service', 0, 'method', (3,),
+                    timeout=TIMEOUT, broadcast=True, aggregate='missing')
+        finally:
+            other.shutdown()
+
+    def test_last_value_query(self):
+        @self.peer.accept_publish('service', 0, 0, 'price')
+        def handler(price):
+            pass
+
+        self.connection.keep_last_values('service', 'price')
+
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(self.sender.last_value('service', 0, 'price',
+            timeout=TIMEOUT), None)
+
+        self.sender.publish('service', 0, 'price', (10,), {'currency': 'x'})
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(self.sender.last_value('service', 0, 'price',
+            timeout=TIMEOUT), ((10,), {'currency': 'x'}))
+
+    def test_per_client_rate_limit(self):
+        other = self.create_hub([self.peer.addr])
+        other.wait_connected()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x
+
+        self.peer.rate_limit(0.01, 1, per_client=True)
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            self.assertEqual(self.sender.rpc('service', 0, 'method', (1,),
+                timeout=TIMEOUT), 1)
+            self.assertRaises(junction.errors.Throttled, self.sender.rpc,
+                    'service', 0, 'method', (2,), timeout=TIMEOUT)
+
+            # peer hubs aren't covered by per-client limits
+            for i in xrange(3):
+                self.assertEqual(other.rpc('service', 0, 'method', (i,),
+                    timeout=TIMEOUT), i)
+        finally:
+            other.shutdown()
+
+    def test_standby_failover(self):
+        proxies = [self.create_hub([self.peer.addr]), self.create_hub(
+            [self.peer.addr])]
+        release = backend.Event()
+        calls = []
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            calls.append(x)
+            release.wait()
+            return x * 2
+
+        client = junction.Client([p.addr for p in proxies], standbys=1)
+        client.connect()
+        client.wait_connected()
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            retried = client.send_rpc('service', 0, 'method', (3,),
+                    idempotent=True)
+            lost = client.send_rpc('service', 0, 'method', (4,))
+
+            backend.pause_for(TIMEOUT)
+
+            # kill the primary hub connection out from under the client
+            primary = client._peer
+            primary.sock.close()
+
+            backend.pause_for(TIMEOUT)
+
+            self.assertIsNot(client._peer, primary)
+            self.assertEqual(client._peer.addr, proxies[1].addr)
+
+            release.set()
+
+            self.assertEqual(retried.get(TIMEOUT), 6)
+            self.assertRaises(junction.errors.LostConnection, lost.get,
+                    TIMEOUT)
+            self.assertEqual(sorted(calls), [3, 3, 4])
+
+            self.assertEqual(client.rpc('service', 0, 'method', (5,),
+                timeout=TIMEOUT), 10)
+        finally:
+            release.set()
+            client.shutdown()
+            for proxy in proxies:
+                proxy.shutdown()
+
+    def test_pooled_client(self):
+        proxies = [self.create_hub([self.peer.addr]), self.create_hub(
+            [self.peer.addr])]
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x * 2
+
+        pool = junction.PooledClient([p.addr for p in proxies],
+                strategy='round_robin')
+        pool.connect()
+        self.assertTrue(pool.wait_connected(TIMEOUT))
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            for i in xrange(4):
+                self.assertEqual(pool.rpc('service', 0, 'method', (i,),
+                    timeout=TIMEOUT), i * 2)
+
+            # the requests were spread over both connections
+            self.assertEqual([m._rpc_client.counter for m in pool._members],
+                    [3, 3])
+
+            # a failed member is passed over
+            pool._members[0]._peer.sock.close()
+            backend.pause_for(TIMEOUT)
+
+            for i in xrange(4):
+                self.assertEqual(pool.rpc('service', 0, 'method', (i,),
+                    timeout=TIMEOUT), i * 2)
+            self.assertEqual(pool._members[1]._rpc_client.counter, 7)
+
+            pool._members[1]._peer.sock.close()
+            backend.pause_for(TIMEOUT)
+
+            self.assertRaises(junction.errors.Unroutable,
+                    pool.rpc, 'service', 0, 'method', (1,))
+        finally:
+            pool.shutdown()
+            for proxy in proxies:
+                proxy.shutdown()
+
+    def test_direct_rpc(self):
+        proxy = self.create_hub([self.peer.addr])
+        listener = self.create_hub([proxy.addr])
+        other = None
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return x * 2
+
+        @listener.accept_publish('service', 0, 0, 'event')
+        def handler(x):
+            pass
+
+        backend.pause_for(TIMEOUT)
+
+        client = junction.Client(proxy.addr, direct=True)
+        client.connect()
+        client.wait_connected()
+
+        def dialled(ident):
+            for i in xrange(20):
+                peer = client._direct_peers.get(ident)
+                if peer is not None and peer.up:
+                    return peer
+                backend.pause_for(TIMEOUT)
+
+        try:
+            self.assertIsNot(dialled(self.peer._ident), None)
+
+            # only the hubs besides the proxy that handle RPCs are dialled
+            self.assertEqual(client._direct_peers.keys(), [self.peer._ident])
+
+            direct = client._direct_client.counter
+            proxied = client._rpc_client.counter
+            self.assertEqual(client.rpc('service', 0, 'method', (3,),
+                timeout=TIMEOUT), 6)
+
+            # it went straight to the handling hub, not through the proxy
+            self.assertEqual(client._direct_client.counter, direct + 1)
+            self.assertEqual(client._rpc_client.counter, proxied)
+
+            # the client learns of hubs that join later
+            other = self.create_hub([proxy.addr])
+
+            @other.accept_rpc('service2', 0, 0, 'method')
+            def handler(x):
+                return x * 3
+
+            peer = dialled(other._ident)
+            self.assertIsNot(peer, None)
+            self.assertEqual(client.rpc('service2', 0, 'method', (3,),
+                timeout=TIMEOUT), 9)
+            self.assertEqual(client._direct_client.counter, direct + 2)
+
+            # a lost direct connection is redialled
+            sock = peer.sock
+            sock.close()
+            for i in xrange(20):
+                if peer.sock is not sock and peer.up:
+                    break
+                backend.pause_for(TIMEOUT)
+
+            self.assertIs(client._direct_peers[other._ident], peer)
+            self.assertTrue(peer.up)
+            self.assertEqual(client.rpc('service2', 0, 'method', (3,),
+                timeout=TIMEOUT), 9)
+            self.assertEqual(client._direct_client.counter, direct + 3)
+
+            # RPCs that the proxy handles itself go through it
+            @proxy.accept_rpc('service3', 0, 0, 'method')
+            def handler(x):
+                return x * 4
+
+            backend.pause_for(TIMEOUT)
+
+            self.assertNotIn(proxy._ident, client._direct_peers)
+            self.assertEqual(client.rpc('service3', 0, 'method', (3,),
+                timeout=TIMEOUT), 12)
+            self.assertEqual(client._rpc_client.counter, proxied + 1)
+        finally:
+            client.shutdown()
+            proxy.shutdown()
+            listener.shutdown()
+            if other is not None:
+                other.shutdown()
+
+    def test_idempotent_broadcast_not_replayed(self):
+        other = self.create_hub([self.peer.addr])
+        proxies = [self.create_hub([self.peer.addr, other.addr]),
+                self.create_hub([self.peer.addr, other.addr])]
+        release = backend.Event()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return 'peer'
+
+        @other.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            release.wait()
+            return 'other'
+
+        client = junction.Client([p.addr for p in proxies], standbys=1)
+        client.connect()
+        client.wait_connected()
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            rpc = client.send_rpc('service', 0, 'method', (1,),
+                    broadcast=True, idempotent=True)
+
+            for i in xrange(20):
+                if rpc.partial_results:
+                    break
+                backend.pause_for(TIMEOUT)
+            self.assertEqual(rpc.partial_results, ['peer'])
+
+            # kill the primary hub connection out from under the client
+            client._peer.sock.close()
+
+            backend.pause_for(TIMEOUT)
+            release.set()
+
+            results = rpc.get(TIMEOUT)
+            self.assertEqual(len(results), 2)
+            self.assertEqual(results[0], 'peer')
+            self.assertIsInstance(results[1], junction.errors.LostConnection)
+        finally:
+            release.set()
+            client.shutdown()
+            for proxy in proxies:
+                proxy.shutdown()
+            other.shutdown()
+
 
 class RelayedClientTests(JunctionTests, GeventTestCase):
     def build_sender(self):
@@ -405,6 +1581,158 @@ class RelayedClientTests(JunctionTests, GeventTestCase):
         self.relayer.shutdown()
         super(RelayedClientTests, self).tearDown()
 
+    def test_aggregated_rpc(self):
+        other = self.create_hub([self.connection.addr])
+        other.wait_connected()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return [x]
+
+        @other.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return [x * 2]
+
+        self.connection.register_aggregator(
+                'concat', lambda acc, r: acc + r, [])
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            result = self.sender.rpc('service', 0, 'method', (3,),
+                    timeout=TIMEOUT, broadcast=True, aggregate='concat')
+            self.assertEqual(sorted(result), [3, 6])
+
+            self.assertRaises(junction.errors.RemoteException,
+                    self.sender.rpc, 'service', 0, 'method', (3,),
+                    timeout=TIMEOUT, broadcast=True, aggregate='missing')
+        finally:
+            other.shutdown()
+
+    def test_proxy_response_cache(self):
+        calls = []
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            calls.append(x)
+            return x * 2
+
+        self.relayer.cache_rpc('service', 'method', 60)
+
+        backend.pause_for(TIMEOUT)
+
+        for i in xrange(3):
+            self.assertEqual(self.sender.rpc('service', 0, 'method', (4,),
+                timeout=TIMEOUT), 8)
+        self.assertEqual(calls, [4])
+        self.assertEqual(self.relayer.cache_stats()[('service', 'method')],
+                {'hits': 2, 'misses': 1, 'size': 1})
+
+    def test_last_value_query(self):
+        @self.peer.accept_publish('service', 0, 0, 'price')
+        def handler(price):
+            pass
+
+        self.connection.keep_last_values('service', 'price')
+
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(self.sender.last_value('service', 0, 'price',
+            timeout=TIMEOUT), None)
+
+        self.sender.publish('service', 0, 'price', (10,), {'currency': 'x'})
+        backend.pause_for(TIMEOUT)
+
+        self.assertEqual(self.sender.last_value('service', 0, 'price',
+            timeout=TIMEOUT), ((10,), {'currency': 'x'}))
+
+    def test_proxy_forwards_packed_bodies(self):
+        results = []
+        forwarded = []
+        ev = backend.Event()
+
+        @self.peer.accept_publish('service', 0, 0, 'method')
+        def handler(x, y=None):
+            results.append((x, y))
+            ev.set()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x, y=None):
+            return (x, y)
+
+        dispatcher = self.relayer._dispatcher
+        send_publish = dispatcher.send_publish
+
+        def spy(client, service, routing_id, method, args, kwargs, *a, **kw):
+            forwarded.append((args, kwargs))
+            return send_publish(
+                    client, service, routing_id, method, args, kwargs, *a, **kw)
+        dispatcher.send_publish = spy
+
+        backend.pause_for(TIMEOUT)
+
+        self.sender.publish('service', 0, 'method', (1,), {'y': [2]})
+        ev.wait(TIMEOUT)
+
+        # the relaying hub only saw the body as opaque bytes
+        self.assertEqual(len(forwarded), 1)
+        self.assertIsInstance(forwarded[0][0], str)
+        self.assertIs(forwarded[0][1], None)
+        self.assertEqual(results, [(1, [2])])
+
+        self.assertEqual(self.sender.rpc('service', 0, 'method', (3,),
+            {'y': 4}, timeout=TIMEOUT), (3, 4))
+
+    def test_response_cache_shared_with_clients(self):
+        calls = []
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x, y=0):
+            calls.append(x)
+            return x + y
+
+        self.relayer.cache_rpc('service', 'method', 60)
+
+        backend.pause_for(TIMEOUT)
+
+        # the hub's own RPC and a client's packed one are the same request
+        self.assertEqual(self.relayer.rpc('service', 0, 'method', (4,),
+            {'y': 1}, timeout=TIMEOUT), 5)
+        self.assertEqual(self.sender.rpc('service', 0, 'method', (4,),
+            {'y': 1}, timeout=TIMEOUT), 5)
+        self.assertEqual(calls, [4])
+        self.assertEqual(self.relayer.cache_stats()[('service', 'method')],
+                {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_aggregated_rpc_errors(self):
+        other = self.create_hub([self.connection.addr])
+        other.wait_connected()
+
+        @self.peer.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            return [x]
+
+        @other.accept_rpc('service', 0, 0, 'method')
+        def handler(x):
+            raise ValueError(x)
+
+        self.connection.register_aggregator(
+                'concat', lambda acc, r: acc + r, [])
+
+        backend.pause_for(TIMEOUT)
+
+        try:
+            rpc = self.sender.send_rpc('service', 0, 'method', (3,),
+                    broadcast=True, aggregate='concat')
+            self.assertEqual(rpc.get(TIMEOUT), [3])
+
+            # the fold is partial, and the client can tell
+            self.assertEqual(len(rpc.errors), 1)
+            self.assertIsInstance(rpc.errors[0],
+                    junction.errors.RemoteException)
+        finally:
+            other.shutdown()
+
 
 class NetworklessDependentTests(GeventTestCase):
     def test_some_math(self):